@@ -0,0 +1,90 @@
+"""Provider -> active requests routing table used by the location fan-out."""
+import json
+import logging
+from typing import Any, AsyncIterable, Dict, Iterable, List, Optional
+
+from redis_swap import discard, staging_prefix, swap_in
+
+logger = logging.getLogger(__name__)
+
+
+def route_of(request: Dict[str, Any], status: Optional[str] = None) -> Dict[str, Any]:
+    """Fields of a service request the location fan-out needs (rooms, distance/ETA, geofence side)"""
+    return {
+        "request_id": request["id"],
+        "client_id": request["client_id"],
+        "status": status or request.get("status"),
+        "client_latitude": request["client_latitude"],
+        "client_longitude": request["client_longitude"],
+    }
+
+
+class ActiveRequestRoutes:
+    """Which requests each provider is currently serving, kept off Mongo.
+
+    Without Redis the table lives in this process. With Redis it is a hash per
+    provider (`<prefix>:<provider_id>`, request_id -> route JSON) so every worker sees
+    the accepts and completions handled by the others.
+    """
+
+    def __init__(self, active_statuses: Iterable[str], redis=None, prefix: str = "routes:active"):
+        self.active_statuses = set(active_statuses)
+        self.redis = redis
+        self.prefix = prefix
+        self._local: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def key(self, provider_id: str) -> str:
+        return f"{self.prefix}:{provider_id}"
+
+    async def add(self, provider_id: str, route: Dict[str, Any]):
+        if self.redis:
+            await self.redis.hset(self.key(provider_id), route["request_id"], json.dumps(route))
+        else:
+            self._local.setdefault(provider_id, {})[route["request_id"]] = route
+
+    async def remove(self, provider_id: str, request_id: str):
+        if self.redis:
+            await self.redis.hdel(self.key(provider_id), request_id)
+            return
+        routes = self._local.get(provider_id)
+        if routes is not None:
+            routes.pop(request_id, None)
+            if not routes:
+                del self._local[provider_id]
+
+    async def sync(self, request: Dict[str, Any], status: Optional[str] = None):
+        """Route or unroute a request after a status change (`status` overrides the stored one)"""
+        if not request.get("provider_id"):
+            return
+        if (status or request.get("status")) in self.active_statuses:
+            await self.add(request["provider_id"], route_of(request, status))
+        else:
+            await self.remove(request["provider_id"], request["id"])
+
+    async def for_provider(self, provider_id: str) -> List[Dict[str, Any]]:
+        if self.redis:
+            return [json.loads(raw) for raw in (await self.redis.hgetall(self.key(provider_id))).values()]
+        return list(self._local.get(provider_id, {}).values())
+
+    async def rebuild(self, requests: AsyncIterable[Dict[str, Any]]) -> int:
+        """Reload from the active requests in Mongo (startup).
+
+        With Redis the table is written under staging keys and swapped over the live
+        hashes atomically, so the other workers keep routing location pings meanwhile.
+        """
+        staging = ActiveRequestRoutes(self.active_statuses, self.redis,
+                                      staging_prefix(self.prefix) if self.redis else self.prefix)
+        total = 0
+        try:
+            async for request in requests:
+                await staging.sync(request)
+                total += 1
+            if self.redis:
+                await swap_in(self.redis, self.prefix, staging.prefix)
+        except BaseException:
+            if self.redis:
+                await discard(self.redis, staging.prefix)
+            raise
+        self._local = staging._local
+        logger.info("Active request routes rebuilt with %d requests", total)
+        return total
@@ -0,0 +1,158 @@
+"""Incremental analytics rollups built from the service request event stream."""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from geohash import region_of
+
+logger = logging.getLogger(__name__)
+
+REQUEST_EVENTS_CHANNEL = "service_request_events"
+COUNTED_TYPES = ("created", "accepted", "completed", "cancelled")
+
+
+class InMemoryEventBus:
+    """Local stand-in for Redis/Kafka: every subscriber gets its own bounded queue"""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._subscribers: List[Tuple[set, asyncio.Queue]] = []
+        self.dropped = 0
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        for channels, queue in self._subscribers:
+            if channel in channels:
+                try:
+                    queue.put_nowait((channel, message))
+                except asyncio.QueueFull:
+                    self.dropped += 1
+
+    async def listen(self, channels: Iterable[str]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        subscription = (set(channels), asyncio.Queue(maxsize=self.maxsize))
+        self._subscribers.append(subscription)
+        try:
+            while True:
+                yield await subscription[1].get()
+        finally:
+            self._subscribers.remove(subscription)
+
+
+async def redis_events(redis, channels: Iterable[str]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(*channels)
+    try:
+        async for message in pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            channel = message["channel"]
+            yield (channel.decode() if isinstance(channel, bytes) else channel), json.loads(message["data"])
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.close()
+
+
+async def kafka_events(bootstrap: str, topics: Iterable[str], group_id: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    from aiokafka import AIOKafkaConsumer
+
+    consumer = AIOKafkaConsumer(*topics, bootstrap_servers=bootstrap, group_id=group_id)
+    await consumer.start()
+    try:
+        async for record in consumer:
+            yield record.topic, json.loads(record.value)
+    finally:
+        await consumer.stop()
+
+
+class AnalyticsRollups:
+    """Per hour x category x region counters of request events plus completed revenue.
+
+    Each event id is first recorded in `applied` (unique `_id`, expired after
+    `dedupe_ttl_seconds`); a redelivered event (outbox retries, several
+    consumers on Redis pub/sub) hits the duplicate key and is not counted twice.
+    The rollup documents themselves only hold counters.
+    """
+
+    def __init__(self, collection, applied, dedupe_ttl_seconds: int = 7 * 86400):
+        self.collection = collection
+        self.applied = applied
+        self.dedupe_ttl_seconds = dedupe_ttl_seconds
+        self.stats = {"applied": 0, "duplicates": 0, "ignored": 0, "errors": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("hour", 1), ("category", 1), ("region", 1)])
+        await self.applied.create_index("applied_at", expireAfterSeconds=self.dedupe_ttl_seconds)
+
+    async def apply(self, event: Dict[str, Any]) -> bool:
+        kind = event.get("type")
+        event_id = event.get("event_id")
+        if kind not in COUNTED_TYPES or not event_id:
+            self.stats["ignored"] += 1
+            return False
+
+        at = datetime.fromisoformat(event["at"])
+        hour = at.replace(minute=0, second=0, microsecond=0)
+        region = region_of(event["client_latitude"], event["client_longitude"])
+        key = f"{hour:%Y%m%d%H}|{event['category']}|{region}"
+
+        inc: Dict[str, Any] = {kind: 1}
+        if kind == "completed":
+            inc["revenue"] = float(event.get("price") or 0.0)
+        try:
+            await self.applied.insert_one({"_id": event_id, "applied_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            self.stats["duplicates"] += 1
+            return False
+        try:
+            await self.collection.update_one(
+                {"_id": key},
+                {"$inc": inc, "$setOnInsert": {"hour": hour, "category": event["category"], "region": region}},
+                upsert=True,
+            )
+        except Exception:
+            # Libera o event_id para a reentrega contar o evento
+            await self.applied.delete_one({"_id": event_id})
+            raise
+        self.stats["applied"] += 1
+        return True
+
+    async def consume(self, source: AsyncIterator[Tuple[str, Dict[str, Any]]]):
+        async for _, event in source:
+            try:
+                await self.apply(event)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Could not apply analytics event {event.get('event_id')}: {e}")
+
+    async def query(
+        self,
+        category: Optional[str] = None,
+        region: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: int = 1000,
+    ) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {}
+        if category:
+            query["category"] = category
+        if region:
+            query["region"] = region
+        if start or end:
+            query["hour"] = {}
+            if start:
+                query["hour"]["$gte"] = start
+            if end:
+                query["hour"]["$lt"] = end
+        rows = []
+        async for doc in self.collection.find(query, {"_id": 0}).sort("hour", 1).limit(limit):
+            rows.append({
+                "hour": doc["hour"],
+                "category": doc["category"],
+                "region": doc["region"],
+                **{kind: doc.get(kind, 0) for kind in COUNTED_TYPES},
+                "revenue": round(doc.get("revenue", 0.0), 2),
+            })
+        return rows
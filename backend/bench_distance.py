@@ -0,0 +1,60 @@
+"""
+Microbenchmark: scalar calculate_distance loop vs the batched geo_kernel.
+
+    python bench_distance.py [sizes...]   (default: 1000 100000 1000000)
+"""
+import math
+import sys
+import time
+
+import numpy as np
+
+from geo_kernel import within_radius
+
+CENTER = (-23.5489, -46.6388)
+RADIUS_KM = 10.0
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    # Mesma fórmula escalar do server.py (sem importar o app)
+    lat1_rad, lat2_rad = math.radians(lat1), math.radians(lat2)
+    dlat = lat2_rad - lat1_rad
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
+    return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def main(sizes):
+    rng = np.random.default_rng(42)
+    print(f"{'points':>9} {'scalar ms':>10} {'kernel ms':>10} {'speedup':>8} {'matches':>8}")
+    for size in sizes:
+        # Prestadores espalhados num raio de ~100 km do centro de SP
+        lats = CENTER[0] + rng.uniform(-0.9, 0.9, size)
+        lons = CENTER[1] + rng.uniform(-0.9, 0.9, size)
+        lat_list, lon_list = lats.tolist(), lons.tolist()
+
+        def scalar():
+            return [i for i, (lat, lon) in enumerate(zip(lat_list, lon_list))
+                    if calculate_distance(CENTER[0], CENTER[1], lat, lon) <= RADIUS_KM]
+
+        def kernel():
+            return within_radius(CENTER[0], CENTER[1], lats, lons, RADIUS_KM)[0]
+
+        repeat = 3 if size <= 100_000 else 1
+        scalar_ms, expected = timed(scalar, repeat)
+        kernel_ms, found = timed(kernel, repeat * 3)
+        assert found.tolist() == expected
+        print(f"{size:>9} {scalar_ms:>10.2f} {kernel_ms:>10.2f} {scalar_ms / kernel_ms:>7.1f}x {len(found):>8}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1_000, 100_000, 1_000_000])
@@ -0,0 +1,170 @@
+"""
+Tail-latency harness: endpoint p50/p99 with slow or failing dependencies.
+
+Runs the real app in-process against mongomock / fakeredis and the stand-ins in
+latency_fakes.py (nothing external is needed) and prints one row per scenario
+and endpoint:
+
+    python bench_latency.py [scenarios...]   (default: all)
+    BENCH_OPS=400 BENCH_CONCURRENCY=32 python bench_latency.py slow_kafka
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+os.environ.setdefault("REDIS_URL", "redis://bench")
+os.environ.setdefault("KAFKA_BOOTSTRAP", "bench:9092")
+os.environ.setdefault("ANALYTICS_CONSUMER", "0")
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("GEOCODE_TIMEOUT_SECONDS", "1")
+
+import fakeredis.aioredis  # noqa: E402
+import httpx  # noqa: E402
+import mongomock_motor  # noqa: E402
+
+import server  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+from latency_fakes import (  # noqa: E402
+    FakeGeocoder, FakeKafkaProducer, LatencyDatabase, LatencyProfile, latency_redis
+)
+
+OPS = int(os.getenv("BENCH_OPS", "200"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "16"))
+CENTER = (-23.5489, -46.6388)
+
+
+def default_profiles() -> Dict[str, LatencyProfile]:
+    return {
+        "mongo": LatencyProfile(median_ms=1.0, spread=0.4, seed=1),
+        "redis": LatencyProfile(median_ms=0.3, spread=0.3, seed=2),
+        "kafka": LatencyProfile(median_ms=5.0, spread=0.5, seed=3),
+        "geocoder": LatencyProfile(median_ms=60.0, spread=0.4, seed=4),
+    }
+
+
+SCENARIOS: Dict[str, Dict[str, LatencyProfile]] = {
+    "baseline": {},
+    "slow_kafka": {"kafka": LatencyProfile(median_ms=400.0, spread=0.6, seed=3)},
+    "mongo_tail": {"mongo": LatencyProfile(median_ms=1.0, spread=1.5, seed=1)},
+    "flaky_redis": {"redis": LatencyProfile(median_ms=0.3, error_rate=0.2, seed=2)},
+    "hung_geocoder": {"geocoder": LatencyProfile(stall_rate=1.0, stall_seconds=3.0, seed=4)},
+}
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else float("nan")
+
+
+def install(profiles: Dict[str, LatencyProfile]):
+    """Point the app's module globals at the stand-ins (what startup would otherwise create)"""
+    server.client = mongomock_motor.AsyncMongoMockClient()
+    raw = server.client["bench"]
+    server.db = LatencyDatabase(raw, profiles["mongo"])
+    redis = latency_redis(fakeredis.aioredis.FakeRedis(), profiles["redis"])
+    server.aioredis.from_url = lambda url, **kwargs: redis
+    server.AIOKafkaProducer = lambda **config: FakeKafkaProducer(profiles["kafka"], **config)
+    # Sem broker: os consumidores do stream ficam ociosos no barramento local
+    server.kafka_events = lambda bootstrap, channels, group_id=None: server.local_events.listen(channels)
+    server.gmaps = FakeGeocoder(profiles["geocoder"])
+    server.geocode_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="geocode")
+    server.graceful.draining = False
+    return raw
+
+
+async def seed_users(raw, providers: int) -> Dict[str, Any]:
+    """Users straight into Mongo with minted tokens (no bcrypt in the measured path)"""
+    def user(name: str, user_type: int) -> Dict[str, str]:
+        doc = server.UserInDB(name=name, email=f"{name}@bench", phone="1", user_type=user_type,
+                              hashed_password="-").dict()
+        users.append(doc)
+        return {"id": doc["id"], "auth": f"Bearer {server.create_access_token({'sub': doc['id']})}"}
+
+    users: List[Dict[str, Any]] = []
+    seeded = {"client": user("client", 2), "providers": [user(f"provider{i}", 1) for i in range(providers)]}
+    await raw.users.insert_many(users)
+    return seeded
+
+
+async def measure(name: str, calls: List[Callable[[], Any]], results: Dict[str, List[float]], errors: Dict[str, int]):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(call):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await call()
+                if response.status_code >= 500:
+                    errors[name] = errors.get(name, 0) + 1
+            except Exception:
+                errors[name] = errors.get(name, 0) + 1
+            results.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one(call) for call in calls))
+
+
+async def run_scenario(overrides: Dict[str, LatencyProfile]) -> Dict[str, Any]:
+    profiles = {**default_profiles(), **overrides}
+    raw = install(profiles)
+    await server.startup_services()
+    transport = httpx.ASGITransport(app=server.app)
+    results: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    failed_before = sum(task["failed"] for task in server.background.metrics()["tasks"].values())
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as http:
+            users = await seed_users(raw, providers=max(OPS // 4, 1))
+            providers = users["providers"]
+
+            def profile_call(provider, i):
+                return lambda: http.post("/api/provider/profile", headers={"Authorization": provider["auth"]}, json={
+                    "category": "Encanador", "price": 80, "description": "Conserto de vazamentos",
+                    "latitude": CENTER[0] + i * 1e-4, "longitude": CENTER[1] + i * 1e-4})
+
+            await measure("POST /provider/profile", [profile_call(p, i) for i, p in enumerate(providers)], results, errors)
+
+            def request_call(i):
+                return lambda: http.post("/api/requests", headers={"Authorization": users["client"]["auth"]}, json={
+                    "provider_id": providers[i % len(providers)]["id"], "category": "Encanador",
+                    "description": "pia", "price": 80,
+                    "client_latitude": CENTER[0] + 0.01, "client_longitude": CENTER[1] + 0.01})
+
+            def location_call(i):
+                provider = providers[i % len(providers)]
+                return lambda: http.put("/api/provider/location", headers={"Authorization": provider["auth"]},
+                                        json={"latitude": CENTER[0] + i * 1e-5, "longitude": CENTER[1]})
+
+            def listing_call(i):
+                return lambda: http.get("/api/providers", headers={"Authorization": users["client"]["auth"]},
+                                        params={"available_only": "true", "radius_km": 5})
+
+            await measure("POST /requests", [request_call(i) for i in range(OPS)], results, errors)
+            await measure("PUT /provider/location", [location_call(i) for i in range(OPS)], results, errors)
+            await measure("GET /providers", [listing_call(i) for i in range(OPS)], results, errors)
+            # Efeitos pós-resposta (notificações, outbox, publishes) com o mesmo prazo do desligamento
+            started = time.perf_counter()
+            drained = await server.background.drain(timeout=server.graceful.grace_seconds)
+            drain_ms = (time.perf_counter() - started) * 1000
+            failed = sum(task["failed"] for task in server.background.metrics()["tasks"].values()) - failed_before
+    finally:
+        await server.shutdown_db_client()
+    return {"results": results, "errors": errors, "drain_ms": drain_ms, "drained": drained, "failed": failed,
+            "injected": {name: profile.stats for name, profile in profiles.items()}}
+
+
+async def main(names: List[str]):
+    # Um único event loop: filas e eventos do app ficam presos ao loop em que foram usados
+    print(f"{'scenario':<14} {'endpoint':<24} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>6}")
+    for name in names:
+        report = await run_scenario(SCENARIOS[name])
+        for endpoint, samples in report["results"].items():
+            ordered = sorted(samples)
+            print(f"{name:<14} {endpoint:<24} {percentile(ordered, 0.5):>8.1f} {percentile(ordered, 0.99):>8.1f} "
+                  f"{ordered[-1]:>8.1f} {report['errors'].get(endpoint, 0):>6}")
+        print(f"{name:<14} {'background drain':<24} {report['drain_ms']:>8.1f} "
+              f"{'' if report['drained'] else '(deadline hit)':>17} {report['failed']:>6}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:] or list(SCENARIOS)))
@@ -0,0 +1,207 @@
+"""Per-request chat between client and provider: group-committed message writes and keyset history."""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 2000
+
+
+class ChatBackpressure(Exception):
+    """Too many messages are waiting for the writer; the sender should retry"""
+
+
+def message_view(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-safe message for sockets and the history endpoint"""
+    return {
+        "id": str(doc["_id"]),
+        "request_id": doc["request_id"],
+        "sender_id": doc["sender_id"],
+        "sender_type": doc["sender_type"],
+        "text": doc["text"],
+        "client_msg_id": doc.get("client_msg_id"),
+        "created_at": doc["created_at"].isoformat(),
+    }
+
+
+class Throttle:
+    """At most one event per key every `interval` seconds (keys idle for longer are forgotten)"""
+
+    def __init__(self, interval: float, clock: Callable[[], float] = time.monotonic, max_keys: int = 100000):
+        self.interval = interval
+        self.clock = clock
+        self.max_keys = max_keys
+        self._last: Dict[Hashable, float] = {}
+        self.dropped = 0
+
+    def allow(self, key: Hashable) -> bool:
+        now = self.clock()
+        last = self._last.get(key)
+        if last is not None and now - last < self.interval:
+            self.dropped += 1
+            return False
+        if len(self._last) >= self.max_keys:
+            self._last = {k: t for k, t in self._last.items() if now - t < self.interval}
+        self._last[key] = now
+        return True
+
+
+class ChatStore:
+    """Messages of every request's chat in one collection, written in batches.
+
+    `append` queues a message and returns once the batch holding it is stored:
+    the writer flushes as soon as `batch_size` messages are waiting, otherwise
+    `flush_interval` after the first one, and messages arriving while a batch is
+    being written go into the next one, so a burst costs one `insert_many`
+    instead of a round trip per message. Ids are ObjectIds (ordered per worker),
+    which also key the history pages. Read receipts are coalesced per (request,
+    user) to the newest message and upserted with the next flush.
+    """
+
+    def __init__(self, messages, reads, batch_size: int = 500, flush_interval: float = 0.005,
+                 max_pending: int = 20000):
+        self.messages = messages
+        self.reads = reads
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._receipts: Dict[Tuple[str, str], ObjectId] = {}
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"messages": 0, "batches": 0, "failed": 0, "rejected": 0, "receipts": 0, "max_batch": 0}
+
+    async def ensure_indexes(self):
+        await self.messages.create_index([("request_id", 1), ("_id", -1)])
+
+    def new_message(self, request_id: str, sender_id: str, sender_type: int, text: str,
+                    client_msg_id: Optional[str] = None) -> Dict[str, Any]:
+        return {"_id": ObjectId(), "request_id": request_id, "sender_id": sender_id, "sender_type": sender_type,
+                "text": text, "client_msg_id": client_msg_id, "created_at": datetime.utcnow()}
+
+    async def append(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue `message` for the next batch and wait until it is stored"""
+        if len(self._pending) >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise ChatBackpressure("Chat writer is behind, try again")
+        stored = asyncio.get_running_loop().create_future()
+        self._pending.append((message, stored))
+        self._wakeup.set()
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        await stored
+        return message
+
+    async def mark_read(self, request_id: str, user_id: str, message_id: str) -> bool:
+        """Move the user's read watermark forward; False if the id is invalid, not newer or not in this chat"""
+        try:
+            position = ObjectId(message_id)
+        except (InvalidId, TypeError):
+            return False
+        key = (request_id, user_id)
+        current = self._receipts.get(key)
+        if current is not None and current >= position:
+            return False
+        if not await self.messages.find_one({"_id": position, "request_id": request_id}, {"_id": 1}):
+            return False
+        # Outro recibo pode ter avançado a marca durante a consulta
+        current = self._receipts.get(key)
+        if current is not None and current >= position:
+            return False
+        self._receipts[key] = position
+        self._wakeup.set()
+        return True
+
+    async def _write(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        try:
+            await self.messages.insert_many([message for message, _ in batch], ordered=False)
+        except asyncio.CancelledError:
+            for _, stored in batch:
+                stored.cancel()
+            raise
+        except Exception as e:
+            self.stats["failed"] += len(batch)
+            logger.warning(f"Could not store {len(batch)} chat messages: {e}")
+            for _, stored in batch:
+                if not stored.done():
+                    stored.set_exception(e)
+            return
+        self.stats["messages"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        for _, stored in batch:
+            if not stored.done():
+                stored.set_result(None)
+
+    async def flush(self):
+        pending, self._pending = self._pending, []
+        receipts, self._receipts = self._receipts, {}
+        self._full.clear()
+        for start in range(0, len(pending), self.batch_size):
+            await self._write(pending[start:start + self.batch_size])
+        if receipts:
+            now = datetime.utcnow()
+            try:
+                await self.reads.bulk_write([
+                    UpdateOne({"_id": f"{request_id}:{user_id}"},
+                              {"$max": {"last_read_id": position},
+                               "$set": {"request_id": request_id, "user_id": user_id, "updated_at": now}},
+                              upsert=True)
+                    for (request_id, user_id), position in receipts.items()
+                ], ordered=False)
+                self.stats["receipts"] += len(receipts)
+            except Exception as e:
+                logger.warning(f"Could not store {len(receipts)} chat read receipts: {e}")
+
+    async def history(self, request_id: str, before: Optional[str] = None,
+                      limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Newest-first page of a chat and the cursor (`before`) of the next, older page"""
+        query: Dict[str, Any] = {"request_id": request_id}
+        if before:
+            try:
+                query["_id"] = {"$lt": ObjectId(before)}
+            except (InvalidId, TypeError) as e:
+                raise ValueError(f"Invalid message cursor: {before!r}") from e
+        docs = await self.messages.find(query).sort("_id", -1).limit(limit + 1).to_list(None)
+        page = [message_view(doc) for doc in docs[:limit]]
+        return page, page[-1]["id"] if len(docs) > limit else None
+
+    async def read_state(self, request_id: str) -> Dict[str, str]:
+        """user_id -> id of the newest message that user has read"""
+        return {doc["user_id"]: str(doc["last_read_id"])
+                async for doc in self.reads.find({"request_id": request_id})}
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Chat writer error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
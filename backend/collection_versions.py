@@ -0,0 +1,91 @@
+"""Change counters used to build strong ETags for listing endpoints."""
+import hashlib
+import math
+import uuid
+from collections import defaultdict
+from typing import Iterable, List, Optional
+
+# Tamanho da célula (em graus) dos contadores de prestadores, ~11 km
+PROVIDER_CELL_DEGREES = 0.1
+# Acima disso a busca usa o contador global de prestadores
+MAX_CELLS_PER_QUERY = 400
+
+
+def provider_cell(latitude: float, longitude: float) -> str:
+    return f"{math.floor(latitude / PROVIDER_CELL_DEGREES)}:{math.floor(longitude / PROVIDER_CELL_DEGREES)}"
+
+
+def provider_cells_in_radius(latitude: float, longitude: float, radius_km: float) -> Optional[List[str]]:
+    """Cells covering the bounding box of a radius search, or None when there are too many"""
+    dlat = radius_km / 111.0
+    dlon = radius_km / max(111.0 * math.cos(math.radians(latitude)), 1e-6)
+    lat0, lat1 = math.floor((latitude - dlat) / PROVIDER_CELL_DEGREES), math.floor((latitude + dlat) / PROVIDER_CELL_DEGREES)
+    lon0, lon1 = math.floor((longitude - dlon) / PROVIDER_CELL_DEGREES), math.floor((longitude + dlon) / PROVIDER_CELL_DEGREES)
+    if (lat1 - lat0 + 1) * (lon1 - lon0 + 1) > MAX_CELLS_PER_QUERY:
+        return None
+    return [f"{i}:{j}" for i in range(lat0, lat1 + 1) for j in range(lon0, lon1 + 1)]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag (RFC 9110)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class CollectionVersions:
+    """Monotonic counters per scope (`providers`, `providers:cell:<cell>`, `requests:user:<id>`).
+
+    Every write path bumps the scopes it touches *after* the database write, so an
+    ETag derived from the counters read before a query can never describe newer data
+    than it was computed from. With Redis the counters are shared between workers;
+    otherwise they live in this process. The epoch is mixed into every ETag so a
+    counter reset (restart, Redis flush) can't make an old ETag match again.
+    """
+
+    def __init__(self, redis=None, prefix: str = "versions"):
+        self.redis = redis
+        self.prefix = prefix
+        self.epoch = uuid.uuid4().hex[:12]
+        self._local = defaultdict(int)
+
+    async def init(self):
+        if self.redis:
+            epoch_key = f"{self.prefix}:epoch"
+            await self.redis.set(epoch_key, self.epoch, nx=True)
+            epoch = await self.redis.get(epoch_key)
+            self.epoch = epoch.decode() if isinstance(epoch, bytes) else epoch
+
+    def _key(self, scope: str) -> str:
+        return f"{self.prefix}:{scope}"
+
+    async def bump(self, *scopes: str):
+        if self.redis:
+            pipe = self.redis.pipeline(transaction=False)
+            for scope in scopes:
+                pipe.incr(self._key(scope))
+            await pipe.execute()
+        else:
+            for scope in scopes:
+                self._local[scope] += 1
+
+    async def get(self, scopes: Iterable[str]) -> List[int]:
+        scopes = list(scopes)
+        if self.redis:
+            values = await self.redis.mget([self._key(scope) for scope in scopes])
+            return [int(v) if v is not None else 0 for v in values]
+        return [self._local.get(scope, 0) for scope in scopes]
+
+    async def etag(self, scopes: Iterable[str], variant: str = "") -> str:
+        scopes = list(scopes)
+        versions = await self.get(scopes)
+        digest = hashlib.sha1()
+        digest.update(self.epoch.encode())
+        for scope, version in zip(scopes, versions):
+            digest.update(f"|{scope}={version}".encode())
+        digest.update(f"|{variant}".encode())
+        return f'"{digest.hexdigest()}"'
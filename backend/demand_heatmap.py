@@ -0,0 +1,192 @@
+"""Incremental demand heatmap: pending and recent service requests per geohash cell."""
+import logging
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from geohash import center, encode
+
+logger = logging.getLogger(__name__)
+
+# Precisão 6: células de ~1,2 x 0,6 km
+HEATMAP_PRECISION = 6
+
+CellKey = Tuple[str, str]  # (geohash, categoria)
+
+
+def _timestamp(value: Any) -> float:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        # Datas do app são UTC "naive"
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+    return float(value)
+
+
+class _Bucket:
+    __slots__ = ("index", "counts", "request_ids")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.counts: Counter = Counter()
+        self.request_ids: List[str] = []
+
+
+class DemandHeatmap:
+    """Counts per (cell, category) of requests still PENDING and of requests created in sliding windows.
+
+    Arrivals go into time buckets of `bucket_seconds`; every window keeps a running
+    total per cell plus a pointer to its oldest bucket, and advancing the clock
+    subtracts only the buckets that just fell out of each window. Updates and expiry
+    therefore cost O(cells touched); queries scan the active cells only. Request ids
+    are remembered while they matter, so redelivered events are not counted twice.
+    `on_change(key)` is called for every (cell, category) whose counts moved.
+    """
+
+    def __init__(self, windows: Sequence[int] = (900, 3600), bucket_seconds: int = 60,
+                 precision: int = HEATMAP_PRECISION, clock: Callable[[], float] = time.time,
+                 on_change: Optional[Callable[[CellKey], None]] = None):
+        self.windows = tuple(sorted(windows))
+        self.bucket_seconds = bucket_seconds
+        self.precision = precision
+        self.clock = clock
+        self.on_change = on_change
+        self._buckets: Deque[_Bucket] = deque()
+        self._expired = {window: 0 for window in self.windows}  # buckets já subtraídos por janela
+        self._recent: Dict[int, Counter] = {window: Counter() for window in self.windows}
+        self._pending: Counter = Counter()
+        # request_id -> (célula, ainda pendente?, índice do bucket ou None)
+        self._requests: Dict[str, Tuple[CellKey, bool, Optional[int]]] = {}
+        self._centers: Dict[str, Tuple[float, float]] = {}
+
+    def _expire(self, now: float):
+        current = int(now // self.bucket_seconds)
+        for window in self.windows:
+            oldest_kept = current - window // self.bucket_seconds
+            totals, position = self._recent[window], self._expired[window]
+            while position < len(self._buckets) and self._buckets[position].index <= oldest_kept:
+                totals.subtract(self._buckets[position].counts)
+                for key in self._buckets[position].counts:
+                    if totals[key] <= 0:
+                        del totals[key]
+                    if self.on_change:
+                        self.on_change(key)
+                position += 1
+            self._expired[window] = position
+        # Bucket fora de todas as janelas sai da fila
+        while self._buckets and self._expired[self.windows[-1]] > 0:
+            bucket = self._buckets.popleft()
+            for window in self.windows:
+                self._expired[window] -= 1
+            for request_id in bucket.request_ids:
+                entry = self._requests.get(request_id)
+                if entry and not entry[1]:
+                    del self._requests[request_id]
+
+    def advance(self):
+        """Expire the buckets that left the windows (queries and updates also do it)"""
+        self._expire(self.clock())
+
+    def count(self, key: CellKey, window: Optional[int] = None) -> Tuple[int, int]:
+        """(pending, created within `window`) of one (cell, category)"""
+        return self._pending.get(key, 0), self._recent[window or self.windows[0]].get(key, 0)
+
+    def record(self, request_id: str, latitude: float, longitude: float, category: str,
+               created_at: Any = None, pending: bool = True):
+        """A new request (or one loaded at startup); duplicates are ignored"""
+        if request_id in self._requests:
+            return
+        now = self.clock()
+        self._expire(now)
+        key = (encode(latitude, longitude, self.precision), category)
+        if pending:
+            self._pending[key] += 1
+        self._requests[request_id] = (key, pending, None)
+
+        at = min(_timestamp(created_at), now) if created_at is not None else now
+        index = int(at // self.bucket_seconds)
+        if index <= int(now // self.bucket_seconds) - self.windows[-1] // self.bucket_seconds:
+            if not pending:
+                del self._requests[request_id]
+            elif self.on_change:
+                self.on_change(key)
+            return  # velho demais para qualquer janela
+        last = self._buckets[-1] if self._buckets else None
+        if last is None or index > last.index or self._expired[self.windows[0]] == len(self._buckets):
+            # Atrasados entram no bucket mais novo (nunca num bucket já expirado)
+            bucket = _Bucket(max(index, last.index + 1) if last else index)
+            self._buckets.append(bucket)
+        else:
+            bucket = last
+        bucket.counts[key] += 1
+        bucket.request_ids.append(request_id)
+        self._requests[request_id] = (key, pending, bucket.index)
+        for window in self.windows:
+            self._recent[window][key] += 1
+        if self.on_change:
+            self.on_change(key)
+
+    def resolve(self, request_id: str):
+        """The request left PENDING (accepted, cancelled...): it stops counting as pending"""
+        entry = self._requests.get(request_id)
+        if not entry or not entry[1]:
+            return
+        key, _, bucket_index = entry
+        self._pending[key] -= 1
+        if self._pending[key] <= 0:
+            del self._pending[key]
+        if bucket_index is None or not self._buckets or bucket_index < self._buckets[0].index:
+            del self._requests[request_id]  # já fora das janelas: não precisa mais de dedup
+        else:
+            self._requests[request_id] = (key, False, bucket_index)
+        if self.on_change:
+            self.on_change(key)
+
+    def apply(self, event: Dict[str, Any]):
+        """Request lifecycle event from the outbox stream"""
+        kind, request_id = event.get("type"), event.get("request_id")
+        if not request_id:
+            return
+        if kind == "created":
+            self.record(request_id, event["client_latitude"], event["client_longitude"],
+                        event["category"], event.get("at"))
+        elif event.get("status") != "pending":
+            self.resolve(request_id)
+
+    async def consume(self, source: AsyncIterator[Tuple[str, Dict[str, Any]]]):
+        async for _, event in source:
+            try:
+                self.apply(event)
+            except Exception as e:
+                logger.warning(f"Could not apply heatmap event {event.get('event_id')}: {e}")
+
+    def _center(self, cell: str) -> Tuple[float, float]:
+        point = self._centers.get(cell)
+        if point is None:
+            if len(self._centers) > 100000:
+                self._centers.clear()
+            point = self._centers[cell] = center(cell)
+        return point
+
+    def cells(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+              window: Optional[int] = None, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Cells whose center is inside the bbox, with pending and recent (within `window`) counts"""
+        window = window or self.windows[0]
+        if window not in self._recent:
+            raise ValueError(f"window must be one of {list(self.windows)}")
+        self._expire(self.clock())
+        recent = self._recent[window]
+        merged: Dict[str, List[int]] = {}
+        for source, column in ((self._pending, 0), (recent, 1)):
+            for (cell, cell_category), count in source.items():
+                if category and cell_category != category:
+                    continue
+                merged.setdefault(cell, [0, 0])[column] += count
+        rows = []
+        for cell, (pending, created) in merged.items():
+            lat, lon = self._center(cell)
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                rows.append({"cell": cell, "latitude": lat, "longitude": lon, "pending": pending, "recent": created})
+        rows.sort(key=lambda row: (row["pending"] + row["recent"]), reverse=True)
+        return rows
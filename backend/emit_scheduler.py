@@ -0,0 +1,115 @@
+"""Per-tick coalescing of high-frequency Socket.IO emits."""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BATCH_EVENT = "batch"
+
+# emit(event, data, room)
+Emit = Callable[[str, Any, str], Awaitable[Any]]
+# on_empty([(room, event, data, key)]): mensagens de salas sem membros no flush (key None se não tinha)
+OnEmpty = Callable[[List[Tuple[str, str, Any, Optional[Hashable]]]], Awaitable[Any]]
+
+_UNKEYED = object()
+
+
+class EmitScheduler:
+    """Collects messages per room and sends them once per tick.
+
+    A message queued with a `key` replaces the pending one with the same event and
+    key in that room (only the newest location of a request matters). Messages for
+    rooms without members are dropped at flush time, or handed to `on_empty` in one
+    call per flush (to be held for offline recipients). A room with a single pending
+    message gets it as a plain event; several messages go out as one `batch` event
+    carrying `[{"event": ..., "data": ...}, ...]` in queue order.
+    """
+
+    def __init__(self, emit: Emit, has_members: Callable[[str], bool], tick: float = 0.1,
+                 on_empty: Optional[OnEmpty] = None):
+        self.emit = emit
+        self.has_members = has_members
+        self.on_empty = on_empty
+        self.tick = tick
+        # room -> {(event, key ou contador): data}; dict preserva a ordem de chegada
+        self._pending: Dict[str, Dict[Tuple[str, Hashable], Any]] = {}
+        self._sequence = 0
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"queued": 0, "superseded": 0, "empty_rooms": 0, "packets": 0, "messages": 0, "errors": 0,
+                      "held": 0}
+
+    def queue(self, event: str, data: Any, room: str, key: Optional[Hashable] = None):
+        if key is None:
+            self._sequence += 1
+            key = (_UNKEYED, self._sequence)
+        messages = self._pending.setdefault(room, {})
+        slot = (event, key)
+        if slot in messages:
+            # Mantém a posição original e troca pelo payload mais novo
+            self.stats["superseded"] += 1
+        messages[slot] = data
+        self.stats["queued"] += 1
+
+    def pending(self) -> int:
+        return sum(len(messages) for messages in self._pending.values())
+
+    async def _send(self, room: str, messages: List[Tuple[str, Any]]):
+        try:
+            if len(messages) == 1:
+                await self.emit(messages[0][0], messages[0][1], room)
+            else:
+                await self.emit(BATCH_EVENT, [{"event": event, "data": data} for event, data in messages], room)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Coalesced emit to {room} failed: {e}")
+
+    async def flush(self) -> int:
+        """Send everything pending now; returns the number of packets sent"""
+        pending, self._pending = self._pending, {}
+        sends, undelivered = [], []
+        for room, messages in pending.items():
+            if not self.has_members(room):
+                self.stats["empty_rooms"] += 1
+                undelivered.extend(
+                    (room, event, data, None if isinstance(key, tuple) and key[0] is _UNKEYED else key)
+                    for (event, key), data in messages.items()
+                )
+                continue
+            batch = [(event, data) for (event, _), data in messages.items()]
+            self.stats["messages"] += len(batch)
+            sends.append(self._send(room, batch))
+        if sends:
+            await asyncio.gather(*sends)
+        self.stats["packets"] += len(sends)
+        if undelivered and self.on_empty:
+            try:
+                await self.on_empty(undelivered)
+                self.stats["held"] += len(undelivered)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Could not hold {len(undelivered)} emits for empty rooms: {e}")
+        return len(sends)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Emit scheduler error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, flush: bool = True):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if flush:
+            await self.flush()
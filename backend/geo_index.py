@@ -0,0 +1,122 @@
+"""Redis GEO hot set of AVAILABLE providers, one sorted set per category."""
+import logging
+from typing import Any, AsyncIterable, Dict, List, Optional, Tuple
+
+from redis_swap import discard, staging_prefix, swap_in
+
+logger = logging.getLogger(__name__)
+
+# Limites aceitos pelo GEOADD do Redis
+MAX_GEO_LATITUDE = 85.05112878
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class ProviderGeoIndex:
+    """Keeps `<prefix>:<category>` GEO sets with the user_id of every available provider.
+
+    A hash `<prefix>:members` maps user_id -> category so a provider can be removed
+    (socket disconnect, status change) without knowing its category, and a set
+    `<prefix>:categories` lists the categories currently populated.
+    """
+
+    def __init__(self, redis, prefix: str = "providers:available"):
+        self.redis = redis
+        self.prefix = prefix
+        self.members_key = f"{prefix}:members"
+        self.categories_key = f"{prefix}:categories"
+
+    def key(self, category: str) -> str:
+        return f"{self.prefix}:{category}"
+
+    async def add(self, user_id: str, category: str, latitude: float, longitude: float):
+        if abs(latitude) > MAX_GEO_LATITUDE or abs(longitude) > 180:
+            await self.remove(user_id)
+            return
+        previous = _decode(await self.redis.hget(self.members_key, user_id))
+        pipe = self.redis.pipeline(transaction=True)
+        if previous and previous != category:
+            pipe.zrem(self.key(previous), user_id)
+        pipe.geoadd(self.key(category), [longitude, latitude, user_id])
+        pipe.hset(self.members_key, user_id, category)
+        pipe.sadd(self.categories_key, category)
+        await pipe.execute()
+
+    async def remove(self, user_id: str):
+        category = _decode(await self.redis.hget(self.members_key, user_id))
+        if not category:
+            return
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zrem(self.key(category), user_id)
+        pipe.hdel(self.members_key, user_id)
+        await pipe.execute()
+
+    async def sync(self, profile: Dict[str, Any]):
+        """Add or remove a provider according to its profile status"""
+        if profile.get("status") == "available" and profile.get("latitude") is not None:
+            await self.add(profile["user_id"], profile["category"], profile["latitude"], profile["longitude"])
+        else:
+            await self.remove(profile["user_id"])
+
+    async def categories(self) -> List[str]:
+        return sorted(_decode(c) for c in await self.redis.smembers(self.categories_key))
+
+    async def search(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_km: float,
+        category: Optional[str] = None,
+        count: Optional[int] = None,
+    ) -> List[Tuple[str, float]]:
+        """Return (user_id, distance_km) pairs sorted by distance"""
+        categories = [category] if category else await self.categories()
+        found: List[Tuple[str, float]] = []
+        for cat in categories:
+            rows = await self.redis.geosearch(
+                self.key(cat),
+                longitude=longitude,
+                latitude=latitude,
+                radius=radius_km,
+                unit="km",
+                withdist=True,
+                sort="ASC",
+                count=count,
+            )
+            found.extend((_decode(member), float(dist)) for member, dist in rows)
+        found.sort(key=lambda item: item[1])
+        return found[:count] if count else found
+
+    async def rebuild(self, profiles: AsyncIterable[Dict[str, Any]]) -> int:
+        """Reload the hot set from the AVAILABLE profiles in Mongo.
+
+        The new set is written under a staging prefix and swapped over the live keys
+        atomically, so other workers keep matching against the old set meanwhile.
+        """
+        staging = ProviderGeoIndex(self.redis, staging_prefix(self.prefix))
+        try:
+            total = await staging._load(profiles)
+            await swap_in(self.redis, self.prefix, staging.prefix)
+        except BaseException:
+            await discard(self.redis, staging.prefix)
+            raise
+        logger.info("Provider geo index rebuilt with %d available providers", total)
+        return total
+
+    async def _load(self, profiles: AsyncIterable[Dict[str, Any]]) -> int:
+        total = 0
+        pipe = self.redis.pipeline(transaction=False)
+        async for profile in profiles:
+            lat, lon = profile.get("latitude"), profile.get("longitude")
+            if lat is None or lon is None or abs(lat) > MAX_GEO_LATITUDE or abs(lon) > 180:
+                continue
+            pipe.geoadd(self.key(profile["category"]), [lon, lat, profile["user_id"]])
+            pipe.hset(self.members_key, profile["user_id"], profile["category"])
+            pipe.sadd(self.categories_key, profile["category"])
+            total += 1
+            if total % 1000 == 0:
+                await pipe.execute()
+        await pipe.execute()
+        return total
@@ -0,0 +1,78 @@
+"""Batched distance/bearing kernels over NumPy coordinate columns."""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.0
+
+
+def coordinate_columns(points: Sequence[Dict[str, Any]], lat_field: str = "latitude",
+                       lon_field: str = "longitude") -> Tuple[np.ndarray, np.ndarray]:
+    """Latitude/longitude columns (float64) out of a list of documents"""
+    count = len(points)
+    lats = np.fromiter((p[lat_field] for p in points), dtype=np.float64, count=count)
+    lons = np.fromiter((p[lon_field] for p in points), dtype=np.float64, count=count)
+    return lats, lons
+
+
+def bounding_box_mask(latitude: float, longitude: float, lats: np.ndarray, lons: np.ndarray,
+                      radius_km: float) -> np.ndarray:
+    """Cheap superset of the points within `radius_km` (no trigonometry per point)"""
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    mask = np.abs(lats - latitude) <= dlat
+    cos_lat = np.cos(np.radians(min(abs(latitude) + dlat, 90.0)))
+    if cos_lat > 1e-6:
+        dlon = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+        if dlon < 180.0:
+            delta = np.abs(lons - longitude)
+            if abs(longitude) + dlon > 180.0:
+                # Caixa cruza o antimeridiano: mede a diferença "dando a volta"
+                delta = np.minimum(delta, 360.0 - delta)
+            mask &= delta <= dlon
+    return mask
+
+
+def haversine_km(latitude: float, longitude: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    lat1, lat2 = np.radians(latitude), np.radians(lats)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin(np.radians(lons - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def bearing_deg(latitude: float, longitude: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Initial bearing (0-360, clockwise from north) from the origin to each point"""
+    lat1, lat2 = np.radians(latitude), np.radians(lats)
+    dlon = np.radians(lons - longitude)
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(x, y)) + 360.0) % 360.0
+
+
+def within_radius(latitude: float, longitude: float, lats: np.ndarray, lons: np.ndarray,
+                  radius_km: Optional[float] = None, nearest_first: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """(indices, distances_km) of the points within `radius_km` (all points when None).
+
+    The bounding box drops far points before the exact haversine runs on the rest.
+    """
+    indices = np.arange(len(lats))
+    if radius_km is not None:
+        indices = np.flatnonzero(bounding_box_mask(latitude, longitude, lats, lons, radius_km))
+        lats, lons = lats[indices], lons[indices]
+    distances = haversine_km(latitude, longitude, lats, lons)
+    if radius_km is not None:
+        inside = distances <= radius_km
+        indices, distances = indices[inside], distances[inside]
+    if nearest_first:
+        order = np.argsort(distances, kind="stable")
+        indices, distances = indices[order], distances[order]
+    return indices, distances
+
+
+def with_distances(latitude: float, longitude: float, points: List[Dict[str, Any]],
+                   radius_km: Optional[float] = None, nearest_first: bool = False) -> List[Dict[str, Any]]:
+    """Copies of the documents within `radius_km`, each with its `distance` in km"""
+    if not points:
+        return []
+    indices, distances = within_radius(latitude, longitude, *coordinate_columns(points), radius_km, nearest_first)
+    return [{**points[i], "distance": float(d)} for i, d in zip(indices.tolist(), distances.tolist())]
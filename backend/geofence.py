@@ -0,0 +1,53 @@
+"""Geofence around each active request's client, with hysteresis between entering and leaving."""
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+
+
+class Geofence:
+    """Decides NEAR_CLIENT transitions from provider -> client distances.
+
+    A request in one of `approach_statuses` enters the fence at `enter_radius_km` and
+    only leaves it beyond `exit_radius_km`, so GPS jitter around the border does not
+    flap the status. On leaving, the request goes back to the status it had before
+    entering. The current side of the fence comes from the route's `status`, so the
+    engine itself keeps no per-request state besides transitions still being written.
+    """
+
+    def __init__(self, enter_radius_km: float = 0.2, exit_radius_km: float = 0.3,
+                 near_status: str = "near_client", approach_statuses: Sequence[str] = ("accepted", "in_progress")):
+        if exit_radius_km < enter_radius_km:
+            raise ValueError("exit radius must not be smaller than the enter radius")
+        self.enter_radius_km = enter_radius_km
+        self.exit_radius_km = exit_radius_km
+        self.near_status = near_status
+        self.approach_statuses = tuple(approach_statuses)
+        self._resume: Dict[str, str] = {}
+        self._in_flight: Set[str] = set()
+        self.stats = {"checked": 0, "entered": 0, "left": 0}
+
+    def evaluate(self, routes: Iterable[Dict[str, Any]], distances: Iterable[float]) -> List[Tuple[Dict[str, Any], str]]:
+        """(route, new_status) for every request that crossed the fence; call `settle` once written"""
+        transitions = []
+        for route, distance in zip(routes, distances):
+            self.stats["checked"] += 1
+            request_id, status = route["request_id"], route.get("status")
+            if request_id in self._in_flight:
+                continue
+            if status in self.approach_statuses and distance <= self.enter_radius_km:
+                self._resume[request_id] = status
+                transitions.append((route, self.near_status))
+                self.stats["entered"] += 1
+            elif status == self.near_status and distance > self.exit_radius_km:
+                transitions.append((route, self._resume.pop(request_id, self.approach_statuses[0])))
+                self.stats["left"] += 1
+            else:
+                continue
+            self._in_flight.add(request_id)
+        return transitions
+
+    def settle(self, request_id: str):
+        self._in_flight.discard(request_id)
+
+    def forget(self, request_id: str):
+        """The request left the active statuses (completed, cancelled...)"""
+        self._resume.pop(request_id, None)
+        self._in_flight.discard(request_id)
@@ -0,0 +1,81 @@
+"""Minimal geohash encoding used to bucket coordinates into regions/cells."""
+from typing import List, Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {c: i for i, c in enumerate(_BASE32)}
+
+# Precisão 4: células de ~39 x 20 km, usadas como "região" em analytics e rankings
+REGION_PRECISION = 4
+
+
+def encode(latitude: float, longitude: float, precision: int = 5) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bit, ch, even = 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[ch])
+            bit, ch = 0, 0
+    return "".join(chars)
+
+
+def region_of(latitude: float, longitude: float) -> str:
+    return encode(latitude, longitude, REGION_PRECISION)
+
+
+def bounds(cell: str) -> Tuple[float, float, float, float]:
+    """(min_lat, min_lon, max_lat, max_lon) of a geohash cell"""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for c in cell:
+        bits = _DECODE[c]
+        for shift in range(4, -1, -1):
+            bit = (bits >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+
+def center(cell: str) -> Tuple[float, float]:
+    lat_lo, lon_lo, lat_hi, lon_hi = bounds(cell)
+    return (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2
+
+
+def cells_in_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                  precision: int, limit: int = 10000) -> List[str]:
+    """Cells of the given precision covering a bounding box (raises ValueError above `limit`)"""
+    lat_lo, lon_lo, lat_hi, lon_hi = bounds(encode(min_lat, min_lon, precision))
+    dlat, dlon = lat_hi - lat_lo, lon_hi - lon_lo
+    rows = int((max_lat - lat_lo) // dlat) + 1
+    cols = int((max_lon - lon_lo) // dlon) + 1
+    if rows * cols > limit:
+        raise ValueError("bounding box covers too many cells")
+    return [
+        encode(min(lat_lo + (i + 0.5) * dlat, 89.999999), min(lon_lo + (j + 0.5) * dlon, 179.999999), precision)
+        for i in range(rows) for j in range(cols)
+    ]
@@ -0,0 +1,133 @@
+"""Idempotency-Key support: the first request with a key runs, retries replay its stored response."""
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used with a different payload"""
+
+
+class IdempotencyInProgress(Exception):
+    """Another request with the key is still running after the wait deadline"""
+
+
+def fingerprint(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Responses per (scope, user, key) in a Mongo collection that expires after `ttl_seconds`.
+
+    The first request inserts a `pending` document and runs; retries with the same
+    key get the stored response instead. A retry that arrives while the first one
+    is still running waits for it: on an in-process future when both hit the same
+    worker, polling the document otherwise. If the first attempt fails the key is
+    released so a retry can redo the work; if its worker dies, the lease expires
+    and the next retry takes over.
+    """
+
+    def __init__(self, collection, ttl_seconds: int = 86400, lease_seconds: float = 30.0,
+                 wait_timeout: float = 10.0, poll_interval: float = 0.05):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.lease = timedelta(seconds=lease_seconds)
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"executed": 0, "replayed": 0, "waited": 0, "conflicts": 0, "released": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    async def _claim(self, doc_id: str, digest: str) -> bool:
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "_id": doc_id, "fingerprint": digest, "state": "pending",
+                "created_at": now, "lease_until": now + self.lease
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def _take_over(self, doc_id: str) -> bool:
+        now = datetime.utcnow()
+        result = await self.collection.update_one(
+            {"_id": doc_id, "state": "pending", "lease_until": {"$lt": now}},
+            {"$set": {"lease_until": now + self.lease}}
+        )
+        return result.modified_count == 1
+
+    async def _execute(self, doc_id: str, handler: Callable[[], Awaitable[Any]],
+                       encode: Callable[[Any], Any]) -> Any:
+        done = self._inflight[doc_id] = asyncio.get_running_loop().create_future()
+        try:
+            try:
+                result = await handler()
+            except BaseException:
+                # Falhou: libera a chave para a próxima tentativa refazer
+                await self.collection.delete_one({"_id": doc_id, "state": "pending"})
+                self.stats["released"] += 1
+                raise
+            try:
+                await self.collection.update_one(
+                    {"_id": doc_id},
+                    {"$set": {"state": "done", "response": encode(result), "completed_at": datetime.utcnow()}}
+                )
+            except Exception as e:
+                # Resposta não gravada: a chave fica pendente até o lease expirar
+                logger.warning(f"Could not store idempotent response {doc_id}: {e}")
+            self.stats["executed"] += 1
+            return result
+        finally:
+            self._inflight.pop(doc_id, None)
+            done.set_result(None)
+
+    async def _wait(self, doc_id: str, timeout: float, delay: float) -> float:
+        """Wait for the owner (future if local, sleep otherwise); returns the next poll delay"""
+        self.stats["waited"] += 1
+        local = self._inflight.get(doc_id)
+        if local is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(local), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return delay
+        await asyncio.sleep(min(delay, timeout))
+        return min(delay * 2, 0.5)
+
+    async def run(self, scope: str, user_id: str, key: str, payload: Any,
+                  handler: Callable[[], Awaitable[Any]], encode: Callable[[Any], Any] = lambda value: value
+                  ) -> Tuple[Any, bool]:
+        """(result, replayed): `handler()`'s result, or the stored `encode(result)` of an earlier run"""
+        doc_id, digest = f"{scope}:{user_id}:{key}", fingerprint(payload)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        delay = self.poll_interval
+        while True:
+            if await self._claim(doc_id, digest):
+                return await self._execute(doc_id, handler, encode), False
+            stored = await self.collection.find_one({"_id": doc_id})
+            if stored is None:
+                continue  # o dono falhou e liberou a chave
+            if stored["fingerprint"] != digest:
+                self.stats["conflicts"] += 1
+                raise IdempotencyConflict("Idempotency-Key was already used with a different payload")
+            if stored["state"] == "done":
+                self.stats["replayed"] += 1
+                return stored["response"], True
+            if stored["lease_until"] < datetime.utcnow() and await self._take_over(doc_id):
+                logger.warning(f"Taking over expired idempotency lease {doc_id}")
+                return await self._execute(doc_id, handler, encode), False
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+            delay = await self._wait(doc_id, remaining, delay)
@@ -0,0 +1,157 @@
+"""Local stand-ins for Mongo, Redis, Kafka and the geocoder with injected latency, errors and stalls."""
+import asyncio
+import functools
+import inspect
+import math
+import random
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+# Métodos do Motor que devolvem cursores (a latência entra no to_list / iteração)
+CURSOR_METHODS = frozenset({"find", "aggregate", "list_indexes", "sort", "limit", "skip", "batch_size"})
+
+
+class LatencyProfile:
+    """Latency distribution for one dependency: log-normal around `median_ms`.
+
+    `spread` is the sigma of the log-normal (0 gives a fixed latency). A call
+    stalls for `stall_seconds` with probability `stall_rate` (a hung socket, to
+    exercise timeouts) and fails with `error` with probability `error_rate` after
+    its delay. `wait()` is for async clients, `block()` for sync ones run in threads.
+    """
+
+    def __init__(self, median_ms: float = 1.0, spread: float = 0.5, error_rate: float = 0.0,
+                 stall_rate: float = 0.0, stall_seconds: float = 30.0,
+                 error: Type[Exception] = ConnectionError, seed: Optional[int] = None):
+        self.median_ms = median_ms
+        self.spread = spread
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.error = error
+        self.rng = random.Random(seed)
+        self.stats = {"calls": 0, "errors": 0, "stalls": 0}
+
+    def delay(self) -> float:
+        self.stats["calls"] += 1
+        if self.stall_rate and self.rng.random() < self.stall_rate:
+            self.stats["stalls"] += 1
+            return self.stall_seconds
+        return self.median_ms / 1000 * math.exp(self.spread * self.rng.gauss(0, 1))
+
+    def _maybe_fail(self, operation: str):
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise self.error(f"injected failure in {operation}")
+
+    async def wait(self, operation: str = ""):
+        await asyncio.sleep(self.delay())
+        self._maybe_fail(operation)
+
+    def block(self, operation: str = ""):
+        time.sleep(self.delay())
+        self._maybe_fail(operation)
+
+
+class LatencyProxy:
+    """Wraps a client so every call that returns a coroutine waits on `profile` first.
+
+    Attributes named in `chained` (cursors, pipelines, collections) are wrapped
+    again, so `db.users.find().sort(...).to_list(...)` pays the latency once, on the
+    call that actually does I/O. Async iteration pays it once per cursor.
+    """
+
+    def __init__(self, target: Any, profile: LatencyProfile, chained: Iterable[str] = ()):
+        self._target = target
+        self._profile = profile
+        self._chained = frozenset(chained)
+
+    def _wrap(self, value: Any) -> "LatencyProxy":
+        return LatencyProxy(value, self._profile, self._chained)
+
+    async def _delayed(self, operation: str, coroutine):
+        try:
+            await self._profile.wait(operation)
+        except BaseException:
+            coroutine.close()
+            raise
+        return await coroutine
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if name in self._chained:
+            if callable(attr):
+                return functools.wraps(attr)(lambda *args, **kwargs: self._wrap(attr(*args, **kwargs)))
+            return self._wrap(attr)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return self._delayed(name, result) if inspect.iscoroutine(result) else result
+        return call
+
+    def __getitem__(self, name: str):
+        return self._wrap(self._target[name])
+
+    async def __aiter__(self):
+        await self._profile.wait("iterate")
+        async for item in self._target:
+            yield item
+
+
+class LatencyDatabase(LatencyProxy):
+    """Motor database whose collections (attribute or item access) inject latency"""
+
+    def __init__(self, database: Any, profile: LatencyProfile):
+        super().__init__(database, profile, CURSOR_METHODS)
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if callable(attr) and not hasattr(attr, "find_one"):
+            return super().__getattr__(name)  # command(), list_collection_names()...
+        return self._wrap(attr)
+
+
+def latency_redis(redis: Any, profile: LatencyProfile) -> LatencyProxy:
+    """redis.asyncio client (e.g. fakeredis) with latency on every command and pipeline execute"""
+    return LatencyProxy(redis, profile, chained={"pipeline"})
+
+
+class FakeKafkaProducer:
+    """AIOKafkaProducer stand-in: `send` returns a delivery future, `send_and_wait` awaits it"""
+
+    def __init__(self, profile: LatencyProfile, **config: Any):
+        self.profile = profile
+        self.config = config
+        self.sent: List[Tuple[str, Any, Any]] = []
+        self.started = False
+
+    async def start(self):
+        self.started = True
+
+    async def stop(self):
+        self.started = False
+
+    async def _deliver(self, topic: str, value: Any, key: Any):
+        await self.profile.wait(f"send {topic}")
+        self.sent.append((topic, value, key))
+
+    async def send(self, topic: str, value: Any = None, key: Any = None, **kwargs: Any) -> asyncio.Future:
+        return asyncio.ensure_future(self._deliver(topic, value, key))
+
+    async def send_and_wait(self, topic: str, value: Any = None, key: Any = None, **kwargs: Any):
+        return await (await self.send(topic, value, key))
+
+
+class FakeGeocoder:
+    """googlemaps.Client stand-in: a synchronous `reverse_geocode` that blocks its thread"""
+
+    def __init__(self, profile: LatencyProfile):
+        self.profile = profile
+
+    def reverse_geocode(self, latlng: Tuple[float, float], **kwargs: Any) -> List[Dict[str, Any]]:
+        self.profile.block("reverse_geocode")
+        latitude, longitude = latlng
+        return [{"formatted_address": f"Rua Simulada, {latitude:.4f}, {longitude:.4f}"}]
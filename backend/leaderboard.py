@@ -0,0 +1,103 @@
+"""Provider rankings per category and region, kept in Redis sorted sets."""
+import logging
+from typing import Any, AsyncIterable, Dict, List, Optional, Tuple
+
+from geohash import region_of
+from redis_swap import discard, staging_prefix, swap_in
+
+logger = logging.getLogger(__name__)
+
+# Média "a priori" e peso (em avaliações) da nota bayesiana
+BAYES_PRIOR_MEAN = 3.5
+BAYES_PRIOR_WEIGHT = 10
+ALL_REGIONS = "all"
+
+
+def bayesian_score(rating: float, total_ratings: int,
+                   prior_mean: float = BAYES_PRIOR_MEAN, prior_weight: float = BAYES_PRIOR_WEIGHT) -> float:
+    """Average rating shrunk towards the prior while a provider has few ratings"""
+    total_ratings = total_ratings or 0
+    return round((prior_weight * prior_mean + (rating or 0.0) * total_ratings) / (prior_weight + total_ratings), 4)
+
+
+def ranking_fields(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Indexed profile fields backing the Mongo fallback of the rankings"""
+    return {
+        "rating_score": bayesian_score(profile.get("rating", 0.0), profile.get("total_ratings", 0)),
+        "region": region_of(profile["latitude"], profile["longitude"]),
+    }
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class ProviderLeaderboard:
+    """`<prefix>:<category>:<region>` and `<prefix>:<category>:all` sorted sets scored by `rating_score`.
+
+    Offline providers are left out. A hash `<prefix>:members` remembers where each
+    provider is ranked so a category/region change or removal touches only its keys.
+    """
+
+    def __init__(self, redis, prefix: str = "leaderboard"):
+        self.redis = redis
+        self.prefix = prefix
+        self.members_key = f"{prefix}:members"
+
+    def key(self, category: str, region: str = ALL_REGIONS) -> str:
+        return f"{self.prefix}:{category}:{region}"
+
+    async def update(self, user_id: str, category: str, region: str, score: float):
+        placement = f"{category}|{region}"
+        previous = _decode(await self.redis.hget(self.members_key, user_id))
+        pipe = self.redis.pipeline(transaction=True)
+        if previous and previous != placement:
+            old_category, old_region = previous.split("|", 1)
+            pipe.zrem(self.key(old_category, old_region), user_id)
+            pipe.zrem(self.key(old_category), user_id)
+        pipe.zadd(self.key(category, region), {user_id: score})
+        pipe.zadd(self.key(category), {user_id: score})
+        pipe.hset(self.members_key, user_id, placement)
+        await pipe.execute()
+
+    async def remove(self, user_id: str):
+        previous = _decode(await self.redis.hget(self.members_key, user_id))
+        if not previous:
+            return
+        category, region = previous.split("|", 1)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zrem(self.key(category, region), user_id)
+        pipe.zrem(self.key(category), user_id)
+        pipe.hdel(self.members_key, user_id)
+        await pipe.execute()
+
+    async def sync(self, profile: Dict[str, Any]):
+        if profile.get("status") == "offline" or profile.get("latitude") is None:
+            await self.remove(profile["user_id"])
+            return
+        fields = ranking_fields(profile)
+        # A nota gravada no perfil vem da média sem arredondamento; recalcular de `rating` divergiria do Mongo
+        score = profile.get("rating_score")
+        await self.update(profile["user_id"], profile["category"], fields["region"],
+                          fields["rating_score"] if score is None else score)
+
+    async def top(self, category: str, region: Optional[str] = None, limit: int = 10) -> List[Tuple[str, float]]:
+        rows = await self.redis.zrevrange(self.key(category, region or ALL_REGIONS), 0, limit - 1, withscores=True)
+        return [(_decode(member), float(score)) for member, score in rows]
+
+    async def rebuild(self, profiles: AsyncIterable[Dict[str, Any]]) -> int:
+        """Reload the rankings from Mongo into staging keys and swap them over the live ones atomically"""
+        staging = ProviderLeaderboard(self.redis, staging_prefix(self.prefix))
+        total = 0
+        try:
+            async for profile in profiles:
+                if profile.get("status") == "offline" or profile.get("latitude") is None:
+                    continue
+                await staging.sync(profile)
+                total += 1
+            await swap_in(self.redis, self.prefix, staging.prefix)
+        except BaseException:
+            await discard(self.redis, staging.prefix)
+            raise
+        logger.info("Provider leaderboard rebuilt with %d providers", total)
+        return total
@@ -0,0 +1,169 @@
+"""Queue-based JSON logging: handlers on the event loop only enqueue, a thread does the I/O."""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import traceback
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Atributos padrão do LogRecord; o resto veio de `extra=` e vai como campo do JSON
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """`"socket_connect=0.1,engineio.server=0.01"` -> {name: rate}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info))
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the records of high-volume events.
+
+    The rate is looked up by the record's `event` attribute (`extra={"event": ...}`)
+    and then by logger name; WARNING and above are never sampled out. Kept records
+    carry `sample_rate` so counts can be scaled back up downstream.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rates: Dict[str, float] = dict(rates or {})
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None:
+            rate = self.rates.get(record.name)
+        if rate is None or rate >= 1.0:
+            return True
+        if random.random() < rate:
+            record.sample_rate = rate
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Drops (and counts) records when the queue is full instead of waiting for the writer"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Mensagem e traceback resolvidos aqui: os args podem mudar depois de enfileirados
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Root logging wired as filter -> bounded queue -> writer thread -> JSON stream"""
+
+    def __init__(self, level: str = "INFO", sample_rates: Optional[Dict[str, float]] = None,
+                 levels: Optional[Dict[str, str]] = None, stream=None, max_queue: int = 10000):
+        self.sampling = SamplingFilter(sample_rates)
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.handler = _NonBlockingQueueHandler(self.queue)
+        self.handler.addFilter(self.sampling)
+        self.output = logging.StreamHandler(stream or sys.stdout)
+        self.output.setFormatter(JsonFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, self.output, respect_handler_level=True)
+        self.level = level
+        self.levels = dict(levels or {})
+        self.running = False
+        self._atexit = False
+
+    def install(self) -> "LogPipeline":
+        if self.running:
+            return self
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        self.set_level(self.level)
+        for name, level in self.levels.items():
+            self.set_level(level, name)
+        self.listener.start()
+        self.running = True
+        if not self._atexit:
+            atexit.register(self.stop)
+            self._atexit = True
+        return self
+
+    def stop(self, hand_off: bool = False):
+        """Write out what is queued and stop the writer thread.
+
+        With `hand_off` the root logger keeps writing JSON synchronously, for the few
+        lines logged after the drain (e.g. the shutdown report).
+        """
+        if self.running:
+            self.running = False
+            root = logging.getLogger()
+            root.removeHandler(self.handler)
+            self.listener.stop()
+            if hand_off:
+                self.output.addFilter(self.sampling)
+                root.addHandler(self.output)
+
+    def set_level(self, level: str, logger_name: Optional[str] = None):
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level {level}")
+        logging.getLogger(logger_name).setLevel(level)
+        if logger_name:
+            self.levels[logger_name] = level
+        else:
+            self.level = level
+
+    def set_rate(self, name: str, rate: float):
+        if rate >= 1.0:
+            self.sampling.rates.pop(name, None)
+        else:
+            self.sampling.rates[name] = max(0.0, rate)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "level": self.level,
+            "levels": self.levels,
+            "sample_rates": self.sampling.rates,
+            "queued": self.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "sampled_out": self.sampling.sampled_out,
+        }
@@ -0,0 +1,146 @@
+"""Transactional outbox: notifications are stored with the state change and delivered by a dispatcher."""
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# deliver(events) -> ids entregues com sucesso
+Deliver = Callable[[List[Dict[str, Any]]], Awaitable[Iterable[str]]]
+
+LEASE_FREE = datetime(1970, 1, 1)
+
+
+def outbox_event(event: str, payload: Dict[str, Any], room: Optional[str] = None,
+                 channel: Optional[str] = None, emit: bool = True) -> Dict[str, Any]:
+    """Build an outbox document: `event` is emitted to `room` (or broadcast) and published to `channel`.
+
+    With `emit=False` the event only goes to the broker channel.
+    """
+    return {
+        "_id": str(uuid.uuid4()),
+        "event": event,
+        "room": room,
+        "channel": channel,
+        "emit": emit,
+        "payload": payload,
+        "created_at": datetime.utcnow(),
+        "dispatched_at": None,
+        "lease_owner": None,
+        "lease_until": LEASE_FREE,
+        "attempts": 0,
+    }
+
+
+class OutboxDispatcher:
+    """Tails the outbox collection and hands pending events to `deliver` in batches.
+
+    Workers claim a batch with a lease, deliver it and mark it dispatched; a crash
+    before the mark lets the lease expire and another worker redelivers the events
+    (at-least-once). Consumers deduplicate by the `event_id` added to every payload,
+    and the dispatcher skips ids it has already delivered itself.
+    """
+
+    def __init__(self, collection, deliver: Deliver, batch_size: int = 100,
+                 poll_interval: float = 1.0, lease_seconds: float = 30.0, dedup_size: int = 10000):
+        self.collection = collection
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease_seconds)
+        self.owner = uuid.uuid4().hex
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._dedup_size = dedup_size
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"enqueued": 0, "delivered": 0, "duplicates_skipped": 0, "failed_batches": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("dispatched_at", 1), ("lease_until", 1), ("created_at", 1)])
+        # Eventos entregues somem depois de um dia
+        await self.collection.create_index("dispatched_at", expireAfterSeconds=86400)
+
+    async def enqueue(self, events: List[Dict[str, Any]], session=None):
+        if not events:
+            return
+        await self.collection.insert_many(events, session=session)
+        self.stats["enqueued"] += len(events)
+
+    def notify(self):
+        """Wake the dispatcher right away (called once the enqueuing write has committed)"""
+        self._wakeup.set()
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        pending = {"dispatched_at": None, "lease_until": {"$lt": now}}
+        ids = [doc["_id"] async for doc in self.collection.find(pending, {"_id": 1}).sort("created_at", 1).limit(self.batch_size)]
+        if not ids:
+            return []
+        token = f"{self.owner}:{uuid.uuid4().hex}"
+        await self.collection.update_many(
+            {"_id": {"$in": ids}, **pending},
+            {"$set": {"lease_owner": token, "lease_until": now + self.lease}, "$inc": {"attempts": 1}},
+        )
+        return await self.collection.find({"_id": {"$in": ids}, "lease_owner": token}).sort("created_at", 1).to_list(None)
+
+    def _remember(self, event_id: str):
+        self._recent[event_id] = None
+        if len(self._recent) > self._dedup_size:
+            self._recent.popitem(last=False)
+
+    async def dispatch_once(self) -> int:
+        batch = await self._claim()
+        if not batch:
+            return 0
+        fresh = [event for event in batch if event["_id"] not in self._recent]
+        self.stats["duplicates_skipped"] += len(batch) - len(fresh)
+        delivered = set()
+        try:
+            delivered = set(await self.deliver(fresh)) if fresh else set()
+        except Exception as e:
+            self.stats["failed_batches"] += 1
+            logger.warning(f"Outbox delivery failed, events will be retried: {e}")
+        for event_id in delivered:
+            self._remember(event_id)
+        done = list(delivered | {event["_id"] for event in batch if event["_id"] in self._recent})
+        if done:
+            await self.collection.update_many(
+                {"_id": {"$in": done}},
+                {"$set": {"dispatched_at": datetime.utcnow(), "lease_owner": None}},
+            )
+        self.stats["delivered"] += len(delivered)
+        return len(batch)
+
+    async def _run(self):
+        while True:
+            try:
+                while await self.dispatch_once() >= self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Outbox dispatcher error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain: bool = True):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if drain:
+            while await self.dispatch_once():
+                pass
@@ -0,0 +1,104 @@
+"""Store-and-forward for socket events whose recipient was offline: held per room, delivered on connect."""
+import itertools
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from pymongo import InsertOne, ReplaceOne
+
+# (room, event, data, collapse): com `collapse`, só o mais novo de (room, event, collapse) fica guardado
+HeldEvent = Tuple[str, str, Any, Optional[Hashable]]
+
+# Salas pessoais (um usuário); salas de pedido/broadcast não têm um destinatário para guardar
+PERSONAL_ROOM_PREFIXES = ("client_", "provider_")
+
+
+def is_personal_room(room: Optional[str]) -> bool:
+    return bool(room) and room.startswith(PERSONAL_ROOM_PREFIXES)
+
+
+class PendingEvents:
+    """Events for personal rooms that had no connected socket, kept in a Mongo TTL collection.
+
+    `hold` writes a batch with one `bulk_write`; an event with a collapse key
+    replaces the held one with the same room, event and key, so an offline client
+    keeps only the newest location of each request. A room keeps at most
+    `max_per_room` events (the oldest are trimmed) and nothing outlives
+    `ttl_seconds`. Delivery is claim -> emit -> `ack`: `claim(room)` marks the
+    room's events with a token and returns them oldest first (two sockets
+    connecting at once don't both get them), `ack(token)` deletes them once they
+    were sent and `release(token)` hands them back for the next connect. A claim
+    older than `claim_seconds` (its worker died mid-delivery) can be taken again.
+    """
+
+    def __init__(self, collection, ttl_seconds: int = 86400, max_per_room: int = 100, claim_seconds: int = 60):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.max_per_room = max_per_room
+        self.claim_seconds = claim_seconds
+        # Desempate da ordem entre eventos guardados no mesmo instante
+        self._sequence = itertools.count()
+        self.stats = {"held": 0, "collapsed": 0, "trimmed": 0, "delivered": 0, "claims": 0, "released": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("room", 1), ("created_at", 1), ("seq", 1)])
+        await self.collection.create_index("claimed_by", sparse=True)
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    async def hold(self, events: Iterable[HeldEvent]) -> int:
+        now = datetime.utcnow()
+        writes, rooms = [], set()
+        for room, event, data, collapse in events:
+            if not is_personal_room(room):
+                continue
+            doc = {"room": room, "event": event, "data": data, "created_at": now, "seq": next(self._sequence)}
+            if collapse is None:
+                writes.append(InsertOne({"_id": uuid.uuid4().hex, **doc}))
+            else:
+                doc_id = f"{room}|{event}|{collapse}"
+                writes.append(ReplaceOne({"_id": doc_id}, {"_id": doc_id, **doc}, upsert=True))
+            rooms.add(room)
+        if not writes:
+            return 0
+        result = await self.collection.bulk_write(writes, ordered=True)
+        self.stats["held"] += len(writes)
+        self.stats["collapsed"] += result.matched_count
+        for room in rooms:
+            await self._trim(room)
+        return len(writes)
+
+    async def _trim(self, room: str):
+        overflow = await self.collection.find({"room": room}, {"_id": 1}).sort([("created_at", -1), ("seq", -1)]) \
+            .skip(self.max_per_room).to_list(None)
+        if overflow:
+            result = await self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in overflow]}})
+            self.stats["trimmed"] += result.deleted_count
+
+    async def claim(self, room: str) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """(token, the room's held events as `batch` items {event, data, queued_at}, oldest first)"""
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        claimed = await self.collection.update_many(
+            {"room": room, "$or": [{"claimed_by": None},
+                                   {"claimed_at": {"$lt": now - timedelta(seconds=self.claim_seconds)}}]},
+            {"$set": {"claimed_by": token, "claimed_at": now}}
+        )
+        if not claimed.modified_count:
+            return None, []
+        docs = await self.collection.find({"claimed_by": token}).sort([("created_at", 1), ("seq", 1)]).to_list(None)
+        self.stats["claims"] += 1
+        return token, [{"event": doc["event"], "data": doc["data"], "queued_at": doc["created_at"].isoformat()}
+                       for doc in docs]
+
+    async def ack(self, token: str) -> int:
+        """The claimed events were sent: remove them"""
+        result = await self.collection.delete_many({"claimed_by": token})
+        self.stats["delivered"] += result.deleted_count
+        return result.deleted_count
+
+    async def release(self, token: str):
+        """Delivery failed: the claimed events wait for the next connect"""
+        result = await self.collection.update_many(
+            {"claimed_by": token}, {"$unset": {"claimed_by": "", "claimed_at": ""}}
+        )
+        self.stats["released"] += result.modified_count
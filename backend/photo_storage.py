@@ -0,0 +1,235 @@
+"""Job photos: streamed multipart uploads, content-addressed files and thumbnails built in a process pool."""
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow é opcional: sem ele as fotos são guardadas sem miniaturas
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Assinaturas aceitas (primeiros bytes do arquivo) -> extensão
+IMAGE_SIGNATURES = ((b"\xff\xd8\xff", ".jpg"), (b"\x89PNG\r\n\x1a\n", ".png"))
+MAX_PART_HEADER_BYTES = 16 * 1024
+
+
+class InvalidUpload(Exception):
+    """The body is not a multipart form with the expected file field"""
+
+
+class UnsupportedImage(Exception):
+    """The file is not a JPEG, PNG or WebP image"""
+
+
+class UploadTooLarge(Exception):
+    """The file went over the configured size limit"""
+
+
+def _params(header: str) -> Tuple[str, Dict[str, str]]:
+    value, *rest = header.split(";")
+    params = {}
+    for item in rest:
+        key, _, raw = item.strip().partition("=")
+        params[key.lower()] = raw.strip().strip('"')
+    return value.strip().lower(), params
+
+
+def multipart_boundary(content_type: Optional[str]) -> bytes:
+    kind, params = _params(content_type or "")
+    if kind != "multipart/form-data" or not params.get("boundary"):
+        raise InvalidUpload("Expected multipart/form-data with a boundary")
+    return params["boundary"].encode("latin-1")
+
+
+def image_extension(head: bytes) -> str:
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    raise UnsupportedImage("Only JPEG, PNG and WebP photos are accepted")
+
+
+async def stream_file_part(chunks: AsyncIterator[bytes], boundary: bytes, field: str) -> AsyncIterator[bytes]:
+    """Yield the body of the `field` part of a multipart stream as it arrives.
+
+    Only the unconsumed tail (at most one chunk plus the delimiter) is kept in
+    memory, whatever the size of the part. Other parts are skipped; the rest of
+    the stream after the file part is not read (see `drain`).
+    """
+    delimiter = b"\r\n--" + boundary
+    buffer = b"\r\n"  # o primeiro delimitador não tem CRLF antes
+    state = "preamble"
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            if state in ("preamble", "skip", "body"):
+                index = buffer.find(delimiter)
+                if index == -1:
+                    # Guarda o que pode ser o começo de um delimitador cortado entre chunks
+                    ready = max(len(buffer) - len(delimiter) + 1, 0)
+                    if state == "body" and ready:
+                        yield buffer[:ready]
+                    buffer = buffer[ready:]
+                    break
+                if state == "body":
+                    if index:
+                        yield buffer[:index]
+                    return
+                buffer = buffer[index + len(delimiter):]
+                state = "delimiter"
+            if state == "delimiter":
+                if len(buffer) < 2:
+                    break
+                if buffer.startswith(b"--"):
+                    raise InvalidUpload(f"Missing '{field}' file part")
+                if not buffer.startswith(b"\r\n"):
+                    raise InvalidUpload("Malformed multipart delimiter")
+                buffer = buffer[2:]
+                state = "headers"
+            if state == "headers":
+                end = buffer.find(b"\r\n\r\n")
+                if end == -1:
+                    if len(buffer) > MAX_PART_HEADER_BYTES:
+                        raise InvalidUpload("Multipart part headers too large")
+                    break
+                headers = {}
+                for line in buffer[:end].decode("latin-1").split("\r\n"):
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                buffer = buffer[end + 4:]
+                _, disposition = _params(headers.get("content-disposition", ""))
+                state = "body" if disposition.get("name") == field else "skip"
+    raise InvalidUpload("Multipart body ended before the file part was complete")
+
+
+async def drain(chunks: AsyncIterator[bytes], limit: int) -> bool:
+    """Read and discard what is left of a request body, up to `limit` bytes.
+
+    A rejected or finished upload must not leave its tail in the socket, or the
+    next request on the keep-alive connection would be parsed from it. Returns
+    False when the body went over `limit`; the connection should then be closed.
+    """
+    read = 0
+    async for chunk in chunks:
+        read += len(chunk)
+        if read > limit:
+            return False
+    return True
+
+
+def render_thumbnails(source: str, sizes: Sequence[int]) -> Dict[str, str]:
+    """Square-bounded JPEG thumbnails next to `source` (runs in a worker process)"""
+    stem, _ = os.path.splitext(source)
+    written = {}
+    with Image.open(source) as image:
+        # JPEG grande: decodifica direto numa escala reduzida
+        image.draft("RGB", (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for size in sorted(sizes, reverse=True):
+            target = f"{stem}_{size}.jpg"
+            image.thumbnail((size, size))
+            image.save(target, "JPEG", quality=82, optimize=True)
+            written[str(size)] = target
+    return written
+
+
+class PhotoStore:
+    """Content-addressed photo files under `root`, served from `base_url`.
+
+    Uploads are streamed to a temporary file in `flush_bytes` writes (off the
+    event loop) while their SHA-256 is computed, then renamed to
+    `<root>/<aa>/<sha256><ext>`; a photo that is already stored is not written
+    twice. Thumbnails are rendered by `executor` (a process pool, so decoding and
+    resizing never hold the loop or the GIL) once per distinct photo.
+    """
+
+    def __init__(self, root: str, base_url: str = "/media/photos", max_bytes: int = 15 * 1024 * 1024,
+                 thumbnail_sizes: Sequence[int] = (1024, 256), executor: Optional[Executor] = None,
+                 flush_bytes: int = 256 * 1024):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/")
+        self.max_bytes = max_bytes
+        self.thumbnail_sizes = tuple(thumbnail_sizes)
+        self.executor = executor
+        self.flush_bytes = flush_bytes
+        (self.root / "tmp").mkdir(parents=True, exist_ok=True)
+        self.stats = {"stored": 0, "deduplicated": 0, "rejected": 0, "bytes": 0, "thumbnails_failed": 0}
+
+    def url(self, path: Path) -> str:
+        return f"{self.base_url}/{path.relative_to(self.root).as_posix()}"
+
+    async def _spool(self, body: AsyncIterator[bytes], temp: Path) -> Tuple[str, str, int]:
+        digest = hashlib.sha256()
+        pending = bytearray()
+        size = 0
+        extension = None
+        with open(temp, "wb") as out:
+            async for data in body:
+                size += len(data)
+                if size > self.max_bytes:
+                    raise UploadTooLarge(f"Photo exceeds {self.max_bytes} bytes")
+                digest.update(data)
+                pending += data
+                if extension is None and len(pending) >= 12:
+                    extension = image_extension(bytes(pending[:12]))
+                if len(pending) >= self.flush_bytes:
+                    await asyncio.to_thread(out.write, bytes(pending))
+                    pending.clear()
+            if extension is None:
+                extension = image_extension(bytes(pending[:12]))
+            await asyncio.to_thread(out.write, bytes(pending))
+        return digest.hexdigest(), extension, size
+
+    async def _thumbnails(self, path: Path) -> Dict[str, str]:
+        stem = path.with_suffix("")
+        existing = {str(size): f"{stem}_{size}.jpg" for size in self.thumbnail_sizes}
+        if all(os.path.exists(target) for target in existing.values()):
+            return existing
+        if Image is None or not self.thumbnail_sizes:
+            return {}
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, render_thumbnails, str(path), self.thumbnail_sizes
+            )
+        except Exception as e:
+            # A foto original continua válida; miniaturas ficam para a próxima cópia dela
+            self.stats["thumbnails_failed"] += 1
+            logger.warning(f"Could not render thumbnails for {path.name}: {e}")
+            return {}
+
+    async def save(self, body: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Store a streamed image; returns its digest, URL, thumbnail URLs and whether it was a duplicate"""
+        temp = self.root / "tmp" / uuid.uuid4().hex
+        try:
+            digest, extension, size = await self._spool(body, temp)
+            target = self.root / digest[:2] / f"{digest}{extension}"
+            duplicate = target.exists()
+            if duplicate:
+                self.stats["deduplicated"] += 1
+            else:
+                target.parent.mkdir(exist_ok=True)
+                os.replace(temp, target)
+                self.stats["stored"] += 1
+                self.stats["bytes"] += size
+        except (InvalidUpload, UnsupportedImage, UploadTooLarge):
+            self.stats["rejected"] += 1
+            raise
+        finally:
+            if temp.exists():
+                temp.unlink()
+        thumbnails = await self._thumbnails(target)
+        return {
+            "sha256": digest,
+            "size": size,
+            "url": self.url(target),
+            "thumbnails": {size: self.url(Path(path)) for size, path in thumbnails.items()},
+            "deduplicated": duplicate,
+        }
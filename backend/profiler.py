@@ -0,0 +1,279 @@
+"""On-demand sampling profiler and event-loop watchdog for the debug endpoints."""
+import asyncio
+import fnmatch
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+Frame = Tuple[str, str, int]  # (função, arquivo, linha da definição)
+Stack = Tuple[Frame, ...]     # raiz primeiro
+
+
+def capture_stack(frame, limit: int = 128) -> Stack:
+    frames = []
+    while frame is not None and len(frames) < limit:
+        code = frame.f_code
+        frames.append((getattr(code, "co_qualname", code.co_name), os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return tuple(reversed(frames))
+
+
+def thread_stack(thread_id: int) -> Stack:
+    frame = sys._current_frames().get(thread_id)
+    return capture_stack(frame) if frame is not None else ()
+
+
+def collapsed(counts: Counter) -> str:
+    """Brendan Gregg's collapsed format: `root;child;leaf <samples>` per line"""
+    lines = []
+    for stack, count in counts.most_common():
+        names = ";".join(f"{name} ({filename}:{line})".replace(";", ",") for name, filename, line in stack)
+        lines.append(f"{names} {count}")
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def speedscope(counts: Counter, name: str, interval: float) -> Dict[str, Any]:
+    """Speedscope "sampled" profile: one weighted sample per distinct stack"""
+    frame_index: Dict[Frame, int] = {}
+    samples, weights = [], []
+    for stack, count in counts.most_common():
+        samples.append([frame_index.setdefault(frame, len(frame_index)) for frame in stack])
+        weights.append(round(count * interval * 1000, 3))
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": [{"name": n, "file": f, "line": l} for n, f, l in frame_index]},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 3),
+            "samples": samples,
+            "weights": weights,
+        }],
+        "name": name,
+        "exporter": "freelas-backend",
+    }
+
+
+class StackSampler:
+    """Background thread that samples the stack of one thread every `interval` seconds.
+
+    `accept()` runs on the sampler thread for every sample and may return the bucket
+    the sample belongs to (None drops it), which is how route profiling keeps only the
+    samples taken while a profiled request's task is the one running. Readers on other
+    threads go through `snapshot()`, which copies a bucket under the sampler's lock.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005,
+                 accept: Optional[Callable[[], Optional[str]]] = None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.accept = accept or (lambda: "all")
+        self.counts: Dict[str, Counter] = {}
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            bucket = self.accept()
+            if bucket is None:
+                continue
+            stack = thread_stack(self.thread_id)
+            if stack:
+                with self._lock:
+                    self.counts.setdefault(bucket, Counter())[stack] += 1
+                    self.samples += 1
+
+    def snapshot(self, bucket: str) -> Counter:
+        with self._lock:
+            return Counter(self.counts.get(bucket, ()))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+async def profile_for(seconds: float, interval: float = 0.005) -> Counter:
+    """Sample the event loop thread for `seconds` (everything the loop runs meanwhile)"""
+    sampler = StackSampler(threading.get_ident(), interval)
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop()
+    return sampler.snapshot("all")
+
+
+class RouteProfiler:
+    """Profiles a sampled fraction of the HTTP requests whose path matches a pattern.
+
+    While a chosen request is in flight its task is registered; the sampler thread
+    only keeps samples taken while one of those tasks is the loop's current task, so
+    concurrent requests to other routes do not pollute the profile.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.targets: Dict[str, Dict[str, Any]] = {}
+        self._active: Dict[asyncio.Task, str] = {}
+        self._sampler: Optional[StackSampler] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def enable(self, pattern: str, fraction: float, max_requests: int = 1000):
+        self.targets[pattern] = {"fraction": fraction, "remaining": max_requests, "profiled": 0}
+        if self._sampler is None:
+            self._loop = asyncio.get_running_loop()
+            self._sampler = StackSampler(threading.get_ident(), self.interval, self._current_target)
+            self._sampler.start()
+
+    def disable(self, pattern: Optional[str] = None):
+        if pattern is None:
+            self.targets.clear()
+        else:
+            self.targets.pop(pattern, None)
+        if not self.targets and self._sampler:
+            self._sampler.stop()
+            self._sampler = None
+
+    def _current_target(self) -> Optional[str]:
+        if not self._active:
+            return None
+        task = asyncio.current_task(self._loop)
+        return self._active.get(task) if task is not None else None
+
+    def choose(self, path: str) -> Optional[str]:
+        for pattern, target in self.targets.items():
+            if fnmatch.fnmatchcase(path, pattern):
+                if target["remaining"] > 0 and random.random() < target["fraction"]:
+                    target["remaining"] -= 1
+                    target["profiled"] += 1
+                    return pattern
+                return None
+        return None
+
+    def results(self, pattern: str) -> Counter:
+        if not self._sampler:
+            return Counter()
+        return self._sampler.snapshot(pattern)
+
+    def status(self) -> Dict[str, Any]:
+        return {"interval_ms": self.interval * 1000, "targets": {
+            pattern: {**target, "samples": sum(self.results(pattern).values())}
+            for pattern, target in self.targets.items()
+        }}
+
+
+class RouteProfilerMiddleware:
+    """Pure ASGI middleware, so the endpoint runs in the task that gets registered"""
+
+    def __init__(self, app, profiler: RouteProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        profiler = self.profiler
+        pattern = profiler.choose(scope["path"]) if scope["type"] == "http" and profiler.targets else None
+        if pattern is None:
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        profiler._active[task] = pattern
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler._active.pop(task, None)
+
+
+class LoopMonitor:
+    """Measures event-loop lag and captures the loop thread's stack while it is blocked.
+
+    A heartbeat coroutine sleeps `interval` and records how late it woke up; a watchdog
+    thread notices when the heartbeat is overdue by more than `threshold` and grabs
+    the stack of whatever is holding the loop at that moment.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, max_records: int = 100):
+        self.threshold = threshold
+        self.interval = interval
+        self.lags: Deque[float] = deque(maxlen=2000)
+        self.max_lag = 0.0
+        self.blocked: Deque[Dict[str, Any]] = deque(maxlen=max_records)
+        self._beat = time.monotonic()
+        self._episode: Optional[Dict[str, Any]] = None
+        self._thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            episode, self._episode = self._episode, None
+            if episode is not None:
+                episode["lag_ms"] = round(lag * 1000, 1)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            overdue = time.monotonic() - self._beat - self.interval
+            if overdue > self.threshold and self._episode is None:
+                self._episode = {"at": datetime.utcnow().isoformat(), "lag_ms": None,
+                                 "stack": [f"{n} ({f}:{l})" for n, f, l in thread_stack(self._thread_id)]}
+                self.blocked.append(self._episode)
+
+    def start(self):
+        if self._task:
+            return
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._watchdog.join()
+
+    def report(self) -> Dict[str, Any]:
+        ordered = sorted(self.lags)
+
+        def percentile(p: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2) if ordered else 0.0
+
+        return {
+            "running": self.running,
+            "threshold_ms": self.threshold * 1000,
+            "lag_ms": {"p50": percentile(0.5), "p99": percentile(0.99), "max": round(self.max_lag * 1000, 2)},
+            "blocked": list(self.blocked),
+        }
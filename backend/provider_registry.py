@@ -0,0 +1,265 @@
+"""Columnar in-memory registry of online providers (a few dozen bytes per provider)."""
+import logging
+import time
+import uuid
+from typing import Any, AsyncIterable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from geo_kernel import bounding_box_mask, within_radius
+
+logger = logging.getLogger(__name__)
+
+_U64 = (1 << 64) - 1
+_EMPTY, _DELETED = 0, -1
+
+
+def _key(user_id: str) -> Tuple[int, int]:
+    """UUID user_id -> two signed 64-bit halves (ids are uuid4 strings throughout the app)"""
+    value = uuid.UUID(user_id).int
+    hi, lo = value >> 64, value & _U64
+    return (hi - (1 << 64) if hi >= 1 << 63 else hi), (lo - (1 << 64) if lo >= 1 << 63 else lo)
+
+
+def _user_id(hi: int, lo: int) -> str:
+    return str(uuid.UUID(int=((hi & _U64) << 64) | (lo & _U64)))
+
+
+class RegistrySnapshot:
+    """Read-only copy of the registry columns; safe to query from other threads"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], categories: List[str], statuses: List[str], taken_at: float):
+        for column in columns.values():
+            column.flags.writeable = False
+        self.columns = columns
+        self.categories = categories
+        self.statuses = statuses
+        self.taken_at = taken_at
+
+    def nearby(self, latitude: float, longitude: float, radius_km: float,
+               category: Optional[str] = None, status: str = "available") -> List[Tuple[str, float]]:
+        """(user_id, distance_km) of the providers with `status` within the radius, nearest first"""
+        if status not in self.statuses or (category is not None and category not in self.categories):
+            return []
+        cols = self.columns
+        # Caixa + filtros sobre as colunas inteiras; haversine só nos que sobraram
+        mask = bounding_box_mask(latitude, longitude, cols["latitude"], cols["longitude"], radius_km)
+        mask &= cols["status"] == self.statuses.index(status)
+        if category is not None:
+            mask &= cols["category"] == self.categories.index(category)
+        slots = np.flatnonzero(mask)
+        inside, distances = within_radius(latitude, longitude, cols["latitude"][slots], cols["longitude"][slots],
+                                          radius_km, nearest_first=True)
+        slots = slots[inside]
+        his, los = cols["id_hi"][slots].tolist(), cols["id_lo"][slots].tolist()
+        return [(_user_id(hi, lo), distance) for hi, lo, distance in zip(his, los, distances.tolist())]
+
+
+class ProviderRegistry:
+    """Provider state in NumPy columns indexed by slot, with an open-addressing user_id -> slot table.
+
+    Per provider: 16 bytes of id, float32 lat/lon/price/rating, a uint16 category code
+    and a uint8 status code (35 bytes), plus 8 bytes of hash table and 4 of free-list.
+    Categories and statuses are interned into codes; removed slots go to a free-list
+    and are reused. Writers mutate the columns in place (event loop only); readers in
+    other threads take a `snapshot()`, which is copied at most once per write batch.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._reset(capacity)
+        self.ready = False
+
+    def _reset(self, capacity: int):
+        capacity = max(16, 1 << (capacity - 1).bit_length())
+        self._columns = self._allocate(capacity)
+        self._table = np.zeros(2 * capacity, dtype=np.int32)  # slot + 1; 0 vazio, -1 removido
+        self._table_used = 0
+        self._free = np.empty(capacity, dtype=np.int32)
+        self._free_count = 0
+        self._high = 0
+        self._size = 0
+        self._category_codes: Dict[str, int] = {}
+        self._categories: List[str] = []
+        self._status_codes: Dict[str, int] = {}
+        self._statuses: List[str] = []
+        self._version = 0
+        self._snapshot: Optional[RegistrySnapshot] = None
+        self._snapshot_version = -1
+
+    @staticmethod
+    def _allocate(capacity: int) -> Dict[str, np.ndarray]:
+        return {
+            "id_hi": np.zeros(capacity, dtype=np.int64),
+            "id_lo": np.zeros(capacity, dtype=np.int64),
+            "latitude": np.zeros(capacity, dtype=np.float32),
+            "longitude": np.zeros(capacity, dtype=np.float32),
+            "price": np.zeros(capacity, dtype=np.float32),
+            "rating": np.zeros(capacity, dtype=np.float32),
+            "category": np.zeros(capacity, dtype=np.uint16),
+            "status": np.full(capacity, 255, dtype=np.uint8),  # 255 = slot livre
+        }
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return len(self._columns["status"])
+
+    def nbytes(self) -> int:
+        return sum(c.nbytes for c in self._columns.values()) + self._table.nbytes + self._free.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "providers": self._size,
+            "capacity": self.capacity,
+            "bytes": self.nbytes(),
+            "bytes_per_provider": round(self.nbytes() / max(self._size, 1), 1),
+        }
+
+    def _probe(self, hi: int, lo: int) -> Tuple[int, int]:
+        """(slot or -1, table position where the key is or should be inserted)"""
+        table, ids_hi, ids_lo = self._table, self._columns["id_hi"], self._columns["id_lo"]
+        mask = len(table) - 1
+        position, insert_at = lo & mask, -1
+        while True:
+            entry = int(table[position])
+            if entry == _EMPTY:
+                return -1, (position if insert_at < 0 else insert_at)
+            if entry == _DELETED:
+                if insert_at < 0:
+                    insert_at = position
+            elif ids_hi[entry - 1] == hi and ids_lo[entry - 1] == lo:
+                return entry - 1, position
+            position = (position + 1) & mask
+
+    def _rehash(self, table_size: int):
+        self._table = np.zeros(table_size, dtype=np.int32)
+        self._table_used = 0
+        live = np.flatnonzero(self._columns["status"][:self._high] != 255)
+        for slot, hi, lo in zip(live.tolist(), self._columns["id_hi"][live].tolist(), self._columns["id_lo"][live].tolist()):
+            _, position = self._probe(hi, lo)
+            self._table[position] = slot + 1
+            self._table_used += 1
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        grown = self._allocate(capacity)
+        for name, column in self._columns.items():
+            grown[name][:len(column)] = column
+        self._columns = grown
+        free = np.empty(capacity, dtype=np.int32)
+        free[:self._free_count] = self._free[:self._free_count]
+        self._free = free
+        self._rehash(2 * capacity)
+
+    @staticmethod
+    def _code(codes: Dict[str, int], names: List[str], value: str, limit: int) -> int:
+        code = codes.get(value)
+        if code is None:
+            if len(names) >= limit:
+                raise ValueError(f"too many distinct values to intern: {value!r}")
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def _lookup(self, user_id: str) -> Tuple[int, int]:
+        try:
+            key = _key(user_id)
+        except (TypeError, ValueError):
+            return -1, -1  # id fora do formato UUID nunca é registrado
+        return self._probe(*key)
+
+    def slot_of(self, user_id: str) -> int:
+        return self._lookup(user_id)[0]
+
+    def upsert(self, user_id: str, category: str, status: str, latitude: float, longitude: float,
+               price: float = 0.0, rating: float = 0.0):
+        hi, lo = _key(user_id)
+        slot, position = self._probe(hi, lo)
+        if slot < 0:
+            if self._free_count:
+                self._free_count -= 1
+                slot = int(self._free[self._free_count])
+            else:
+                if self._high == self.capacity:
+                    self._grow()
+                    _, position = self._probe(hi, lo)
+                slot = self._high
+                self._high += 1
+            if self._table[position] == _EMPTY:
+                self._table_used += 1
+            self._table[position] = slot + 1
+            self._size += 1
+        cols = self._columns
+        cols["id_hi"][slot], cols["id_lo"][slot] = hi, lo
+        cols["latitude"][slot], cols["longitude"][slot] = latitude, longitude
+        cols["price"][slot], cols["rating"][slot] = price or 0.0, rating or 0.0
+        cols["category"][slot] = self._code(self._category_codes, self._categories, category, 1 << 16)
+        cols["status"][slot] = self._code(self._status_codes, self._statuses, status, 255)
+        self._version += 1
+        if self._table_used * 4 > len(self._table) * 3:
+            # Muitas marcas de remoção: reconstrói a tabela no mesmo tamanho
+            self._rehash(len(self._table))
+
+    def update_location(self, user_id: str, latitude: float, longitude: float) -> bool:
+        slot = self.slot_of(user_id)
+        if slot < 0:
+            return False
+        self._columns["latitude"][slot], self._columns["longitude"][slot] = latitude, longitude
+        self._version += 1
+        return True
+
+    def remove(self, user_id: str) -> bool:
+        slot, position = self._lookup(user_id)
+        if slot < 0:
+            return False
+        self._table[position] = _DELETED
+        self._columns["status"][slot] = 255
+        self._free[self._free_count] = slot
+        self._free_count += 1
+        self._size -= 1
+        self._version += 1
+        return True
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        slot = self.slot_of(user_id)
+        if slot < 0:
+            return None
+        cols = self._columns
+        return {
+            "user_id": user_id,
+            "category": self._categories[cols["category"][slot]],
+            "status": self._statuses[cols["status"][slot]],
+            "latitude": float(cols["latitude"][slot]),
+            "longitude": float(cols["longitude"][slot]),
+            "price": float(cols["price"][slot]),
+            "rating": float(cols["rating"][slot]),
+        }
+
+    def sync(self, profile: Dict[str, Any]):
+        """Mirror a profile: offline (or without coordinates) providers leave the registry"""
+        if profile.get("status") == "offline" or profile.get("latitude") is None:
+            self.remove(profile["user_id"])
+            return
+        self.upsert(profile["user_id"], profile["category"], profile["status"], profile["latitude"],
+                    profile["longitude"], profile.get("price", 0.0), profile.get("rating", 0.0))
+
+    def snapshot(self, max_age: float = 0.0) -> RegistrySnapshot:
+        """Immutable view of the current columns; reused while nothing changed (or for `max_age` seconds)"""
+        now = time.monotonic()
+        cached = self._snapshot
+        if cached and (self._snapshot_version == self._version or now - cached.taken_at < max_age):
+            return cached
+        columns = {name: column[:self._high].copy() for name, column in self._columns.items()}
+        self._snapshot = RegistrySnapshot(columns, list(self._categories), list(self._statuses), now)
+        self._snapshot_version = self._version
+        return self._snapshot
+
+    async def rebuild(self, profiles: AsyncIterable[Dict[str, Any]]) -> int:
+        self._reset(self.capacity)
+        async for profile in profiles:
+            self.sync(profile)
+        self.ready = True
+        logger.info("Provider registry loaded with %d online providers", len(self))
+        return len(self)
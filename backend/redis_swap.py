@@ -0,0 +1,42 @@
+"""Atomic replacement of a family of Redis keys rebuilt under a staging prefix."""
+import uuid
+from typing import List
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def staging_prefix(prefix: str) -> str:
+    """A private prefix that `<prefix>:*` scans never match"""
+    return f"{prefix}~rebuild~{uuid.uuid4().hex}"
+
+
+async def keys_under(redis, prefix: str) -> List[str]:
+    return [_decode(key) async for key in redis.scan_iter(match=f"{prefix}:*")]
+
+
+async def swap_in(redis, live_prefix: str, staged_prefix: str) -> int:
+    """Make the `<staged_prefix>:*` keys the `<live_prefix>:*` keys in one MULTI.
+
+    Live keys with no staged counterpart are deleted in the same transaction, so
+    readers on other workers see either the old family or the new one, never an
+    empty one. Returns the number of keys swapped in.
+    """
+    staged = await keys_under(redis, staged_prefix)
+    targets = {key: live_prefix + key[len(staged_prefix):] for key in staged}
+    stale = [key for key in await keys_under(redis, live_prefix) if key not in targets.values()]
+    pipe = redis.pipeline(transaction=True)
+    if stale:
+        pipe.delete(*stale)
+    for source, target in targets.items():
+        pipe.rename(source, target)
+    await pipe.execute()
+    return len(targets)
+
+
+async def discard(redis, staged_prefix: str):
+    """Drop what a failed rebuild left under its staging prefix"""
+    leftovers = await keys_under(redis, staged_prefix)
+    if leftovers:
+        await redis.delete(*leftovers)
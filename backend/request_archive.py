@@ -0,0 +1,130 @@
+"""Hot/cold tiering of service requests: finished requests move to an archive collection."""
+import asyncio
+import base64
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+# on_archived(requests) -> invalidação das listagens dos envolvidos
+OnArchived = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+class RequestArchiver:
+    """Moves requests in a terminal status, untouched for `older_than_days`, from `hot` to `archive`.
+
+    A pass copies `batch_size` documents at a time and sleeps `pause` between
+    batches, so live traffic never waits on a long write. Each batch is upserted
+    into the archive by `_id` before it is deleted from the hot collection, and
+    the delete only matches the `updated_seq` that was copied: a crash in between
+    leaves a duplicate the next pass settles, and a request written during the
+    copy stays hot (its stale archive copy is dropped).
+    """
+
+    def __init__(self, hot, archive, terminal_statuses: Iterable[str], older_than_days: float = 30,
+                 batch_size: int = 500, pause: float = 0.05, on_archived: Optional[OnArchived] = None):
+        self.hot = hot
+        self.archive = archive
+        self.terminal_statuses = [str(getattr(status, "value", status)) for status in terminal_statuses]
+        self.older_than = timedelta(days=older_than_days)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.on_archived = on_archived
+        self.stats = {"passes": 0, "archived": 0, "raced": 0, "failed_passes": 0, "last_pass_at": None}
+
+    def _due(self, now: datetime) -> Dict[str, Any]:
+        return {"status": {"$in": self.terminal_statuses}, "updated_at": {"$lt": now - self.older_than}}
+
+    async def archive_batch(self, now: Optional[datetime] = None) -> int:
+        """Move one batch; returns how many documents were due (less than `batch_size` means done)"""
+        now = now or datetime.utcnow()
+        batch = await self.hot.find(self._due(now)).limit(self.batch_size).to_list(None)
+        if not batch:
+            return 0
+        await self.archive.bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, {**doc, "archived_at": now}, upsert=True) for doc in batch],
+            ordered=False
+        )
+        result = await self.hot.delete_many(
+            {"$or": [{"_id": doc["_id"], "updated_seq": doc.get("updated_seq")} for doc in batch]}
+        )
+        moved = batch
+        if result.deleted_count < len(batch):
+            # Alterados durante a cópia: continuam quentes e a cópia velha sai do arquivo
+            ids = [doc["_id"] for doc in batch]
+            still_hot = {doc["_id"] async for doc in self.hot.find({"_id": {"$in": ids}}, {"_id": 1})}
+            await self.archive.delete_many({"_id": {"$in": list(still_hot)}})
+            moved = [doc for doc in batch if doc["_id"] not in still_hot]
+            self.stats["raced"] += len(still_hot)
+        self.stats["archived"] += len(moved)
+        if moved and self.on_archived:
+            await self.on_archived(moved)
+        return len(batch)
+
+    async def archive_once(self, now: Optional[datetime] = None) -> int:
+        """One full pass over the due requests; returns how many were moved"""
+        archived = self.stats["archived"]
+        while await self.archive_batch(now) >= self.batch_size:
+            await asyncio.sleep(self.pause)
+        self.stats["passes"] += 1
+        self.stats["last_pass_at"] = datetime.utcnow()
+        return self.stats["archived"] - archived
+
+    async def run(self, interval: float = 3600.0):
+        while True:
+            try:
+                moved = await self.archive_once()
+                if moved:
+                    logger.info(f"Archived {moved} finished service requests")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed_passes"] += 1
+                logger.warning(f"Request archival pass failed: {e}")
+            await asyncio.sleep(interval)
+
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(f"{doc['created_at'].isoformat()}|{doc['id']}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """(created_at, id) of the last document of the previous page; ValueError if malformed"""
+    try:
+        created_at, request_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), request_id
+    except (UnicodeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor!r}") from e
+
+
+async def history_page(tiers: List[Any], query: Dict[str, Any], limit: int,
+                       before: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Newest-first page of `query` across every tier (hot first) and the cursor of the next page.
+
+    Keyset pagination on (created_at, id): each tier returns at most `limit + 1`
+    documents after the cursor from its own index and the sorted runs are merged,
+    so a page costs the same whether the history is hot, archived or both. A
+    request caught mid-move (in both tiers) is returned once.
+    """
+    if before:
+        created_at, request_id = decode_cursor(before)
+        query = {**query, "$or": [{"created_at": {"$lt": created_at}},
+                                  {"created_at": created_at, "id": {"$lt": request_id}}]}
+    runs = [
+        await tier.find(query, {"_id": 0}).sort([("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(None)
+        for tier in tiers
+    ]
+    page: List[Dict[str, Any]] = []
+    seen = set()
+    for doc in heapq.merge(*runs, key=lambda doc: (doc["created_at"], doc["id"]), reverse=True):
+        if doc["id"] in seen:
+            continue
+        seen.add(doc["id"])
+        if len(page) == limit:
+            return page, encode_cursor(page[-1])
+        page.append(doc)
+    return page, None
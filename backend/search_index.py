@@ -0,0 +1,212 @@
+"""In-process inverted index over provider category/description with trigram typo tolerance."""
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+import numpy as np
+
+from geo_kernel import within_radius
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Peso de cada campo na pontuação
+FIELD_WEIGHTS = {"category": 3.0, "description": 1.0}
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents ("Eletricísta" -> "eletricista")"""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(normalize(text)) if len(t) >= 2]
+
+
+def trigrams(token: str) -> FrozenSet[str]:
+    padded = f"  {token} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class ProviderSearchIndex:
+    """Token -> {slot: field weight} postings plus a trigram -> token map of the vocabulary.
+
+    Query tokens are expanded to vocabulary tokens whose trigram sets are similar
+    (Dice coefficient), which covers misspellings and prefixes typed so far. Documents
+    live in numbered slots with their coordinates and category in NumPy columns, so
+    scoring, the category/distance filters and top-N run vectorized without Mongo.
+    Posting arrays are rebuilt lazily, only for tokens whose documents changed.
+    """
+
+    def __init__(self, min_similarity: float = 0.5, max_expansions: int = 20, capacity: int = 1024,
+                 common_gram_tokens: int = 1000, expansion_cache_size: int = 10000):
+        self.min_similarity = min_similarity
+        self.max_expansions = max_expansions
+        self.common_gram_tokens = common_gram_tokens
+        self.expansion_cache_size = expansion_cache_size
+        self._vocabulary_version = 0
+        self._expansion_cache: Dict[str, Tuple[int, List[Tuple[str, float]]]] = {}
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._gram_tokens: Dict[str, Set[str]] = defaultdict(set)
+        self._token_grams: Dict[str, FrozenSet[str]] = {}
+
+        self._slots: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._doc_tokens: Dict[int, Tuple[str, ...]] = {}
+        self._category_codes: Dict[str, int] = {}
+        self._lat = np.zeros(capacity)
+        self._lon = np.zeros(capacity)
+        self._category = np.full(capacity, -1, dtype=np.int32)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _allocate(self, doc_id: str) -> int:
+        if self._free:
+            slot = self._free.pop()
+            self._ids[slot] = doc_id
+        else:
+            slot = len(self._ids)
+            self._ids.append(doc_id)
+            if slot >= len(self._lat):
+                grow = len(self._lat)
+                self._lat = np.concatenate([self._lat, np.zeros(grow)])
+                self._lon = np.concatenate([self._lon, np.zeros(grow)])
+                self._category = np.concatenate([self._category, np.full(grow, -1, dtype=np.int32)])
+        self._slots[doc_id] = slot
+        return slot
+
+    def upsert(self, doc_id: str, category: str, description: str, latitude: float, longitude: float):
+        self.remove(doc_id)
+        weights: Dict[str, float] = {}
+        for field, text in (("category", category), ("description", description)):
+            for token in tokenize(text):
+                weights[token] = max(weights.get(token, 0.0), FIELD_WEIGHTS[field])
+
+        slot = self._allocate(doc_id)
+        for token, weight in weights.items():
+            if token not in self._token_grams:
+                grams = trigrams(token)
+                self._token_grams[token] = grams
+                for gram in grams:
+                    self._gram_tokens[gram].add(token)
+                self._postings[token] = {}
+                self._vocabulary_version += 1
+            self._postings[token][slot] = weight
+            self._arrays.pop(token, None)
+        self._doc_tokens[slot] = tuple(weights)
+        self._lat[slot] = latitude
+        self._lon[slot] = longitude
+        self._category[slot] = self._category_codes.setdefault(normalize(category), len(self._category_codes))
+
+    def update_location(self, doc_id: str, latitude: float, longitude: float):
+        slot = self._slots.get(doc_id)
+        if slot is not None:
+            self._lat[slot] = latitude
+            self._lon[slot] = longitude
+
+    def remove(self, doc_id: str):
+        slot = self._slots.pop(doc_id, None)
+        if slot is None:
+            return
+        for token in self._doc_tokens.pop(slot, ()):
+            postings = self._postings[token]
+            postings.pop(slot, None)
+            self._arrays.pop(token, None)
+            if not postings:
+                # Token sem documentos sai do vocabulário
+                del self._postings[token]
+                self._vocabulary_version += 1
+                for gram in self._token_grams.pop(token, ()):
+                    tokens = self._gram_tokens[gram]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._gram_tokens[gram]
+        self._ids[slot] = None
+        self._category[slot] = -1
+        self._free.append(slot)
+
+    def _posting_arrays(self, token: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(token)
+        if arrays is None:
+            postings = self._postings[token]
+            arrays = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float32, count=len(postings)),
+            )
+            self._arrays[token] = arrays
+        return arrays
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        cached = self._expansion_cache.get(token)
+        if cached and cached[0] == self._vocabulary_version:
+            return cached[1]
+
+        grams = trigrams(token)
+        # Trigramas muito comuns ("  e") só geram candidatos se não houver outros
+        rare = [g for g in grams if len(self._gram_tokens.get(g, ())) <= self.common_gram_tokens]
+        candidates: Set[str] = set()
+        for gram in rare or grams:
+            candidates.update(self._gram_tokens.get(gram, ()))
+        expansions = []
+        for candidate in candidates:
+            if candidate == token:
+                expansions.append((candidate, 1.0))
+                continue
+            candidate_grams = self._token_grams[candidate]
+            dice = 2.0 * len(grams & candidate_grams) / (len(grams) + len(candidate_grams))
+            # Prefixo digitado até agora conta como quase exato
+            if len(token) >= 3 and candidate.startswith(token):
+                dice = max(dice, 0.9)
+            if dice >= self.min_similarity:
+                expansions.append((candidate, dice))
+        expansions.sort(key=lambda item: item[1], reverse=True)
+        expansions = expansions[:self.max_expansions]
+
+        if len(self._expansion_cache) >= self.expansion_cache_size:
+            self._expansion_cache.clear()
+        self._expansion_cache[token] = (self._vocabulary_version, expansions)
+        return expansions
+
+    def search(
+        self,
+        query: str,
+        limit: int = 20,
+        latitude: Optional[float] = None,
+        longitude: Optional[float] = None,
+        radius_km: Optional[float] = None,
+        category: Optional[str] = None,
+    ) -> List[Tuple[str, float, Optional[float]]]:
+        """(doc_id, score, distance_km) best first; distance is None without coordinates"""
+        size = len(self._ids)
+        total = np.zeros(size, dtype=np.float32)
+        for token in dict.fromkeys(tokenize(query)):
+            # Melhor expansão de cada token por documento, somada entre tokens
+            best = np.zeros(size, dtype=np.float32)
+            for candidate, similarity in self._expand(token):
+                slots, weights = self._posting_arrays(candidate)
+                best[slots] = np.maximum(best[slots], weights * similarity)
+            total += best
+
+        slots = np.flatnonzero(total)
+        if category:
+            code = self._category_codes.get(normalize(category), -2)
+            slots = slots[self._category[slots] == code]
+
+        distances = None
+        if latitude is not None and longitude is not None:
+            inside, distances = within_radius(latitude, longitude, self._lat[slots], self._lon[slots], radius_km)
+            slots = slots[inside]
+
+        scores = total[slots]
+        if len(slots) > limit:
+            keep = np.argpartition(-scores, limit - 1)[:limit]
+            slots, scores = slots[keep], scores[keep]
+            distances = distances[keep] if distances is not None else None
+        order = np.lexsort((distances if distances is not None else np.zeros(len(slots)), -scores))
+        return [
+            (self._ids[slots[i]], float(scores[i]), float(distances[i]) if distances is not None else None)
+            for i in order
+        ]
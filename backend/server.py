@@ -1,15 +1,20 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 
 from motor.motor_asyncio import AsyncIOMotorClient
 import socketio
 import os
+import socket
 import logging
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Awaitable, Callable, Tuple, Union
 import uuid
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
@@ -19,24 +24,140 @@ from enum import Enum
 import googlemaps
 import math
 import json
+import asyncio
+import random
 import redis.asyncio as aioredis
 from aiokafka import AIOKafkaProducer
+from pymongo import ReturnDocument
+
+from active_routes import ActiveRequestRoutes
+from analytics import AnalyticsRollups, InMemoryEventBus, REQUEST_EVENTS_CHANNEL, kafka_events, redis_events
+from chat import MAX_MESSAGE_LENGTH, ChatBackpressure, ChatStore, Throttle, message_view
+from collection_versions import CollectionVersions, etag_matches, provider_cell, provider_cells_in_radius
+from demand_heatmap import DemandHeatmap
+from emit_scheduler import BATCH_EVENT, EmitScheduler
+from geofence import Geofence
+from geo_index import ProviderGeoIndex
+from geo_kernel import bearing_deg, coordinate_columns, with_distances, within_radius
+from geohash import region_of
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore
+from log_pipeline import LogPipeline, parse_rates
+from leaderboard import ProviderLeaderboard, bayesian_score, ranking_fields
+from outbox import OutboxDispatcher, outbox_event
+from pending_events import PendingEvents, is_personal_room
+from photo_storage import (InvalidUpload, PhotoStore, UnsupportedImage, UploadTooLarge, drain, multipart_boundary,
+                           stream_file_part)
+from profiler import LoopMonitor, RouteProfiler, RouteProfilerMiddleware, collapsed, profile_for, speedscope
+from provider_registry import ProviderRegistry
+from request_archive import RequestArchiver, history_page
+from search_index import ProviderSearchIndex
+from shutdown import GracefulShutdown
+from slow_queries import SlowQueryLog
+from surge_pricing import SUPPLY_EVENT, SurgePricing
+from task_runner import BackgroundTaskRunner
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.getenv('MONGO_URL', 'mongodb://localhost:27017')  # default p/ dev
-client = AsyncIOMotorClient(mongo_url)
+# Comandos acima do limite ficam registrados por forma de consulta (sem ligar o profiler do Mongo)
+slow_queries = SlowQueryLog(threshold_ms=float(os.getenv("SLOW_QUERY_MS", "100")))
+slow_query_task: Optional[asyncio.Task] = None
+client = AsyncIOMotorClient(mongo_url, event_listeners=[slow_queries])
 db = client[os.getenv('DB_NAME', 'freelancerapp')]
 
 # Google Maps client (opcional)
 gmaps_key = os.getenv('GOOGLE_MAPS_API_KEY')
 gmaps = googlemaps.Client(key=gmaps_key) if gmaps_key else None
+# Geocoder travado não segura a resposta (cai no rótulo de coordenadas) nem ocupa o executor padrão do loop
+GEOCODE_TIMEOUT_SECONDS = float(os.getenv("GEOCODE_TIMEOUT_SECONDS", "3"))
+geocode_executor = ThreadPoolExecutor(max_workers=int(os.getenv("GEOCODE_WORKERS", "4")), thread_name_prefix="geocode")
+
+# Fotos de conclusão: disco local endereçado por conteúdo, miniaturas geradas em processos separados
+MEDIA_ROOT = Path(os.getenv("MEDIA_ROOT", str(ROOT_DIR / "media")))
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_MB", "15")) * 1024 * 1024
+# Foto + cabeçalhos/outros campos do multipart
+PHOTO_MAX_BODY = PHOTO_MAX_BYTES + 64 * 1024
+photo_executor = ProcessPoolExecutor(max_workers=int(os.getenv("PHOTO_WORKERS", "2")))
+photos: Optional[PhotoStore] = None
 
 # Messaging clients
 redis_client: Optional[aioredis.Redis] = None
 kafka_producer: Optional[AIOKafkaProducer] = None
+geo_index: Optional[ProviderGeoIndex] = None
+leaderboard: Optional[ProviderLeaderboard] = None
+# Estado compacto dos prestadores online (matching sem Redis)
+provider_registry = ProviderRegistry()
+# Matching reusa a mesma cópia das colunas por esse tempo; o status é conferido no Mongo de qualquer forma
+PROVIDER_SNAPSHOT_MAX_AGE = float(os.getenv("PROVIDER_SNAPSHOT_MAX_AGE_SECONDS", "0.5"))
+# Busca textual em memória (categoria/descrição), reconstruída no startup
+search_index = ProviderSearchIndex()
+collection_versions = CollectionVersions()
+outbox: Optional[OutboxDispatcher] = None
+# Respostas por Idempotency-Key (retries de POST /requests e /ratings); recriado no startup com o db atual
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+idempotency = IdempotencyStore(db.idempotency_keys, ttl_seconds=IDEMPOTENCY_TTL_SECONDS)
+mongo_transactions = False
+# O updated_seq é reservado antes do commit: o cursor de /requests/changes só passa de escritas mais velhas que isso
+REQUEST_CHANGES_LAG_SECONDS = float(os.getenv("REQUEST_CHANGES_LAG_SECONDS", "5"))
+# Eventos para salas pessoais sem socket conectado, entregues no próximo connect; recriado no startup
+PENDING_EVENTS_TTL_SECONDS = int(os.getenv("PENDING_EVENTS_TTL_SECONDS", "86400"))
+PENDING_EVENTS_MAX = int(os.getenv("PENDING_EVENTS_MAX", "100"))
+pending_events = PendingEvents(db.pending_events, ttl_seconds=PENDING_EVENTS_TTL_SECONDS, max_per_room=PENDING_EVENTS_MAX)
+# Chat por pedido: mensagens gravadas em lote (group commit), recriado no startup com o db atual
+chat = ChatStore(db.chat_messages, db.chat_reads)
+# "Digitando..." no máximo uma vez a cada TYPING_INTERVAL_SECONDS por usuário e pedido
+typing_throttle = Throttle(float(os.getenv("TYPING_INTERVAL_SECONDS", "2")))
+# Pedidos finalizados há mais de ARCHIVE_AFTER_DAYS saem de service_requests para o arquivo
+archiver: Optional[RequestArchiver] = None
+archive_task: Optional[asyncio.Task] = None
+# GET /requests pagina as duas camadas pelo cursor (created_at, id) do histórico
+REQUESTS_PAGE_SIZE = int(os.getenv("REQUESTS_PAGE_SIZE", "100"))
+REQUESTS_PAGE_MAX = int(os.getenv("REQUESTS_PAGE_MAX", "200"))
+
+# Side effects executed after the response (geocoding, fan-out, notifications)
+background = BackgroundTaskRunner(
+    max_concurrency=int(os.getenv('BACKGROUND_CONCURRENCY', '32')),
+    max_pending=int(os.getenv('BACKGROUND_MAX_PENDING', '10000'))
+)
+
+# Identidade estável do worker: os grupos Kafka por worker são retomados no restart em vez de ficarem órfãos.
+# Com vários workers no mesmo host, cada um precisa de um WORKER_INDEX (ou WORKER_ID) próprio
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getenv('WORKER_INDEX', '0')}"
+# Local stand-in for the broker when neither Redis nor Kafka is configured
+local_events = InMemoryEventBus()
+analytics: Optional[AnalyticsRollups] = None
+analytics_task: Optional[asyncio.Task] = None
+# Demanda por célula (pendentes + janelas recentes), alimentada pelo stream de eventos
+demand_heatmap = DemandHeatmap(windows=[int(w) for w in os.getenv("DEMAND_WINDOWS_SECONDS", "900,3600").split(",")])
+heatmap_task: Optional[asyncio.Task] = None
+# Multiplicador de preço por célula/categoria (pedidos abertos na janela x prestadores disponíveis)
+surge = SurgePricing(
+    lambda channel, message: publish_event(channel, message),
+    window_seconds=int(os.getenv("SURGE_WINDOW_SECONDS", "900")),
+    max_multiplier=float(os.getenv("SURGE_MAX_MULTIPLIER", "2.0"))
+)
+surge_tasks: List[asyncio.Task] = []
+
+# Debug/metrics surface is disabled unless a token is configured
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN')
+
+# Rolling deploy: prazo total para drenar sockets, filas e produtores no desligamento
+graceful = GracefulShutdown(grace_seconds=float(os.getenv("SHUTDOWN_GRACE_SECONDS", "15")))
+# Clientes desconectados no drain reconectam espalhados nesse intervalo
+DRAIN_RECONNECT_JITTER_MS = int(os.getenv("DRAIN_RECONNECT_JITTER_MS", "5000"))
+
+# Localização padrão do cliente quando o app não envia coordenadas
+DEFAULT_CLIENT_LATITUDE = -23.5489
+DEFAULT_CLIENT_LONGITUDE = -46.6388
+DEFAULT_SEARCH_RADIUS_KM = 50.0
+
+# Campos do perfil que alimentam os índices derivados (geo, rankings, registry)
+PROVIDER_INDEX_PROJECTION = {
+    "_id": 0, "user_id": 1, "category": 1, "status": 1, "price": 1,
+    "latitude": 1, "longitude": 1, "rating": 1, "total_ratings": 1, "rating_score": 1
+}
 
 # JWT Configuration
 SECRET_KEY = "your-secret-key-here-change-in-production"
@@ -51,13 +172,26 @@ security = HTTPBearer()
 sio = socketio.AsyncServer(
     async_mode='asgi',
     cors_allowed_origins="*",
-    logger=True,
-    engineio_logger=True
+    # Log por pacote só quando o nível desses loggers for baixado (ver /api/debug/logging)
+    logger=logging.getLogger("socketio.server"),
+    engineio_logger=logging.getLogger("engineio.server")
+)
+
+# Emits de localização são agrupados por sala a cada tick; os de salas pessoais vazias ficam guardados
+emits = EmitScheduler(
+    lambda event, data, room: sio.emit(event, data, room=room),
+    lambda room: room_has_members(room),
+    tick=float(os.getenv("EMIT_TICK_SECONDS", "0.1")),
+    on_empty=lambda undelivered: pending_events.hold(undelivered)
 )
 
 # Create the main app
 app = FastAPI(title="FreelancerApp API")
 
+# Profiling sob demanda (endpoints /api/debug/*)
+route_profiler = RouteProfiler()
+loop_monitor = LoopMonitor()
+
 # Create socket app
 socket_app = socketio.ASGIApp(sio, app)
 
@@ -83,6 +217,22 @@ class RequestStatus(str, Enum):
     COMPLETED = "completed"
     CANCELLED = "cancelled"
 
+# Pedidos em aberto (índices parciais da coleção quente) e finalizados (arquiváveis)
+OPEN_REQUEST_STATUSES = (RequestStatus.PENDING, RequestStatus.ACCEPTED, RequestStatus.IN_PROGRESS,
+                         RequestStatus.NEAR_CLIENT, RequestStatus.STARTED)
+TERMINAL_REQUEST_STATUSES = (RequestStatus.COMPLETED, RequestStatus.CANCELLED)
+# Pedidos cujo cliente acompanha a localização do prestador
+ACTIVE_REQUEST_STATUSES = (RequestStatus.ACCEPTED, RequestStatus.IN_PROGRESS, RequestStatus.NEAR_CLIENT)
+# Prestador -> pedidos ativos (local; no Redis quando configurado)
+active_routes = ActiveRequestRoutes(ACTIVE_REQUEST_STATUSES)
+# Cerca em volta do cliente: entra em NEAR_CLIENT a GEOFENCE_ENTER_KM, sai só além de GEOFENCE_EXIT_KM
+geofence = Geofence(
+    enter_radius_km=float(os.getenv("GEOFENCE_ENTER_KM", "0.2")),
+    exit_radius_km=float(os.getenv("GEOFENCE_EXIT_KM", "0.3")),
+    near_status=RequestStatus.NEAR_CLIENT,
+    approach_statuses=(RequestStatus.ACCEPTED, RequestStatus.IN_PROGRESS)
+)
+
 # Models
 class UserBase(BaseModel):
     name: str
@@ -128,6 +278,8 @@ class ServiceProviderProfile(BaseModel):
     status: ServiceStatus = ServiceStatus.AVAILABLE
     rating: float = 0.0
     total_ratings: int = 0
+    rating_score: float = Field(default_factory=lambda: bayesian_score(0.0, 0))
+    region: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ServiceRequest(BaseModel):
@@ -142,11 +294,15 @@ class ServiceRequest(BaseModel):
     provider_latitude: Optional[float] = None
     provider_longitude: Optional[float] = None
     price: float
+    base_price: Optional[float] = None
+    surge_multiplier: float = 1.0
     status: RequestStatus = RequestStatus.PENDING
     created_at: datetime = Field(default_factory=datetime.utcnow)
     accepted_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
     photo_url: Optional[str] = None
+    updated_seq: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Rating(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -164,6 +320,11 @@ class LocationUpdate(BaseModel):
 class ProviderStatusUpdate(BaseModel):
     status: ServiceStatus
 
+class LoggingUpdate(BaseModel):
+    level: Optional[str] = None
+    levels: Dict[str, str] = {}
+    sample_rates: Dict[str, float] = {}
+
 # Helper functions
 def get_password_hash(password):
     return pwd_context.hash(password)
@@ -204,14 +365,371 @@ async def publish_event(channel: str, message: Dict[str, Any]):
         await redis_client.publish(channel, json.dumps(message))
     if kafka_producer:
         await kafka_producer.send_and_wait(channel, json.dumps(message).encode())
+    if not redis_client and not kafka_producer:
+        local_events.publish(channel, message)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def publish_events(messages: List[Tuple[str, Dict[str, Any]]]):
+    """Publish a batch of events: one Redis pipeline and one Kafka flush"""
+    if not messages:
+        return
+    if redis_client:
+        pipe = redis_client.pipeline(transaction=False)
+        for channel, message in messages:
+            pipe.publish(channel, json.dumps(message))
+        await pipe.execute()
+    if kafka_producer:
+        pending = [await kafka_producer.send(channel, json.dumps(message).encode()) for channel, message in messages]
+        await asyncio.gather(*pending)
+    if not redis_client and not kafka_producer:
+        for channel, message in messages:
+            local_events.publish(channel, message)
+
+async def deliver_outbox_events(events: List[Dict[str, Any]]) -> List[str]:
+    """Socket emits and broker publishes for a batch of outbox events; returns the delivered ids"""
+    delivered = []
+    to_publish = []
+    held = []
+    for event in events:
+        payload = {**event["payload"], "event_id": event["_id"]}
+        room = event.get("room")
+        if event.get("emit", True) and is_personal_room(room) and not room_has_members(room):
+            # Destinatário offline: guarda para o próximo connect em vez de emitir para ninguém
+            held.append((event, payload))
+            continue
+        try:
+            if event.get("emit", True):
+                await sio.emit(event["event"], payload, room=room)
+        except Exception as e:
+            logger.warning(f"Outbox emit of {event['event']} failed: {e}")
+            continue
+        if event.get("channel"):
+            to_publish.append((event, payload))
+        else:
+            delivered.append(event["_id"])
+    if held:
+        try:
+            await pending_events.hold([(event["room"], event["event"], payload, None) for event, payload in held])
+        except Exception as e:
+            logger.warning(f"Could not hold outbox events for offline users: {e}")
+            held = []
+        for event, payload in held:
+            if event.get("channel"):
+                to_publish.append((event, payload))
+            else:
+                delivered.append(event["_id"])
+    if to_publish:
+        try:
+            await publish_events([(event["channel"], payload) for event, payload in to_publish])
+            delivered.extend(event["_id"] for event, _ in to_publish)
+        except Exception as e:
+            logger.warning(f"Outbox publish failed: {e}")
+    return delivered
+
+async def commit_with_events(
+    write: Callable[[Any], Awaitable[Any]],
+    events: Union[List[Dict[str, Any]], Callable[[Any], List[Dict[str, Any]]]]
+):
+    """Run a state write and store its outbox events together (in a transaction when Mongo supports it).
+
+    `events` may be a function of the write result, e.g. no events when a conditional update missed.
+    The all-or-nothing guarantee needs a replica set (or mongos): on a standalone
+    server the write and the enqueue are two operations, and a crash between them
+    loses the events. Startup logs an error in that case, or refuses to start with
+    MONGO_TRANSACTIONS_REQUIRED=1.
+    """
+    if mongo_transactions:
+        async with await client.start_session() as session:
+            async with session.start_transaction():
+                result = await write(session)
+                await outbox.enqueue(events(result) if callable(events) else events, session=session)
+    else:
+        result = await write(None)
+        await outbox.enqueue(events(result) if callable(events) else events)
+    outbox.notify()
+    return result
+
+def request_lifecycle_event(kind: str, request: Dict[str, Any], status: str) -> Dict[str, Any]:
+    """Broker-only event consumed by analytics (created/accepted/completed/cancelled/...)"""
+    return outbox_event(kind, {
+        'type': kind,
+        'request_id': request["id"],
+        'category': request["category"],
+        'price': request["price"],
+        'status': status,
+        'client_latitude': request["client_latitude"],
+        'client_longitude': request["client_longitude"],
+        'at': datetime.utcnow().isoformat()
+    }, channel=REQUEST_EVENTS_CHANNEL, emit=False)
+
+async def enqueue_events(events: List[Dict[str, Any]]):
+    """Outbox events produced by background work (no state write to pair them with)"""
+    await outbox.enqueue(events)
+    outbox.notify()
+
+async def publish_supply(profile: Dict[str, Any], status: Optional[str] = None):
+    """Put a provider's supply change on the shared stream; every worker's surge pricer applies it from there"""
+    event = surge.announce(profile, status)
+    if event:
+        await enqueue_events([outbox_event(SUPPLY_EVENT, event, channel=REQUEST_EVENTS_CHANNEL, emit=False)])
+
+async def detect_mongo_transactions() -> bool:
+    """Transactions need a replica set or a mongos"""
+    try:
+        hello = await client.admin.command("hello")
+    except Exception:
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+async def sync_provider_indexes(profile: Optional[Dict[str, Any]]):
+    """Reflect a provider profile in the local registry and, with Redis, the GEO hot set and rankings"""
+    if not profile:
+        return
+    try:
+        provider_registry.sync(profile)
+    except Exception as e:
+        logger.warning(f"Provider registry update failed for {profile.get('user_id')}: {e}")
+    try:
+        await publish_supply(profile)
+    except Exception as e:
+        logger.warning(f"Surge supply update failed for {profile.get('user_id')}: {e}")
+    if geo_index:
+        try:
+            await geo_index.sync(profile)
+        except Exception as e:
+            logger.warning(f"Geo index update failed for {profile.get('user_id')}: {e}")
+    if leaderboard:
+        try:
+            await leaderboard.sync(profile)
+        except Exception as e:
+            logger.warning(f"Leaderboard update failed for {profile.get('user_id')}: {e}")
+
+async def backfill_ranking_fields():
+    """Profiles created before rankings existed get rating_score/region"""
+    async for profile in db.provider_profiles.find({"rating_score": {"$exists": False}}, PROVIDER_INDEX_PROJECTION):
+        if profile.get("latitude") is None:
+            continue
+        await db.provider_profiles.update_one({"user_id": profile["user_id"]}, {"$set": ranking_fields(profile)})
+
+async def find_available_providers(
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    category: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """AVAILABLE provider profiles within radius, nearest first, with `distance` in km"""
+    hits = None
+    if geo_index:
+        try:
+            hits = await geo_index.search(latitude, longitude, radius_km, category)
+        except Exception as e:
+            logger.warning(f"Geo index search failed, falling back to Mongo: {e}")
+    elif provider_registry.ready:
+        hits = provider_registry.snapshot(max_age=PROVIDER_SNAPSHOT_MAX_AGE).nearby(latitude, longitude, radius_km, category)
+    if hits is not None:
+        distances = dict(hits)
+        profiles = {}
+        async for profile in db.provider_profiles.find(
+            {"user_id": {"$in": list(distances)}, "status": ServiceStatus.AVAILABLE},
+            {"_id": 0}
+        ):
+            profiles[profile["user_id"]] = {**profile, "distance": distances[profile["user_id"]]}
+        return [profiles[user_id] for user_id, _ in hits if user_id in profiles]
+
+    query: Dict[str, Any] = {"status": ServiceStatus.AVAILABLE}
+    if category:
+        query["category"] = category
+    profiles = await db.provider_profiles.find(query, {"_id": 0}).to_list(None)
+    return with_distances(latitude, longitude, profiles, radius_km, nearest_first=True)
+
+async def bump_provider_versions(*points):
+    """Invalidate provider listings around the given (latitude, longitude) points"""
+    scopes = ["providers"] + [
+        f"providers:cell:{provider_cell(lat, lon)}" for lat, lon in points if lat is not None and lon is not None
+    ]
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        await collection_versions.bump(*scopes)
+    except Exception as e:
+        logger.warning(f"Could not bump provider versions: {e}")
+
+async def bump_request_versions(request: Dict[str, Any]):
+    """Invalidate the request listings of both parties of a service request"""
+    try:
+        await collection_versions.bump(
+            f"requests:user:{request['client_id']}",
+            f"requests:user:{request['provider_id']}"
+        )
+    except Exception as e:
+        logger.warning(f"Could not bump request versions: {e}")
+
+async def listing_etag(scopes: List[str], variant: str = "") -> Optional[str]:
+    try:
+        return await collection_versions.etag(scopes, variant)
+    except Exception as e:
+        logger.warning(f"Could not compute ETag: {e}")
+        return None
+
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    """304 response when the client's If-None-Match still matches"""
+    if etag and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return None
+
+def set_etag(response: Response, etag: Optional[str]):
+    if etag:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+
+async def next_request_seq() -> int:
+    """Monotonic sequence stamped on every write to service_requests (delta sync cursor)"""
+    counter = await db.counters.find_one_and_update(
+        {"_id": "service_requests"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+async def request_change_fields() -> Dict[str, Any]:
+    return {"updated_seq": await next_request_seq(), "updated_at": datetime.utcnow()}
+
+async def tombstone_requests(requests: List[Dict[str, Any]]):
+    """Record removed requests so delta sync clients drop them"""
+    for removed in requests:
+        await db.service_request_tombstones.insert_one({
+            "request_id": removed["id"],
+            "user_ids": [removed["client_id"], removed["provider_id"]],
+            "deleted_seq": await next_request_seq(),
+            "deleted_at": datetime.utcnow()
+        })
+        await bump_request_versions(removed)
+
+async def find_request(query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """A service request from the hot collection, falling back to the archive"""
+    for tier in (db.service_requests, db.service_requests_archive):
+        request = await tier.find_one(query, {"_id": 0})
+        if request:
+            return request
+    return None
+
+async def after_requests_archived(requests: List[Dict[str, Any]]):
+    """Archived requests leave the hot listings of both parties"""
+    users = {user_id for r in requests for user_id in (r["client_id"], r["provider_id"])}
+    try:
+        await collection_versions.bump(*(f"requests:user:{user_id}" for user_id in users))
+    except Exception as e:
+        logger.warning(f"Could not bump request versions: {e}")
+
+async def backfill_request_seq():
+    """Stamp documents created before delta sync existed"""
+    async for legacy in db.service_requests.find({"updated_seq": {"$exists": False}}, {"_id": 0, "id": 1}):
+        await db.service_requests.update_one(
+            {"id": legacy["id"], "updated_seq": {"$exists": False}},
+            {"$set": await request_change_fields()}
+        )
+
+async def enrich_requests(current_user: User, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Join the counterpart's name/phone (and category for clients) with batched lookups.
+
+    A request whose counterpart user or profile is missing is returned without
+    those fields rather than dropped: delta sync cursors move past every row.
+    """
+    if current_user.user_type == UserType.PRESTADOR:
+        client_ids = list({r["client_id"] for r in requests})
+        clients = {u["id"]: u async for u in db.users.find({"id": {"$in": client_ids}}, {"_id": 0, "id": 1, "name": 1, "phone": 1})}
+        return [
+            {**r, "client_name": clients[r["client_id"]]["name"], "client_phone": clients[r["client_id"]]["phone"]}
+            if r["client_id"] in clients else r
+            for r in requests
+        ]
+
+    provider_ids = list({r["provider_id"] for r in requests})
+    users = {u["id"]: u async for u in db.users.find({"id": {"$in": provider_ids}}, {"_id": 0, "id": 1, "name": 1, "phone": 1})}
+    profiles = {
+        p["user_id"]: p
+        async for p in db.provider_profiles.find({"user_id": {"$in": provider_ids}}, {"_id": 0, "user_id": 1, "category": 1})
+    }
+    enriched = []
+    for r in requests:
+        provider = users.get(r["provider_id"])
+        profile = profiles.get(r["provider_id"])
+        enriched.append({
+            **r,
+            **({"provider_name": provider["name"], "provider_phone": provider["phone"]} if provider else {}),
+            **({"provider_category": profile["category"]} if profile else {})
+        })
+    return enriched
+
+async def drain_sockets() -> Dict[str, int]:
+    """Flush queued emits, then tell every socket to reconnect elsewhere (with jitter) and disconnect it"""
+    flushed = await emits.flush()
+    sids = list(sio.manager.rooms.get('/', {}).get(None) or {})
+    for sid in sids:
+        await sio.emit('server_draining', {'reconnect_after_ms': random.randint(0, DRAIN_RECONNECT_JITTER_MS)}, to=sid)
+    for sid in sids:
+        await sio.disconnect(sid)
+    return {"flushed_packets": flushed, "notified": len(sids)}
+
+def room_has_members(room: str, exclude_sid: Optional[str] = None) -> bool:
+    participants = sio.manager.rooms.get('/', {}).get(room) or {}
+    return any(sid != exclude_sid for sid in participants)
+
+async def ensure_indexes():
+    await db.users.create_index("id")
+    await db.users.create_index("email")
+    await db.provider_profiles.create_index("user_id")
+    await db.provider_profiles.create_index([("status", 1), ("category", 1)])
+    await db.provider_profiles.create_index([("category", 1), ("rating_score", -1)])
+    await db.provider_profiles.create_index([("category", 1), ("region", 1), ("rating_score", -1)])
+    await db.service_requests.create_index("id")
+    await db.service_requests.create_index("client_id")
+    await db.service_requests.create_index([("client_id", 1), ("updated_seq", 1)])
+    await db.service_requests.create_index([("provider_id", 1), ("updated_seq", 1)])
+    # Carga do heatmap no startup: pendentes + criados nas janelas recentes
+    await db.service_requests.create_index("created_at")
+    # Status só indexado nos estados abertos (rotas ativas, pendentes do heatmap); substitui os índices completos
+    existing = await db.service_requests.index_information()
+    for legacy in ("status_1", "provider_id_1_status_1"):
+        if legacy in existing:
+            await db.service_requests.drop_index(legacy)
+    open_only = {"status": {"$in": [status.value for status in OPEN_REQUEST_STATUSES]}}
+    await db.service_requests.create_index("status", name="status_open", partialFilterExpression=open_only)
+    await db.service_requests.create_index([("provider_id", 1), ("status", 1)], name="provider_id_status_open",
+                                           partialFilterExpression=open_only)
+    # Varredura do arquivador: só os finalizados
+    await db.service_requests.create_index(
+        [("status", 1), ("updated_at", 1)], name="status_updated_at_terminal",
+        partialFilterExpression={"status": {"$in": [status.value for status in TERMINAL_REQUEST_STATUSES]}}
+    )
+    for tier in (db.service_requests, db.service_requests_archive):
+        # Histórico paginado por (created_at, id) em cada camada
+        await tier.create_index([("client_id", 1), ("created_at", -1), ("id", -1)])
+        await tier.create_index([("provider_id", 1), ("created_at", -1), ("id", -1)])
+    await db.service_requests_archive.create_index("id")
+    await db.service_requests_archive.create_index([("client_id", 1), ("updated_seq", 1)])
+    await db.service_requests_archive.create_index([("provider_id", 1), ("updated_seq", 1)])
+    await db.service_request_tombstones.create_index([("user_ids", 1), ("deleted_seq", 1)])
+    await db.ratings.create_index("provider_id")
+    await idempotency.ensure_indexes()
+    await chat.ensure_indexes()
+    await pending_events.ensure_indexes()
+
+def require_debug_token(x_debug_token: Optional[str] = Header(None)):
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_debug_token != DEBUG_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+
+def token_subject(token: str) -> Optional[str]:
+    """User id (`sub`) of a valid, unexpired access token, else None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
+        return None
+    return payload.get("sub")
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    user_id = token_subject(credentials.credentials)
+    if user_id is None:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
@@ -220,16 +738,148 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     
     return User(**user)
 
+def coordinates_label(latitude: float, longitude: float) -> str:
+    return f"Lat: {latitude}, Lng: {longitude}"
+
 async def get_address_from_coordinates(latitude: float, longitude: float) -> str:
     try:
         if gmaps:
-            result = gmaps.reverse_geocode((latitude, longitude))
+            # googlemaps é síncrono: roda fora do event loop
+            result = await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(geocode_executor, gmaps.reverse_geocode, (latitude, longitude)),
+                timeout=GEOCODE_TIMEOUT_SECONDS
+            )
             if result:
                 return result[0]['formatted_address']
-        return f"Lat: {latitude}, Lng: {longitude}"
+        return coordinates_label(latitude, longitude)
+    except Exception as e:
+        logger.warning(f"Geocoding error: {e!r}", extra={"event": "geocoding_error"})
+        return coordinates_label(latitude, longitude)
+
+async def geocode_request_address(service_request: ServiceRequest):
+    """Replace the provisional coordinates label with the geocoded address (runs after the response)"""
+    client_address = await get_address_from_coordinates(
+        service_request.client_latitude,
+        service_request.client_longitude
+    )
+    if client_address != service_request.client_address:
+        await db.service_requests.update_one(
+            {"id": service_request.id},
+            {"$set": {"client_address": client_address, **await request_change_fields()}}
+        )
+        await bump_request_versions(service_request.dict())
+
+def new_request_event(service_request: ServiceRequest, client_user: User,
+                      provider_profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # calcula distância real entre cliente e prestador (se existir perfil)
+    dist_for_notify = 0.0
+    if provider_profile:
+        dist_for_notify = calculate_distance(
+            service_request.client_latitude,
+            service_request.client_longitude,
+            provider_profile.get("latitude", 0.0),
+            provider_profile.get("longitude", 0.0)
+        )
+    return outbox_event('new_request', {
+        'request_id': service_request.id,
+        'client_name': client_user.name,
+        'client_phone': client_user.phone,
+        'category': service_request.category,
+        'description': service_request.description,
+        'price': service_request.price,
+        'distance': round(dist_for_notify, 1),
+        'client_address': service_request.client_address
+    }, room=f"provider_{service_request.provider_id}")
+
+def request_accepted_event(request: Dict[str, Any], provider_user: User,
+                           provider_profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return outbox_event('request_accepted', {
+        'request_id': request["id"],
+        'provider_name': provider_user.name,
+        'provider_phone': provider_user.phone,
+        'category': request["category"],
+        'estimated_time': 15,  # Mock estimation
+        'provider_latitude': provider_profile["latitude"] if provider_profile else None,
+        'provider_longitude': provider_profile["longitude"] if provider_profile else None
+    }, room=f"client_{request['client_id']}")
+
+async def after_provider_moved(previous: Dict[str, Any], latitude: float, longitude: float):
+    """Hot set, rankings, search index and listing versions follow a provider location change"""
+    search_index.update_location(previous["user_id"], latitude, longitude)
+    await sync_provider_indexes({**previous, "latitude": latitude, "longitude": longitude})
+    await bump_provider_versions(
+        (previous.get("latitude"), previous.get("longitude")),
+        (latitude, longitude)
+    )
+
+async def route_request(request: Dict[str, Any], status: str):
+    """Keep the provider -> active requests table in step with a request status change"""
+    if status not in ACTIVE_REQUEST_STATUSES:
+        geofence.forget(request["id"])
+    try:
+        await active_routes.sync(request, status)
     except Exception as e:
-        print(f"Geocoding error: {e}")
-        return f"Lat: {latitude}, Lng: {longitude}"
+        logger.warning(f"Active route update failed for {request.get('id')}: {e}")
+
+async def fan_out_provider_location(provider_id: str, latitude: float, longitude: float):
+    # Emit location update to active requests (routing table, no Mongo read)
+    routes = await active_routes.for_provider(provider_id)
+    if not routes:
+        return
+    lats, lons = coordinate_columns(routes, "client_latitude", "client_longitude")
+    _, distances = within_radius(latitude, longitude, lats, lons)
+    bearings = bearing_deg(latitude, longitude, lats, lons)
+    for route, distance, bearing in zip(routes, distances.tolist(), bearings.tolist()):
+        message = {
+            'request_id': route["request_id"],
+            'provider_latitude': latitude,
+            'provider_longitude': longitude,
+            'distance': round(distance, 1),
+            'bearing': round(bearing),
+            'estimated_time': max(5, int(distance * 2))  # Mock time estimation
+        }
+
+        # Só a posição mais recente de cada pedido sai no próximo tick
+        emits.queue('provider_location_update', message, f"client_{route['client_id']}", key=route["request_id"])
+        emits.queue('provider_location_update', message, f"request_{route['request_id']}", key=route["request_id"])
+
+        await publish_event('provider_location_update', message)
+
+    for route, status in geofence.evaluate(routes, distances.tolist()):
+        background.submit('geofence_transition', lambda route=route, status=status: geofence_transition(route, status))
+
+async def geofence_transition(route: Dict[str, Any], status: str):
+    """Move a request in/out of NEAR_CLIENT after its provider crossed the client's geofence"""
+    expected = [s for s in ACTIVE_REQUEST_STATUSES if s != status]
+    try:
+        update_data = {"status": status, **await request_change_fields()}
+        # Condicional: não sobrescreve uma mudança manual feita nesse meio-tempo
+        previous = await commit_with_events(
+            lambda session: db.service_requests.find_one_and_update(
+                {"id": route["request_id"], "status": {"$in": expected}},
+                {"$set": update_data},
+                projection={"_id": 0},
+                session=session
+            ),
+            lambda previous: [
+                outbox_event('status_updated', {
+                    'request_id': previous["id"],
+                    'status': status,
+                    'message': "Prestador chegando" if status == RequestStatus.NEAR_CLIENT else "",
+                    'automatic': True
+                }, room=f"client_{previous['client_id']}"),
+                request_lifecycle_event('status_changed', previous, status)
+            ] if previous else []
+        )
+        if previous:
+            await route_request({**previous, **update_data}, status)
+            await bump_request_versions(previous)
+    finally:
+        geofence.settle(route["request_id"])
+
+async def emit_location_updated(message: Dict[str, Any]):
+    emits.queue('location_updated', message, f"provider_{message['user_id']}", key=message['user_id'])
+    await publish_event('location_updated', message)
 
 
 # API Routes
@@ -241,6 +891,8 @@ async def root():
 
 @api_router.get("/health")
 async def health_check():
+    if graceful.draining:
+        return JSONResponse(status_code=503, content={"message": "API is draining", "status": "draining"})
     return {"message": "API is healthy", "status": "ok"}
 
 # Authentication routes
@@ -317,24 +969,61 @@ async def create_provider_profile(
         description=profile_data["description"],
         latitude=profile_data["latitude"],
         longitude=profile_data["longitude"],
-        address=address
+        address=address,
+        region=region_of(profile_data["latitude"], profile_data["longitude"])
     )
     
     await db.provider_profiles.insert_one(profile.dict())
+    search_index.upsert(profile.user_id, profile.category, profile.description, profile.latitude, profile.longitude)
+    await sync_provider_indexes(profile.dict())
+    await bump_provider_versions((profile.latitude, profile.longitude))
     return profile
 
 @api_router.get("/providers", response_model=List[Dict[str, Any]])
-async def get_providers(current_user: User = Depends(get_current_user)):
+async def get_providers(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    latitude: float = DEFAULT_CLIENT_LATITUDE,
+    longitude: float = DEFAULT_CLIENT_LONGITUDE,
+    radius_km: Optional[float] = None,
+    available_only: bool = False,
+    sort: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     if current_user.user_type != UserType.CLIENTE:
         raise HTTPException(status_code=403, detail="Only clients can view providers")
-    
+    if sort not in (None, "distance", "rating"):
+        raise HTTPException(status_code=400, detail="sort must be 'distance' or 'rating'")
+
+    # Busca por raio depende só das células cobertas; sem raio, do contador global
+    cells = provider_cells_in_radius(latitude, longitude, radius_km) if radius_km is not None else None
+    scopes = [f"providers:cell:{cell}" for cell in cells] if cells else ["providers"]
+    etag = await listing_etag(scopes, f"{category}|{latitude}|{longitude}|{radius_km}|{available_only}|{sort}")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    if available_only:
+        # Busca geográfica no hot set do Redis (com fallback para o Mongo)
+        candidates = await find_available_providers(
+            latitude, longitude, radius_km or DEFAULT_SEARCH_RADIUS_KM, category
+        )
+    else:
+        profiles = await db.provider_profiles.find({"category": category} if category else {}, {"_id": 0}).to_list(None)
+        candidates = with_distances(latitude, longitude, profiles, radius_km)
+
+    if sort == "rating":
+        candidates.sort(key=lambda p: p.get("rating_score", bayesian_score(p["rating"], p.get("total_ratings", 0))), reverse=True)
+    elif sort == "distance":
+        candidates.sort(key=lambda p: p["distance"])
+
     providers = []
-    async for provider in db.provider_profiles.find({}, {"_id": 0}):
+    for provider in candidates:
         user = await db.users.find_one({"id": provider["user_id"]}, {"_id": 0})
         if user:
-            # Calculate distance (assuming client is at a default location for now)
-            distance = calculate_distance(-23.5489, -46.6388, provider["latitude"], provider["longitude"])
-            
+            distance = provider["distance"]
+
             providers.append({
                 "id": provider["id"],
                 "name": user["name"],
@@ -346,27 +1035,140 @@ async def get_providers(current_user: User = Depends(get_current_user)):
                 "address": provider.get("address", f"Lat: {provider['latitude']}, Lng: {provider['longitude']}"),
                 "status": provider["status"],
                 "rating": provider["rating"],
+                "total_ratings": provider.get("total_ratings", 0),
                 "distance": round(distance, 1),
                 "user_id": provider["user_id"]
             })
-    
+
+    set_etag(response, etag)
     return providers
 
+@api_router.get("/providers/search", response_model=List[Dict[str, Any]])
+async def search_providers(
+    q: str,
+    category: Optional[str] = None,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    radius_km: Optional[float] = None,
+    limit: int = 20,
+    current_user: User = Depends(get_current_user)
+):
+    """Typo-tolerant search over category/description, optionally within a radius"""
+    if current_user.user_type != UserType.CLIENTE:
+        raise HTTPException(status_code=403, detail="Only clients can view providers")
+    hits = search_index.search(q, max(1, min(limit, 100)), latitude, longitude, radius_km, category)
+
+    user_ids = [user_id for user_id, _, _ in hits]
+    profiles = {p["user_id"]: p async for p in db.provider_profiles.find({"user_id": {"$in": user_ids}}, {"_id": 0})}
+    users = {u["id"]: u async for u in db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "name": 1})}
+    results = []
+    for user_id, score, distance in hits:
+        provider = profiles.get(user_id)
+        if not provider or user_id not in users:
+            continue
+        results.append({
+            "id": provider["id"],
+            "name": users[user_id]["name"],
+            "category": provider["category"],
+            "price": provider["price"],
+            "description": provider["description"],
+            "latitude": provider["latitude"],
+            "longitude": provider["longitude"],
+            "address": provider.get("address", coordinates_label(provider["latitude"], provider["longitude"])),
+            "status": provider["status"],
+            "rating": provider["rating"],
+            "distance": round(distance, 1) if distance is not None else None,
+            "score": round(score, 3),
+            "user_id": user_id
+        })
+    return results
+
+@api_router.get("/providers/top", response_model=List[Dict[str, Any]])
+async def get_top_providers(
+    category: str,
+    region: Optional[str] = None,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    limit: int = 10,
+    current_user: User = Depends(get_current_user)
+):
+    """Best ranked (Bayesian rating) non-offline providers of a category, optionally per region"""
+    if current_user.user_type != UserType.CLIENTE:
+        raise HTTPException(status_code=403, detail="Only clients can view providers")
+    limit = max(1, min(limit, 100))
+    if region is None and latitude is not None and longitude is not None:
+        region = region_of(latitude, longitude)
+
+    ranked: Optional[List[Tuple[str, float]]] = None
+    if leaderboard:
+        try:
+            ranked = await leaderboard.top(category, region, limit)
+        except Exception as e:
+            logger.warning(f"Leaderboard read failed, falling back to Mongo: {e}")
+    if ranked is None:
+        query: Dict[str, Any] = {"category": category, "status": {"$ne": ServiceStatus.OFFLINE}}
+        if region:
+            query["region"] = region
+        # Perfis ainda sem backfill não têm rating_score: entram no fim com nota 0
+        ranked = [
+            (p["user_id"], p.get("rating_score", 0.0))
+            async for p in db.provider_profiles.find(query, {"_id": 0, "user_id": 1, "rating_score": 1})
+            .sort("rating_score", -1).limit(limit)
+        ]
+
+    user_ids = [user_id for user_id, _ in ranked]
+    profiles = {p["user_id"]: p async for p in db.provider_profiles.find({"user_id": {"$in": user_ids}}, {"_id": 0})}
+    users = {u["id"]: u async for u in db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "name": 1})}
+    return [
+        {
+            "id": profiles[user_id]["id"],
+            "user_id": user_id,
+            "name": users[user_id]["name"],
+            "category": profiles[user_id]["category"],
+            "price": profiles[user_id]["price"],
+            "status": profiles[user_id]["status"],
+            "rating": profiles[user_id]["rating"],
+            "total_ratings": profiles[user_id].get("total_ratings", 0),
+            "rating_score": score,
+            "region": profiles[user_id].get("region")
+        }
+        for user_id, score in ranked if user_id in profiles and user_id in users
+    ]
+
 # Service request routes
+async def idempotent(scope: str, key: Optional[str], user: User, payload: Dict[str, Any],
+                     handler: Callable[[], Awaitable[Any]]):
+    """Run `handler` once per Idempotency-Key; retries get the stored response back"""
+    if key is None:
+        return await handler()
+    if not 0 < len(key) <= 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must have 1 to 255 characters")
+    try:
+        result, replayed = await idempotency.run(scope, user.id, key, payload, handler, jsonable_encoder)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if replayed:
+        return JSONResponse(content=result, headers={"Idempotent-Replayed": "true"})
+    return result
+
 @api_router.post("/requests", response_model=ServiceRequest)
 async def create_service_request(
     request_data: dict,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     if current_user.user_type != UserType.CLIENTE:
         raise HTTPException(status_code=403, detail="Only clients can create requests")
-    
-    # Get client address
-    client_address = await get_address_from_coordinates(
-        request_data["client_latitude"],
-        request_data["client_longitude"]
-    )
-    
+    return await idempotent("requests", idempotency_key, current_user, request_data,
+                            lambda: open_service_request(request_data, current_user))
+
+async def open_service_request(request_data: dict, current_user: User) -> ServiceRequest:
+    # Preço do perfil ajustado pela demanda atual da célula
+    multiplier = surge.quote(request_data["client_latitude"], request_data["client_longitude"], request_data["category"])
+
+    # Endereço provisório; o geocoding roda depois da resposta
     service_request = ServiceRequest(
         client_id=current_user.id,
         provider_id=request_data["provider_id"],
@@ -374,64 +1176,122 @@ async def create_service_request(
         description=request_data["description"],
         client_latitude=request_data["client_latitude"],
         client_longitude=request_data["client_longitude"],
-        client_address=client_address,
-        price=request_data["price"]
+        client_address=coordinates_label(request_data["client_latitude"], request_data["client_longitude"]),
+        price=round(request_data["price"] * multiplier, 2),
+        base_price=request_data["price"],
+        surge_multiplier=multiplier,
+        updated_seq=await next_request_seq()
     )
     
-    await db.service_requests.insert_one(service_request.dict())
+    provider_profile = await db.provider_profiles.find_one(
+        {"user_id": service_request.provider_id}, {"_id": 0, "latitude": 1, "longitude": 1}
+    )
+    # Notificação ao prestador (com o endereço provisório) no mesmo commit do pedido
+    await commit_with_events(
+        lambda session: db.service_requests.insert_one(service_request.dict(), session=session),
+        [request_lifecycle_event('created', service_request.dict(), RequestStatus.PENDING),
+         new_request_event(service_request, current_user, provider_profile)]
+    )
+    await bump_request_versions(service_request.dict())
+
+    background.submit('geocode_request_address', lambda: geocode_request_address(service_request))
 
-    # calcula distância real entre cliente e prestador (se existir perfil)
-    provider_prof = await db.provider_profiles.find_one({"user_id": request_data["provider_id"]}, {"_id": 0})
-    dist_for_notify = 0.0
-    if provider_prof:
-        dist_for_notify = calculate_distance(
-            request_data["client_latitude"],
-            request_data["client_longitude"],
-            provider_prof.get("latitude", 0.0),
-            provider_prof.get("longitude", 0.0)
-        )
-    # Emit real-time notification to provider
-    await sio.emit('new_request', {
-        'request_id': service_request.id,
-        'client_name': current_user.name,
-        'client_phone': current_user.phone,
-        'category': service_request.category,
-        'description': service_request.description,
-        'price': service_request.price,
-        'distance': round(dist_for_notify, 1),
-        'client_address': client_address
-    }, room=f"provider_{request_data['provider_id']}")
-    
     return service_request
 
 @api_router.get("/requests", response_model=List[Dict[str, Any]])
-async def get_requests(current_user: User = Depends(get_current_user)):
-    requests = []
-    
-    if current_user.user_type == UserType.PRESTADOR:
-        # Providers see requests made to them
-        async for request in db.service_requests.find({"provider_id": current_user.id}, {"_id": 0}):
-            client = await db.users.find_one({"id": request["client_id"]}, {"_id": 0})
-            if client:
-                requests.append({
-                    **request,
-                    "client_name": client["name"],
-                    "client_phone": client["phone"]
-                })
-    else:
-        # Clients see their own requests
-        async for request in db.service_requests.find({"client_id": current_user.id}, {"_id": 0}):
-            provider_profile = await db.provider_profiles.find_one({"user_id": request["provider_id"]}, {"_id": 0})
-            provider_user = await db.users.find_one({"id": request["provider_id"]}, {"_id": 0})
-            if provider_profile and provider_user:
-                requests.append({
-                    **request,
-                    "provider_name": provider_user["name"],
-                    "provider_phone": provider_user["phone"],
-                    "provider_category": provider_profile["category"]
-                })
-    
-    return requests
+async def get_requests(
+    request: Request,
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = REQUESTS_PAGE_SIZE,
+    current_user: User = Depends(get_current_user)
+):
+    """Newest-first requests across the hot and archive tiers; `X-Next-Cursor` goes back as `before`"""
+    limit = max(1, min(limit, REQUESTS_PAGE_MAX))
+    etag = await listing_etag([f"requests:user:{current_user.id}"], f"{current_user.id}:{limit}:{before or ''}")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    # Providers see requests made to them, clients see their own requests
+    owner_field = "provider_id" if current_user.user_type == UserType.PRESTADOR else "client_id"
+    # Mesmo cursor do /requests/history: arquivados continuam na listagem
+    try:
+        requests, cursor = await history_page(
+            [db.service_requests, db.service_requests_archive], {owner_field: current_user.id}, limit, before
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    set_etag(response, etag)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return await enrich_requests(current_user, requests)
+
+@api_router.get("/requests/history", response_model=Dict[str, Any])
+async def get_request_history(
+    before: Optional[str] = None,
+    limit: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """Newest-first requests across the hot and archive tiers; pass `cursor` back as `before`"""
+    limit = max(1, min(limit, 200))
+    owner_field = "provider_id" if current_user.user_type == UserType.PRESTADOR else "client_id"
+    try:
+        page, cursor = await history_page(
+            [db.service_requests, db.service_requests_archive], {owner_field: current_user.id}, limit, before
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"requests": await enrich_requests(current_user, page), "cursor": cursor}
+
+@api_router.get("/requests/changes", response_model=Dict[str, Any])
+async def get_request_changes(
+    since: int = 0,
+    limit: int = 200,
+    current_user: User = Depends(get_current_user)
+):
+    """Requests created/modified and tombstones after the `since` cursor"""
+    limit = max(1, min(limit, 500))
+    owner_field = "provider_id" if current_user.user_type == UserType.PRESTADOR else "client_id"
+
+    # Arquivados mantêm o updated_seq: quem sincroniza do zero também os recebe
+    changed_by_id: Dict[str, Dict[str, Any]] = {}
+    for tier in (db.service_requests_archive, db.service_requests):
+        async for doc in tier.find(
+            {owner_field: current_user.id, "updated_seq": {"$gt": since}}, {"_id": 0}
+        ).sort("updated_seq", 1).limit(limit + 1):
+            changed_by_id[doc["id"]] = doc
+    changed = list(changed_by_id.values())
+    removed = await db.service_request_tombstones.find(
+        {"user_ids": current_user.id, "deleted_seq": {"$gt": since}},
+        {"_id": 0, "request_id": 1, "deleted_seq": 1, "deleted_at": 1}
+    ).sort("deleted_seq", 1).limit(limit + 1).to_list(None)
+
+    # Intercala as duas sequências pelo cursor e corta no limite
+    merged = sorted(
+        [(r["updated_seq"], "change", r) for r in changed] + [(t["deleted_seq"], "tombstone", t) for t in removed],
+        key=lambda item: item[0]
+    )
+    has_more = len(merged) > limit
+    page = merged[:limit]
+
+    # Uma escrita recente pode ter um seq menor ainda sem commit: o cursor para antes da primeira
+    # entrada dentro da janela e essas entradas voltam na próxima chamada (o cliente aplica por id)
+    settled_before = datetime.utcnow() - timedelta(seconds=REQUEST_CHANGES_LAG_SECONDS)
+    cursor = since
+    for seq, kind, doc in page:
+        if doc["updated_at" if kind == "change" else "deleted_at"] > settled_before:
+            break
+        cursor = seq
+
+    return {
+        "changes": await enrich_requests(current_user, [doc for _, kind, doc in page if kind == "change"]),
+        "tombstones": [doc["request_id"] for _, kind, doc in page if kind == "tombstone"],
+        "cursor": cursor,
+        # Página ainda dentro da janela: o cliente espera em vez de repetir a chamada na hora
+        "has_more": has_more and bool(page) and cursor == page[-1][0]
+    }
 
 @api_router.put("/requests/{request_id}/accept")
 async def accept_request(
@@ -446,25 +1306,19 @@ async def accept_request(
         raise HTTPException(status_code=404, detail="Request not found")
     
     # Update request status
-    await db.service_requests.update_one(
-        {"id": request_id},
-        {"$set": {"status": RequestStatus.ACCEPTED, "accepted_at": datetime.utcnow()}}
+    provider_profile = await db.provider_profiles.find_one(
+        {"user_id": current_user.id}, {"_id": 0, "latitude": 1, "longitude": 1}
     )
-    
-    # Get provider profile for location
-    provider_profile = await db.provider_profiles.find_one({"user_id": current_user.id}, {"_id": 0})
-    
-    # Emit real-time notification to client
-    await sio.emit('request_accepted', {
-        'request_id': request_id,
-        'provider_name': current_user.name,
-        'provider_phone': current_user.phone,
-        'category': request["category"],
-        'estimated_time': 15,  # Mock estimation
-        'provider_latitude': provider_profile["latitude"] if provider_profile else None,
-        'provider_longitude': provider_profile["longitude"] if provider_profile else None
-    }, room=f"client_{request['client_id']}")
-    
+    update_data = {"status": RequestStatus.ACCEPTED, "accepted_at": datetime.utcnow(), **await request_change_fields()}
+    # Real-time notification to client, stored with the status change
+    await commit_with_events(
+        lambda session: db.service_requests.update_one({"id": request_id}, {"$set": update_data}, session=session),
+        [request_lifecycle_event('accepted', request, RequestStatus.ACCEPTED),
+         request_accepted_event(request, current_user, provider_profile)]
+    )
+    await route_request(request, RequestStatus.ACCEPTED)
+    await bump_request_versions(request)
+
     return {"message": "Request accepted successfully"}
 
 @api_router.put("/requests/{request_id}/update-status")
@@ -478,36 +1332,106 @@ async def update_request_status(
         raise HTTPException(status_code=404, detail="Request not found")
     
     # Update request status
-    update_data = {"status": status_data["status"]}
+    update_data = {"status": status_data["status"], **await request_change_fields()}
     if status_data["status"] == RequestStatus.COMPLETED:
         update_data["completed_at"] = datetime.utcnow()
         if "photo_url" in status_data:
             update_data["photo_url"] = status_data["photo_url"]
     
-    await db.service_requests.update_one(
-        {"id": request_id},
-        {"$set": update_data}
-    )
-    
-    # Emit real-time notification
+    # Real-time notification to the other party
     room = f"client_{request['client_id']}" if current_user.user_type == UserType.PRESTADOR else f"provider_{request['provider_id']}"
-    await sio.emit('status_updated', {
+    notification = outbox_event('status_updated', {
         'request_id': request_id,
         'status': status_data["status"],
         'message': status_data.get("message", "")
     }, room=room)
+    lifecycle_kind = {
+        RequestStatus.COMPLETED: 'completed',
+        RequestStatus.CANCELLED: 'cancelled'
+    }.get(status_data["status"], 'status_changed')
+
+    await commit_with_events(
+        lambda session: db.service_requests.update_one({"id": request_id}, {"$set": update_data}, session=session),
+        [notification, request_lifecycle_event(lifecycle_kind, request, status_data["status"])]
+    )
+    await route_request(request, status_data["status"])
+    await bump_request_versions(request)
     
     return {"message": "Status updated successfully"}
 
+async def upload_rejected(chunks, status_code: int, detail: str) -> HTTPException:
+    """Error for an upload refused mid-body, after discarding the rest so keep-alive stays usable"""
+    drained = await drain(chunks, PHOTO_MAX_BODY)
+    return HTTPException(status_code=status_code, detail=detail, headers=None if drained else {"Connection": "close"})
+
+@api_router.post("/requests/{request_id}/photo")
+async def upload_request_photo(
+    request_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Multipart `photo` field streamed to storage; its URL becomes the request's photo_url"""
+    # Um único iterador do corpo: o que o parser não leu é descartado no fim, em qualquer saída
+    chunks = request.stream()
+    try:
+        content_length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length", headers={"Connection": "close"})
+    if content_length > PHOTO_MAX_BODY:
+        raise HTTPException(status_code=413, detail="Photo too large", headers={"Connection": "close"})
+    service_request = await db.service_requests.find_one({"id": request_id, "provider_id": current_user.id}, {"_id": 0})
+    if not service_request:
+        raise await upload_rejected(chunks, 404, "Request not found")
+    try:
+        boundary = multipart_boundary(request.headers.get("content-type"))
+        photo = await photos.save(stream_file_part(chunks, boundary, "photo"))
+    except InvalidUpload as e:
+        raise await upload_rejected(chunks, 400, str(e))
+    except UnsupportedImage as e:
+        raise await upload_rejected(chunks, 415, str(e))
+    except UploadTooLarge as e:
+        raise await upload_rejected(chunks, 413, str(e))
+    # Delimitador final / campos depois da foto
+    await drain(chunks, PHOTO_MAX_BODY)
+
+    await db.service_requests.update_one({"id": request_id}, {"$set": {
+        "photo_url": photo["url"],
+        "photo": {"sha256": photo["sha256"], "thumbnails": photo["thumbnails"]},
+        **await request_change_fields()
+    }})
+    await bump_request_versions(service_request)
+    return photo
+
+@api_router.get("/requests/{request_id}/messages", response_model=Dict[str, Any])
+async def get_request_messages(
+    request_id: str,
+    before: Optional[str] = None,
+    limit: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """Newest-first chat page; pass `cursor` back as `before` for older messages"""
+    request = await find_request({"id": request_id, "$or": [{"client_id": current_user.id}, {"provider_id": current_user.id}]})
+    if not request:
+        raise HTTPException(status_code=404, detail="Request not found")
+    try:
+        messages, cursor = await chat.history(request_id, before, max(1, min(limit, 100)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"messages": messages, "cursor": cursor, "reads": await chat.read_state(request_id)}
+
 @api_router.post("/ratings", response_model=Rating)
 async def create_rating(
     rating_data: dict,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     if current_user.user_type != UserType.CLIENTE:
         raise HTTPException(status_code=403, detail="Only clients can rate services")
-    
-    request = await db.service_requests.find_one({"id": rating_data["request_id"], "client_id": current_user.id}, {"_id": 0})
+    return await idempotent("ratings", idempotency_key, current_user, rating_data,
+                            lambda: submit_rating(rating_data, current_user))
+
+async def submit_rating(rating_data: dict, current_user: User) -> Rating:
+    request = await find_request({"id": rating_data["request_id"], "client_id": current_user.id})
     if not request:
         raise HTTPException(status_code=404, detail="Request not found")
     
@@ -528,10 +1452,19 @@ async def create_rating(
     
     if ratings:
         avg_rating = sum(ratings) / len(ratings)
-        await db.provider_profiles.update_one(
+        profile = await db.provider_profiles.find_one_and_update(
             {"user_id": request["provider_id"]},
-            {"$set": {"rating": round(avg_rating, 1), "total_ratings": len(ratings)}}
+            {"$set": {
+                "rating": round(avg_rating, 1),
+                "total_ratings": len(ratings),
+                "rating_score": bayesian_score(avg_rating, len(ratings))
+            }},
+            projection=PROVIDER_INDEX_PROJECTION,
+            return_document=ReturnDocument.AFTER
         )
+        if profile:
+            await sync_provider_indexes(profile)
+            await bump_provider_versions((profile.get("latitude"), profile.get("longitude")))
     
     return rating
 
@@ -544,33 +1477,25 @@ async def update_provider_location(
         raise HTTPException(status_code=403, detail="Only providers can update location")
     
     # Update provider location
-    await db.provider_profiles.update_one(
+    previous = await db.provider_profiles.find_one_and_update(
         {"user_id": current_user.id},
-        {"$set": {"latitude": location.latitude, "longitude": location.longitude}}
+        {"$set": {
+            "latitude": location.latitude,
+            "longitude": location.longitude,
+            "region": region_of(location.latitude, location.longitude)
+        }},
+        projection=PROVIDER_INDEX_PROJECTION
     )
-    
-    # Emit location update to active requests
-    async for request in db.service_requests.find({
-        "provider_id": current_user.id,
-        "status": {"$in": [RequestStatus.ACCEPTED, RequestStatus.IN_PROGRESS]}
-    }, {"_id": 0}):
-        distance = calculate_distance(
-            location.latitude, location.longitude,
-            request["client_latitude"], request["client_longitude"]
+    if previous:
+        background.submit(
+            'after_provider_moved',
+            lambda: after_provider_moved(previous, location.latitude, location.longitude)
         )
-        message = {
-            'request_id': request["id"],
-            'provider_latitude': location.latitude,
-            'provider_longitude': location.longitude,
-            'distance': round(distance, 1),
-            'estimated_time': max(5, int(distance * 2))  # Mock time estimation
-        }
-
-        await sio.emit('provider_location_update', message, room=f"client_{request['client_id']}")
-        await sio.emit('provider_location_update', message, room=f"request_{request['id']}")
+    background.submit(
+        'fan_out_provider_location',
+        lambda: fan_out_provider_location(current_user.id, location.latitude, location.longitude)
+    )
 
-        await publish_event('provider_location_update', message)
-    
     return {"message": "Location updated successfully"}
 
 @api_router.put("/provider/status")
@@ -581,61 +1506,392 @@ async def update_provider_status(
     if current_user.user_type != UserType.PRESTADOR:
         raise HTTPException(status_code=403, detail="Only providers can update status")
 
-    result = await db.provider_profiles.update_one(
-        {"user_id": current_user.id},
-        {"$set": {"status": status_update.status}}
-    )
-
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Provider profile not found")
-
-
     message = {
         'provider_id': current_user.id,
         'status': status_update.status
     }
 
-    await sio.emit('provider_status_update', message)
-    await publish_event('provider_status_update', message)
+    # Broadcast + broker publish are delivered by the outbox dispatcher (only when a profile was updated)
+    profile = await commit_with_events(
+        lambda session: db.provider_profiles.find_one_and_update(
+            {"user_id": current_user.id},
+            {"$set": {"status": status_update.status}},
+            projection=PROVIDER_INDEX_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        ),
+        lambda updated: [outbox_event('provider_status_update', message, channel='provider_status_update')]
+        if updated else []
+    )
 
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Provider profile not found")
+
+    await sync_provider_indexes(profile)
+    await bump_provider_versions((profile.get("latitude"), profile.get("longitude")))
 
     return {"status": status_update.status}
 
+@api_router.get("/analytics/rollups", response_model=List[Dict[str, Any]], dependencies=[Depends(require_debug_token)])
+async def get_analytics_rollups(
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 1000
+):
+    """Hourly request counters and revenue, read only from the rollup collection"""
+    if not analytics:
+        raise HTTPException(status_code=503, detail="Analytics not started")
+    return await analytics.query(category, region, start, end, min(max(limit, 1), 5000))
+
+@api_router.get("/demand/heatmap")
+async def get_demand_heatmap(
+    bbox: str,
+    window: Optional[int] = None,
+    category: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Pending and recently created requests per cell inside `bbox` (min_lon,min_lat,max_lon,max_lat)"""
+    if current_user.user_type != UserType.PRESTADOR:
+        raise HTTPException(status_code=403, detail="Only providers can view demand")
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lon,min_lat,max_lon,max_lat")
+    try:
+        cells = demand_heatmap.cells(min_lat, min_lon, max_lat, max_lon, window, category)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "precision": demand_heatmap.precision,
+        "window_seconds": window or demand_heatmap.windows[0],
+        "cells": cells
+    }
+
+@api_router.get("/pricing/surge")
+async def get_surge_multiplier(
+    latitude: float,
+    longitude: float,
+    category: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Multiplier a request created now at this point would get"""
+    return {"category": category, "multiplier": surge.quote(latitude, longitude, category)}
+
+def profile_response(counts, name: str, interval: float, format: str):
+    if format == "speedscope":
+        return speedscope(counts, name, interval)
+    return PlainTextResponse(collapsed(counts))
+
+@api_router.post("/debug/profile", dependencies=[Depends(require_debug_token)])
+async def profile_event_loop(seconds: float = 5.0, interval_ms: float = 5.0, format: str = "collapsed"):
+    """Sample everything the event loop runs for `seconds` (collapsed stacks or speedscope JSON)"""
+    if not 0 < seconds <= 60 or not 1 <= interval_ms <= 100 or format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="seconds in (0, 60], interval_ms in [1, 100], format collapsed|speedscope")
+    counts = await profile_for(seconds, interval_ms / 1000)
+    return profile_response(counts, f"event loop {seconds:g}s", interval_ms / 1000, format)
+
+@api_router.post("/debug/profile/routes", dependencies=[Depends(require_debug_token)])
+async def enable_route_profiling(pattern: str, fraction: float = 0.1, max_requests: int = 1000):
+    """Profile a sampled fraction of the requests whose path matches `pattern` (fnmatch, e.g. /api/requests/*/accept)"""
+    if not 0 < fraction <= 1 or max_requests < 1:
+        raise HTTPException(status_code=400, detail="fraction in (0, 1] and max_requests >= 1")
+    route_profiler.enable(pattern, fraction, max_requests)
+    return route_profiler.status()
+
+@api_router.get("/debug/profile/routes", dependencies=[Depends(require_debug_token)])
+async def get_route_profile(pattern: Optional[str] = None, format: str = "collapsed"):
+    if pattern is None:
+        return route_profiler.status()
+    if pattern not in route_profiler.targets:
+        raise HTTPException(status_code=404, detail="Route is not being profiled")
+    return profile_response(route_profiler.results(pattern), pattern, route_profiler.interval, format)
+
+@api_router.delete("/debug/profile/routes", dependencies=[Depends(require_debug_token)])
+async def disable_route_profiling(pattern: Optional[str] = None):
+    route_profiler.disable(pattern)
+    return route_profiler.status()
+
+@api_router.post("/debug/loop-monitor", dependencies=[Depends(require_debug_token)])
+async def start_loop_monitor(threshold_ms: float = 100.0):
+    """Record event-loop lag and the stack of every call that blocks the loop longer than `threshold_ms`"""
+    if threshold_ms <= 0:
+        raise HTTPException(status_code=400, detail="threshold_ms must be positive")
+    loop_monitor.threshold = threshold_ms / 1000
+    loop_monitor.start()
+    return loop_monitor.report()
+
+@api_router.get("/debug/loop-monitor", dependencies=[Depends(require_debug_token)])
+async def get_loop_monitor():
+    return loop_monitor.report()
+
+@api_router.delete("/debug/loop-monitor", dependencies=[Depends(require_debug_token)])
+async def stop_loop_monitor():
+    await loop_monitor.stop()
+    return loop_monitor.report()
+
+@api_router.get("/debug/slow-queries", dependencies=[Depends(require_debug_token)])
+async def get_slow_queries(limit: int = 20, collection: Optional[str] = None, explain: bool = False):
+    """Slowest Mongo query shapes with their plans (`explain=true` refreshes the plans now)"""
+    if explain:
+        await slow_queries.explain_slowest(client, limit=min(max(limit, 1), 50), max_age=0)
+    return {**slow_queries.summary(), "slowest": slow_queries.slowest(min(max(limit, 1), 500), collection)}
+
+@api_router.delete("/debug/slow-queries", dependencies=[Depends(require_debug_token)])
+async def reset_slow_queries():
+    slow_queries.reset()
+    return slow_queries.summary()
+
+@api_router.get("/debug/logging", dependencies=[Depends(require_debug_token)])
+async def get_logging_config():
+    return log_pipeline.status()
+
+@api_router.put("/debug/logging", dependencies=[Depends(require_debug_token)])
+async def update_logging_config(update: LoggingUpdate):
+    """Change the root level, per-logger levels and per-event sample rates at runtime"""
+    try:
+        if update.level:
+            log_pipeline.set_level(update.level)
+        for name, level in update.levels.items():
+            log_pipeline.set_level(level, name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for name, rate in update.sample_rates.items():
+        log_pipeline.set_rate(name, rate)
+    return log_pipeline.status()
+
+@api_router.post("/debug/drain", dependencies=[Depends(require_debug_token)])
+async def start_drain():
+    """preStop hook: refuse new sockets, fail the health check and move connected clients elsewhere"""
+    if not graceful.begin_drain():
+        return {"draining": True}
+    return {"draining": True, **await drain_sockets()}
+
+@api_router.post("/debug/archive", dependencies=[Depends(require_debug_token)])
+async def run_archive_pass():
+    """Run an archival pass now instead of waiting for ARCHIVE_INTERVAL_SECONDS"""
+    if not archiver:
+        raise HTTPException(status_code=503, detail="Archiver not started")
+    return {"archived": await archiver.archive_once(), **archiver.stats}
+
+@api_router.get("/metrics", dependencies=[Depends(require_debug_token)])
+async def get_metrics():
+    return {
+        "background_tasks": background.metrics(),
+        "outbox": {**outbox.stats, "transactional": mongo_transactions} if outbox else None,
+        "analytics": analytics.stats if analytics else None,
+        "provider_registry": provider_registry.stats(),
+        "emits": emits.stats,
+        "surge": {**surge.stats, "surging_cells": len(surge.multipliers)},
+        "slow_queries": slow_queries.summary(),
+        "logging": log_pipeline.status(),
+        "idempotency": idempotency.stats,
+        "archive": archiver.stats if archiver else None,
+        "photos": photos.stats if photos else None,
+        "chat": {**chat.stats, "typing_throttled": typing_throttle.dropped},
+        "pending_events": pending_events.stats,
+        "event_loop": {**loop_monitor.report()["lag_ms"], "running": loop_monitor.running,
+                       "blocked": len(loop_monitor.blocked)}
+    }
+
 # Socket.IO Events
 @sio.event
 async def connect(sid, environ, auth):
-    print(f"Client {sid} connected")
-    if auth and 'user_id' in auth:
-        user_type = auth.get('user_type', 1)
-        user_id = auth['user_id']
+    if graceful.draining:
+        raise socketio.exceptions.ConnectionRefusedError("server draining")
+    logger.info(f"Client {sid} connected", extra={"event": "socket_connect", "sid": sid})
+    # Identidade só do JWT (como get_current_user); user_id/user_type enviados no auth são ignorados
+    token = (auth or {}).get('token')
+    if token:
+        user_id = token_subject(token)
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1, "user_type": 1}) if user_id else None
+        if user is None:
+            raise socketio.exceptions.ConnectionRefusedError("invalid token")
+        user_type = user['user_type']
         room = f"{'provider' if user_type == 1 else 'client'}_{user_id}"
+        await sio.save_session(sid, {'user_id': user_id, 'user_type': user_type})
         await sio.enter_room(sid, room)
-        print(f"Client {sid} joined room {room}")
+        logger.info(f"Client {sid} joined room {room}", extra={"event": "socket_join", "sid": sid, "room": room})
+        if user_type == UserType.PRESTADOR:
+            # O disconnect tirou o prestador do hot set; o perfil diz se ele volta como disponível
+            await restore_provider_indexes(user_id)
+        # Direto no handler (não na fila descartável do background); o cliente guarda eventos que chegam
+        # antes do ack do connect e os entrega logo depois dele
+        await deliver_pending_events(sid, room)
+
+async def restore_provider_indexes(user_id: str):
+    """Put a reconnecting provider back in the registry and GEO hot set according to its stored profile"""
+    try:
+        profile = await db.provider_profiles.find_one({"user_id": user_id}, PROVIDER_INDEX_PROJECTION)
+    except Exception as e:
+        logger.warning(f"Could not load profile of reconnecting provider {user_id}: {e}")
+        return
+    if profile:
+        await sync_provider_indexes(profile)
+        await bump_provider_versions((profile.get("latitude"), profile.get("longitude")))
+
+async def deliver_pending_events(sid: str, room: str):
+    """Send what was held for `room` while it was offline as one `batch` packet to the new socket.
+
+    The events are only deleted once the packet went out to a socket that is still
+    connected; otherwise the claim is released and the next connect gets them.
+    """
+    try:
+        token, held = await pending_events.claim(room)
+    except Exception as e:
+        logger.warning(f"Could not load held events for {room}: {e}")
+        return
+    if not held:
+        return
+    try:
+        await sio.emit(BATCH_EVENT, held, to=sid)
+        delivered = sio.manager.is_connected(sid, '/')
+    except Exception as e:
+        logger.warning(f"Could not deliver {len(held)} held events to {room}: {e}")
+        delivered = False
+    try:
+        if delivered:
+            await pending_events.ack(token)
+        else:
+            await pending_events.release(token)
+    except Exception as e:
+        # Claim sem ack/release expira e volta a ser entregue (no pior caso, repetido)
+        logger.warning(f"Could not settle held events of {room}: {e}")
 
 @sio.event
 async def disconnect(sid):
-    print(f"Client {sid} disconnected")
+    logger.info(f"Client {sid} disconnected", extra={"event": "socket_disconnect", "sid": sid})
+    session = await sio.get_session(sid)
+    user_id = session.get('user_id')
+    if user_id and session.get('user_type', 1) == UserType.PRESTADOR:
+        # Prestador sem nenhum socket ativo sai do hot set de disponíveis
+        if not room_has_members(f"provider_{user_id}", exclude_sid=sid):
+            provider_registry.remove(user_id)
+            if geo_index:
+                try:
+                    await geo_index.remove(user_id)
+                except Exception as e:
+                    logger.warning(f"Geo index removal failed for {user_id}: {e}")
+            # Listagens available_only mudaram: invalida os ETags da célula do prestador
+            try:
+                profile = await db.provider_profiles.find_one({"user_id": user_id}, PROVIDER_INDEX_PROJECTION)
+            except Exception as e:
+                logger.warning(f"Could not load profile of disconnected provider {user_id}: {e}")
+                profile = None
+            await bump_provider_versions(((profile or {}).get("latitude"), (profile or {}).get("longitude")))
+            # Deixa de contar como oferta em todos os workers, não só neste
+            if profile:
+                try:
+                    await publish_supply(profile, "offline")
+                except Exception as e:
+                    logger.warning(f"Surge supply update failed for {user_id}: {e}")
 
 @sio.event
 async def location_update(sid, data):
-    user_id = data.get('user_id')
-    latitude = data.get('latitude')
-    longitude = data.get('longitude')
+    # Só o prestador autenticado no connect move a própria posição; data['user_id'] é ignorado
+    session = await sio.get_session(sid)
+    if session.get('user_type') != UserType.PRESTADOR:
+        return
+    user_id = session.get('user_id')
+    latitude = (data or {}).get('latitude')
+    longitude = (data or {}).get('longitude')
     
     if user_id and latitude and longitude:
-        await db.provider_profiles.update_one(
+        previous = await db.provider_profiles.find_one_and_update(
             {"user_id": user_id},
-            {"$set": {"latitude": latitude, "longitude": longitude}}
+            {"$set": {"latitude": latitude, "longitude": longitude, "region": region_of(latitude, longitude)}},
+            projection=PROVIDER_INDEX_PROJECTION
+        )
+        if previous:
+            background.submit('after_provider_moved', lambda: after_provider_moved(previous, latitude, longitude))
+        background.submit(
+            'fan_out_provider_location',
+            lambda: fan_out_provider_location(user_id, latitude, longitude)
         )
-        
+
         # Emit to relevant clients and brokers
         message = {
             'user_id': user_id,
             'latitude': latitude,
             'longitude': longitude
         }
-        await sio.emit('location_updated', message, room=f"provider_{user_id}")
-        await publish_event('location_updated', message)
+        background.submit('location_updated', lambda: emit_location_updated(message))
+
+async def joined_chat(sid, data) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """(session, request_id) when the socket joined the request's chat, else (None, None)"""
+    session = await sio.get_session(sid)
+    request_id = (data or {}).get('request_id')
+    if request_id not in session.get('chats', {}):
+        return None, None
+    return session, request_id
+
+@sio.event
+async def join_request(sid, data):
+    """Join the `request_{id}` room (chat, typing, receipts, tracking) of a request the user is part of"""
+    session = await sio.get_session(sid)
+    user_id = session.get('user_id')
+    request_id = (data or {}).get('request_id')
+    if not user_id or not request_id:
+        return {'ok': False, 'error': 'not authenticated'}
+    request = await db.service_requests.find_one(
+        {"id": request_id, "$or": [{"client_id": user_id}, {"provider_id": user_id}]},
+        {"_id": 0, "client_id": 1, "provider_id": 1}
+    )
+    if not request:
+        return {'ok': False, 'error': 'request not found'}
+    # Sala pessoal da outra parte, avisada de mensagens novas fora do chat
+    counterpart = f"client_{request['client_id']}" if user_id == request['provider_id'] else f"provider_{request['provider_id']}"
+    session.setdefault('chats', {})[request_id] = counterpart
+    await sio.save_session(sid, session)
+    await sio.enter_room(sid, f"request_{request_id}")
+    return {'ok': True, 'reads': await chat.read_state(request_id)}
+
+@sio.event
+async def leave_request(sid, data):
+    session, request_id = await joined_chat(sid, data)
+    if session:
+        session['chats'].pop(request_id, None)
+        await sio.save_session(sid, session)
+        await sio.leave_room(sid, f"request_{request_id}")
+
+@sio.event
+async def chat_message(sid, data):
+    """Store a message (acked once written) and deliver it to the request room on the next emit tick"""
+    session, request_id = await joined_chat(sid, data)
+    if not session:
+        return {'ok': False, 'error': 'join the request first'}
+    text = str(data.get('text') or '').strip()
+    if not text or len(text) > MAX_MESSAGE_LENGTH:
+        return {'ok': False, 'error': f'message must have 1 to {MAX_MESSAGE_LENGTH} characters'}
+    message = chat.new_message(request_id, session['user_id'], session.get('user_type', 1), text, data.get('client_msg_id'))
+    try:
+        await chat.append(message)
+    except ChatBackpressure as e:
+        return {'ok': False, 'error': str(e), 'retry': True}
+    except Exception:
+        return {'ok': False, 'error': 'message not stored', 'retry': True}
+    view = message_view(message)
+    emits.queue('chat_message', view, f"request_{request_id}")
+    emits.queue('chat_unread', {'request_id': request_id, 'message_id': view['id']},
+                session['chats'][request_id], key=request_id)
+    return {'ok': True, 'message': view}
+
+@sio.event
+async def typing(sid, data):
+    session, request_id = await joined_chat(sid, data)
+    if session and typing_throttle.allow((session['user_id'], request_id)):
+        emits.queue('typing', {'request_id': request_id, 'user_id': session['user_id']},
+                    f"request_{request_id}", key=('typing', session['user_id']))
+
+@sio.event
+async def mark_read(sid, data):
+    """Advance the read watermark; receipts are coalesced per tick in the room and per flush in Mongo"""
+    session, request_id = await joined_chat(sid, data)
+    if session and await chat.mark_read(request_id, session['user_id'], data.get('message_id')):
+        emits.queue('chat_read', {'request_id': request_id, 'user_id': session['user_id'],
+                                  'message_id': data['message_id']},
+                    f"request_{request_id}", key=('read', session['user_id']))
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -646,38 +1902,254 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+app.add_middleware(RouteProfilerMiddleware, profiler=route_profiler)
+
+# Fotos e miniaturas gravadas pelo PhotoStore (atrás de um CDN/proxy em produção)
+app.mount("/media/photos", StaticFiles(directory=MEDIA_ROOT / "photos", check_dir=False), name="photos")
+
+# Configure logging: JSON via fila, o event loop só enfileira e uma thread escreve no stdout.
+# Instalado no startup (não no import) e drenado como último passo do shutdown
+socketio_log_level = os.getenv("SOCKETIO_LOG_LEVEL", "WARNING")
+log_pipeline = LogPipeline(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    sample_rates=parse_rates(os.getenv("LOG_SAMPLE_RATES", "socket_connect=0.1,socket_join=0.1,socket_disconnect=0.1")),
+    levels={"socketio.server": socketio_log_level, "engineio.server": socketio_log_level}
 )
 logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_services():
-    global redis_client, kafka_producer
+    global redis_client, kafka_producer, geo_index, leaderboard, collection_versions, outbox, mongo_transactions
+    global analytics, analytics_task, active_routes, heatmap_task, slow_query_task, idempotency, archiver, archive_task
+    global photos, chat, pending_events
+    log_pipeline.install()
     redis_url = os.getenv("REDIS_URL")
     kafka_bootstrap = os.getenv("KAFKA_BOOTSTRAP")
+    idempotency = IdempotencyStore(db.idempotency_keys, ttl_seconds=IDEMPOTENCY_TTL_SECONDS)
+    photos = PhotoStore(MEDIA_ROOT / "photos", max_bytes=PHOTO_MAX_BYTES, executor=photo_executor)
+    pending_events = PendingEvents(db.pending_events, ttl_seconds=PENDING_EVENTS_TTL_SECONDS,
+                                   max_per_room=PENDING_EVENTS_MAX)
+    chat = ChatStore(db.chat_messages, db.chat_reads, batch_size=int(os.getenv("CHAT_BATCH_SIZE", "500")),
+                     flush_interval=float(os.getenv("CHAT_FLUSH_MS", "5")) / 1000)
+    try:
+        await ensure_indexes()
+        await backfill_request_seq()
+        await backfill_ranking_fields()
+    except Exception as e:
+        logger.warning(f"Could not prepare Mongo collections: {e}")
+    try:
+        async for profile in db.provider_profiles.find(
+            {}, {"_id": 0, "user_id": 1, "category": 1, "description": 1, "latitude": 1, "longitude": 1}
+        ):
+            search_index.upsert(profile["user_id"], profile["category"], profile.get("description", ""),
+                                profile["latitude"], profile["longitude"])
+        logger.info(f"Provider search index loaded with {len(search_index)} profiles")
+    except Exception as e:
+        logger.warning(f"Could not load provider search index: {e}")
+    try:
+        await provider_registry.rebuild(db.provider_profiles.find(
+            {"status": {"$ne": ServiceStatus.OFFLINE}}, PROVIDER_INDEX_PROJECTION
+        ))
+    except Exception as e:
+        logger.warning(f"Could not load provider registry, matching falls back to Mongo: {e}")
+    mongo_transactions = await detect_mongo_transactions()
+    if not mongo_transactions:
+        if os.getenv("MONGO_TRANSACTIONS_REQUIRED") == "1":
+            raise RuntimeError("MongoDB has no replica set: the outbox needs transactions (MONGO_TRANSACTIONS_REQUIRED=1)")
+        logger.error(
+            "MongoDB has no replica set: state writes and their outbox events are NOT atomic, "
+            "a crash between them loses notifications. Run Mongo as a replica set (see docker-compose.yml)",
+            extra={"event": "outbox_without_transactions"}
+        )
+    outbox = OutboxDispatcher(db.outbox, deliver_outbox_events)
+    try:
+        await outbox.ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Could not ensure outbox indexes: {e}")
     if redis_url:
         redis_client = aioredis.from_url(redis_url)
+        geo_index = ProviderGeoIndex(redis_client)
+        active_routes = ActiveRequestRoutes(ACTIVE_REQUEST_STATUSES, redis_client)
+        collection_versions = CollectionVersions(redis_client)
+        try:
+            await collection_versions.init()
+        except Exception as e:
+            logger.warning(f"Could not initialise shared collection versions: {e}")
+            collection_versions = CollectionVersions()
+        try:
+            await geo_index.rebuild(db.provider_profiles.find(
+                {"status": ServiceStatus.AVAILABLE},
+                {"_id": 0, "user_id": 1, "category": 1, "latitude": 1, "longitude": 1}
+            ))
+        except Exception as e:
+            logger.warning(f"Could not rebuild provider geo index: {e}")
+        leaderboard = ProviderLeaderboard(redis_client)
+        try:
+            await leaderboard.rebuild(db.provider_profiles.find(
+                {"status": {"$ne": ServiceStatus.OFFLINE}}, PROVIDER_INDEX_PROJECTION
+            ))
+        except Exception as e:
+            logger.warning(f"Could not rebuild provider leaderboard: {e}")
+    try:
+        await active_routes.rebuild(db.service_requests.find(
+            {"status": {"$in": list(ACTIVE_REQUEST_STATUSES)}},
+            {"_id": 0, "id": 1, "client_id": 1, "provider_id": 1, "status": 1,
+             "client_latitude": 1, "client_longitude": 1}
+        ))
+    except Exception as e:
+        logger.warning(f"Could not rebuild active request routes: {e}")
     if kafka_bootstrap:
         kafka_producer = AIOKafkaProducer(bootstrap_servers=kafka_bootstrap)
         await kafka_producer.start()
+    outbox.start()
+    background.start()
+    emits.start()
+    chat.start()
+    slow_query_task = asyncio.create_task(
+        slow_queries.run_explain(client, interval=float(os.getenv("SLOW_QUERY_EXPLAIN_SECONDS", "60")))
+    )
+    archiver = RequestArchiver(
+        db.service_requests, db.service_requests_archive, TERMINAL_REQUEST_STATUSES,
+        older_than_days=float(os.getenv("ARCHIVE_AFTER_DAYS", "30")),
+        batch_size=int(os.getenv("ARCHIVE_BATCH_SIZE", "500")),
+        on_archived=after_requests_archived
+    )
+    archive_task = asyncio.create_task(archiver.run(interval=float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))))
+
+    # Cada worker mantém seu heatmap: grupo Kafka próprio (estável entre restarts) para receber todos os eventos
+    heatmap_task = asyncio.create_task(demand_heatmap.consume(request_event_source(f"demand-heatmap-{WORKER_ID}")))
+    surge_tasks.extend([
+        asyncio.create_task(surge.consume(request_event_source(f"surge-pricing-{WORKER_ID}"))),
+        asyncio.create_task(surge.run_decay())
+    ])
+    try:
+        async for profile in db.provider_profiles.find({"status": ServiceStatus.AVAILABLE}, PROVIDER_INDEX_PROJECTION):
+            surge.seed_supply(profile)
+        since = datetime.utcnow() - timedelta(seconds=max(max(demand_heatmap.windows), max(surge.demand.windows)))
+        async for request in db.service_requests.find(
+            {"$or": [{"status": RequestStatus.PENDING}, {"created_at": {"$gte": since}}]},
+            {"_id": 0, "id": 1, "status": 1, "category": 1, "client_latitude": 1, "client_longitude": 1, "created_at": 1}
+        ).sort("created_at", 1):
+            for demand in (demand_heatmap, surge.demand):
+                demand.record(request["id"], request["client_latitude"], request["client_longitude"],
+                              request["category"], request.get("created_at"),
+                              pending=request.get("status") == RequestStatus.PENDING)
+        await surge.flush()
+    except Exception as e:
+        logger.warning(f"Could not load demand heatmap / surge state: {e}")
+
+    analytics = AnalyticsRollups(
+        db.analytics_rollups, db.analytics_applied_events,
+        dedupe_ttl_seconds=int(os.getenv("ANALYTICS_DEDUPE_TTL_SECONDS", str(7 * 86400)))
+    )
+    try:
+        await analytics.ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Could not ensure analytics indexes: {e}")
+    if os.getenv("ANALYTICS_CONSUMER", "1") == "1":
+        analytics_task = asyncio.create_task(analytics.consume(request_event_source("analytics-rollups")))
+
+def request_event_source(group_id: str):
+    """Request lifecycle stream from Kafka, Redis pub/sub or the in-process bus"""
+    kafka_bootstrap = os.getenv("KAFKA_BOOTSTRAP")
+    if kafka_bootstrap:
+        return kafka_events(kafka_bootstrap, [REQUEST_EVENTS_CHANNEL], group_id=group_id)
+    if redis_client:
+        return redis_events(redis_client, [REQUEST_EVENTS_CHANNEL])
+    return local_events.listen([REQUEST_EVENTS_CHANNEL])
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
-    if kafka_producer:
-        await kafka_producer.stop()
-    if redis_client:
-        await redis_client.close()
+    """Drain in dependency order: sockets, in-process queues, outbox, then producers and databases"""
+    async def stop_background(budget: float):
+        queued = background.pending
+        drained = await background.drain(timeout=max(budget - graceful.floor_seconds, 0))
+        dropped = background.pending
+        await background.stop()
+        return {"queued": queued, "drained": drained, "dropped": dropped}
+
+    async def stop_chat(budget: float):
+        # Grava o que estiver na fila antes de fechar o Mongo
+        stored = chat.stats["messages"]
+        await chat.stop()
+        return {"flushed_messages": chat.stats["messages"] - stored}
+
+    async def stop_emits(budget: float):
+        packets, empty_rooms = emits.stats["packets"], emits.stats["empty_rooms"]
+        await emits.stop()
+        return {"flushed_packets": emits.stats["packets"] - packets,
+                "dropped_rooms": emits.stats["empty_rooms"] - empty_rooms}
+
+    async def stop_consumers(budget: float):
+        tasks = [task for task in (analytics_task, heatmap_task, slow_query_task, archive_task, *surge_tasks) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await loop_monitor.stop()
+        route_profiler.disable()
+        return {"cancelled": len(tasks)}
+
+    async def stop_outbox(budget: float):
+        if not outbox:
+            return None
+        delivered = outbox.stats["delivered"]
+        timed_out = False
+        try:
+            await asyncio.wait_for(outbox.stop(), timeout=max(budget - graceful.floor_seconds, 0.1))
+        except asyncio.TimeoutError:
+            timed_out = True
+        # O que sobrar continua no Mongo e sai pelo dispatcher de outro worker
+        pending = await outbox.collection.count_documents({"dispatched_at": None})
+        return {"delivered": outbox.stats["delivered"] - delivered, "left_pending": pending, "timed_out": timed_out}
+
+    async def stop_kafka(budget: float):
+        if kafka_producer:
+            await kafka_producer.stop()  # envia o que estiver no buffer antes de fechar
+
+    async def close_redis(budget: float):
+        if redis_client:
+            await redis_client.close()
+
+    async def close_mongo(budget: float):
+        client.close()
+
+    async def stop_geocoder(budget: float):
+        # Descarta as geocodificações na fila sem esperar as que estão em andamento
+        geocode_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def stop_photo_workers(budget: float):
+        photo_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def stop_logging(budget: float):
+        # Escreve o que está na fila; o relatório final sai direto no stdout
+        queued = log_pipeline.queue.qsize()
+        await asyncio.to_thread(log_pipeline.stop, True)
+        return {"flushed": queued, "dropped": log_pipeline.handler.dropped}
+
+    report = await graceful.run([
+        ("sockets", lambda budget: drain_sockets()),
+        ("background_tasks", stop_background),
+        ("chat", stop_chat),
+        ("emits", stop_emits),
+        ("consumers", stop_consumers),
+        ("outbox", stop_outbox),
+        ("kafka", stop_kafka),
+        ("redis", close_redis),
+        ("mongo", close_mongo),
+        ("geocoder", stop_geocoder),
+        ("photo_workers", stop_photo_workers),
+        ("logging", stop_logging),
+    ])
+    logger.info("Shutdown complete", extra={"event": "shutdown", "report": report})
 
 # Use socket_app instead of app for the main application
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(socket_app, host="0.0.0.0", port=8001)
+    # log_config=None: os logs do uvicorn também passam pela fila JSON
+    uvicorn.run(socket_app, host="0.0.0.0", port=8001, log_config=None)
 
 # For production, export socket_app
 app = socket_app
@@ -0,0 +1,60 @@
+"""Ordered graceful shutdown under one deadline, reporting what each step flushed or dropped."""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Recebe os segundos que restam do prazo; devolve o que foi entregue/descartado
+ShutdownStep = Tuple[str, Callable[[float], Awaitable[Optional[Dict[str, Any]]]]]
+
+
+class GracefulShutdown:
+    """Runs shutdown steps in order, all sharing `grace_seconds`.
+
+    `begin_drain()` flips `draining` (new sockets are refused and the health check
+    fails) and may be called ahead of the shutdown, e.g. from a preStop hook. Each
+    step is time-boxed to what is left of the deadline, but never less than
+    `floor_seconds`, so closing clients still happens after a slow flush. A step
+    that times out or fails is recorded and the sequence moves on.
+    """
+
+    def __init__(self, grace_seconds: float = 15.0, floor_seconds: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.grace_seconds = grace_seconds
+        self.floor_seconds = floor_seconds
+        self.clock = clock
+        self.draining = False
+        self.report: Optional[Dict[str, Any]] = None
+
+    def begin_drain(self) -> bool:
+        """True the first time (callers notify clients only once)"""
+        if self.draining:
+            return False
+        self.draining = True
+        return True
+
+    async def run(self, steps: Sequence[ShutdownStep]) -> Dict[str, Any]:
+        self.begin_drain()
+        started = self.clock()
+        deadline = started + self.grace_seconds
+        report: Dict[str, Any] = {"steps": {}}
+        for name, action in steps:
+            budget = max(deadline - self.clock(), self.floor_seconds)
+            step_started = self.clock()
+            entry: Dict[str, Any] = {}
+            try:
+                entry.update(await asyncio.wait_for(action(budget), timeout=budget) or {})
+            except asyncio.TimeoutError:
+                entry["timed_out"] = True
+                logger.warning(f"Shutdown step {name} timed out after {budget:.1f}s")
+            except Exception as e:
+                entry["error"] = f"{type(e).__name__}: {e}"
+                logger.warning(f"Shutdown step {name} failed: {e}")
+            entry["ms"] = round((self.clock() - step_started) * 1000, 1)
+            report["steps"][name] = entry
+        report["duration_ms"] = round((self.clock() - started) * 1000, 1)
+        report["within_deadline"] = self.clock() <= deadline
+        self.report = report
+        return report
@@ -0,0 +1,238 @@
+"""Slow Mongo command log grouped by query shape, with explain plans for the worst shapes."""
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Comandos com forma de consulta (e os que o explain aceita)
+SHAPED_COMMANDS = {
+    "find": ("filter", "sort", "projection"),
+    "aggregate": ("pipeline",),
+    "count": ("query",),
+    "distinct": ("key", "query"),
+    "findAndModify": ("query", "sort"),
+    "update": ("updates",),
+    "delete": ("deletes",),
+    "insert": (),
+}
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Campos de sessão/transação que o explain rejeita
+_SESSION_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "writeConcern", "readConcern"}
+
+
+def normalize(value: Any) -> Any:
+    """Replace literal values by "?" keeping field names, operators and nesting"""
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [normalize(item) for item in value]
+        if all(item == "?" for item in items):
+            return ["?"] if items else []
+        return items
+    return "?"
+
+
+def query_shape(command_name: str, command: Dict[str, Any]) -> Tuple[str, str]:
+    """(collection, canonical shape) of a command"""
+    collection = str(command.get(command_name))
+    shape: Dict[str, Any] = {"op": command_name}
+    for field in SHAPED_COMMANDS.get(command_name, ()):
+        if field not in command:
+            continue
+        value = command[field]
+        if field == "key":
+            shape[field] = value
+        elif field == "updates":
+            shape["q"] = [normalize(update.get("q", {})) for update in value[:1]]
+            shape["multi"] = bool(value[0].get("multi")) if value else False
+        elif field == "deletes":
+            shape["q"] = [normalize(delete.get("q", {})) for delete in value[:1]]
+        elif field == "projection":
+            shape[field] = sorted(value)
+        elif field == "sort":
+            shape[field] = dict(value)
+        else:
+            shape[field] = normalize(value)
+    return collection, json.dumps(shape, default=str)
+
+
+def explain_command(command_name: str, command: Dict[str, Any]) -> Dict[str, Any]:
+    """The original command without driver/session fields, ready to wrap in `explain`"""
+    return {key: value for key, value in command.items()
+            if not key.startswith("$") and key not in _SESSION_FIELDS}
+
+
+def plan_summary(explain: Dict[str, Any]) -> Dict[str, Any]:
+    """Stages of the winning plan, and whether it scans the whole collection"""
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        # aggregate: o plano do $cursor fica no primeiro estágio
+        for stage in explain.get("stages", []):
+            planner = stage.get("$cursor", {}).get("queryPlanner")
+            if planner:
+                break
+    stages, indexes = [], []
+    node = (planner or {}).get("winningPlan", {})
+    node = node.get("queryPlan", node)  # formato do SBE
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if not node:
+            continue
+        stages.append(node.get("stage"))
+        if node.get("indexName"):
+            indexes.append(node["indexName"])
+        pending.extend(node.get("inputStages", []))
+        pending.append(node.get("inputStage"))
+    return {"stages": stages, "indexes": indexes, "collscan": "COLLSCAN" in stages}
+
+
+class _ShapeStats:
+    __slots__ = ("database", "collection", "command_name", "shape", "count", "failed", "total_ms",
+                 "max_ms", "last_seen", "sample", "plan", "explained_at")
+
+    def __init__(self, database: str, collection: str, command_name: str, shape: str):
+        self.database = database
+        self.collection = collection
+        self.command_name = command_name
+        self.shape = shape
+        self.count = 0
+        self.failed = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_seen = 0.0
+        self.sample: Optional[Dict[str, Any]] = None
+        self.plan: Optional[Dict[str, Any]] = None
+        self.explained_at = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "database": self.database,
+            "collection": self.collection,
+            "command": self.command_name,
+            "shape": json.loads(self.shape),
+            "count": self.count,
+            "failed": self.failed,
+            "total_ms": round(self.total_ms, 1),
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "max_ms": round(self.max_ms, 1),
+            "last_seen": self.last_seen,
+            "plan": self.plan,
+        }
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    """pymongo command listener that keeps the commands slower than `threshold_ms`.
+
+    The driver calls listeners on whatever thread ran the command (Motor uses a
+    thread pool), so the callbacks only do dictionary work under a lock; the
+    explain plans are fetched later by `explain_slowest`, on the event loop. Only
+    the normalized shape is exposed, the last literal command is kept for explain.
+    """
+
+    def __init__(self, threshold_ms: float = 100.0, max_shapes: int = 500, clock=time.time):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self.clock = clock
+        self._started: Dict[Tuple[Any, int], Tuple[str, Dict[str, Any]]] = {}
+        self._shapes: Dict[Tuple[str, str, str], _ShapeStats] = {}
+        self._lock = threading.Lock()
+        self.stats = {"slow": 0, "dropped_shapes": 0, "explained": 0, "explain_errors": 0}
+
+    # Callbacks do driver
+    def started(self, event):
+        if event.command_name in SHAPED_COMMANDS:
+            with self._lock:
+                self._started[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finished(event, failed=False)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+    def _finished(self, event, failed: bool):
+        if event.command_name not in SHAPED_COMMANDS:
+            return
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+        elapsed_ms = event.duration_micros / 1000
+        if started is None or elapsed_ms < self.threshold_ms:
+            return
+        database, command = started
+        collection, shape = query_shape(event.command_name, command)
+        key = (database, collection, shape)
+        with self._lock:
+            entry = self._shapes.get(key)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    self.stats["dropped_shapes"] += 1
+                    return
+                entry = self._shapes[key] = _ShapeStats(database, collection, event.command_name, shape)
+            entry.count += 1
+            entry.failed += failed
+            entry.total_ms += elapsed_ms
+            entry.max_ms = max(entry.max_ms, elapsed_ms)
+            entry.last_seen = self.clock()
+            entry.sample = command
+            self.stats["slow"] += 1
+
+    def slowest(self, limit: int = 20, collection: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = [entry for entry in self._shapes.values() if collection in (None, entry.collection)]
+            entries.sort(key=lambda entry: entry.total_ms, reverse=True)
+            return [entry.snapshot() for entry in entries[:limit]]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            collscans = [
+                {"collection": entry.collection, "shape": json.loads(entry.shape), "count": entry.count}
+                for entry in self._shapes.values() if entry.plan and entry.plan.get("collscan")
+            ]
+            return {**self.stats, "threshold_ms": self.threshold_ms, "shapes": len(self._shapes),
+                    "collscans": collscans}
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+
+    async def explain_slowest(self, client, limit: int = 5, max_age: float = 600.0) -> int:
+        """Fetch `queryPlanner` explains for the `limit` slowest shapes without a recent plan"""
+        now = self.clock()
+        with self._lock:
+            entries = sorted(
+                (entry for entry in self._shapes.values()
+                 if entry.command_name in EXPLAINABLE and now - entry.explained_at > max_age),
+                key=lambda entry: entry.total_ms, reverse=True
+            )[:limit]
+            jobs = [(entry, entry.database, entry.command_name, entry.sample) for entry in entries]
+        explained = 0
+        for entry, database, command_name, command in jobs:
+            try:
+                result = await client[database].command(
+                    {"explain": explain_command(command_name, command), "verbosity": "queryPlanner"}
+                )
+                plan = plan_summary(result)
+            except Exception as e:
+                self.stats["explain_errors"] += 1
+                plan = {"error": str(e)}
+            with self._lock:
+                entry.plan = plan
+                entry.explained_at = now
+            explained += 1
+        self.stats["explained"] += explained
+        return explained
+
+    async def run_explain(self, client, interval: float = 60.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.explain_slowest(client)
+            except Exception as e:
+                logger.warning(f"Slow query explain failed: {e}")
@@ -0,0 +1,172 @@
+"""Streaming surge multipliers per cell and category from live demand and supply."""
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from demand_heatmap import CellKey, DemandHeatmap
+from geohash import encode
+
+logger = logging.getLogger(__name__)
+
+# Precisão 5: células de ~4,9 x 4,9 km
+SURGE_PRECISION = 5
+SURGE_CHANNEL = "surge_updates"
+# Mudança de oferta publicada no mesmo stream dos eventos de pedido, para todo worker contar igual
+SUPPLY_EVENT = "provider_supply"
+
+
+def supply_event(profile: Dict[str, Any], status: Optional[str] = None) -> Dict[str, Any]:
+    """Stream payload for a provider's supply slot (`status` overrides the profile's, e.g. offline on disconnect)"""
+    return {
+        "type": SUPPLY_EVENT,
+        "user_id": profile["user_id"],
+        "status": status or profile.get("status"),
+        "category": profile.get("category"),
+        "latitude": profile.get("latitude"),
+        "longitude": profile.get("longitude"),
+        "at": datetime.utcnow().isoformat(),
+    }
+
+
+class SurgePricing:
+    """Multiplier per (cell, category) from requests opened in a rolling window vs AVAILABLE providers.
+
+    Demand and supply both come from the shared request event stream: lifecycle
+    events feed a `DemandHeatmap` per cell and `provider_supply` events move
+    providers between cells, so every worker prices from the same counts. Every
+    change re-prices only the (cell, category) it touched; multipliers move in
+    `step` increments and only actual changes are handed to `publish`.
+    """
+
+    def __init__(self, publish: Callable[[str, Dict[str, Any]], Awaitable[Any]], window_seconds: int = 900,
+                 threshold: float = 1.0, sensitivity: float = 0.25, max_multiplier: float = 2.0,
+                 step: float = 0.1, precision: int = SURGE_PRECISION, clock: Callable[[], float] = time.time):
+        self.publish = publish
+        self.threshold = threshold
+        self.sensitivity = sensitivity
+        self.max_multiplier = max_multiplier
+        self.step = step
+        self.precision = precision
+        self.demand = DemandHeatmap(windows=(window_seconds,), precision=precision, clock=clock,
+                                    on_change=self._touched)
+        self.supply: Counter = Counter()
+        self._providers: Dict[str, CellKey] = {}
+        # Último `at` aplicado por prestador: evento atrasado/reentregue não desfaz um mais novo
+        self._supply_at: Dict[str, str] = {}
+        self._announced: Dict[str, Optional[CellKey]] = {}
+        self.multipliers: Dict[CellKey, float] = {}
+        self._changed: Dict[CellKey, None] = {}
+        self.stats = {"repriced": 0, "published": 0, "errors": 0, "supply_events": 0, "stale_supply": 0}
+
+    def key(self, latitude: float, longitude: float, category: str) -> CellKey:
+        return encode(latitude, longitude, self.precision), category
+
+    def multiplier_for(self, demand: int, supply: int) -> float:
+        ratio = demand / max(supply, 1)
+        raw = 1.0 + self.sensitivity * max(0.0, ratio - self.threshold)
+        return round(min(self.max_multiplier, round(raw / self.step) * self.step), 2)
+
+    def _touched(self, key: CellKey):
+        self.stats["repriced"] += 1
+        multiplier = self.multiplier_for(self.demand.count(key)[1], self.supply.get(key, 0))
+        if multiplier != self.multipliers.get(key, 1.0):
+            if multiplier == 1.0:
+                del self.multipliers[key]
+            else:
+                self.multipliers[key] = multiplier
+            self._changed[key] = None
+
+    def placement(self, profile: Dict[str, Any]) -> Optional[CellKey]:
+        """The (cell, category) a provider counts towards, None when it is not AVAILABLE"""
+        if profile.get("status") == "available" and profile.get("latitude") is not None:
+            return self.key(profile["latitude"], profile["longitude"], profile["category"])
+        return None
+
+    def announce(self, profile: Dict[str, Any], status: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Supply event to publish for this profile, or None when its slot did not move.
+
+        Location pings inside the same cell produce nothing. The slot is compared with
+        both the replicated view and what this worker announced last, since the view
+        only catches up once the stream delivers our own event back.
+        """
+        event = supply_event(profile, status)
+        placement = self.placement(event)
+        user_id = profile["user_id"]
+        if placement == self._providers.get(user_id) and placement == self._announced.get(user_id, placement):
+            return None
+        self._announced[user_id] = placement
+        return event
+
+    def seed_supply(self, profile: Dict[str, Any]):
+        """Startup snapshot from Mongo; providers already reported on the stream keep the newer state"""
+        if profile["user_id"] not in self._supply_at:
+            self.update_supply(profile)
+
+    def update_supply(self, profile: Dict[str, Any]):
+        """Provider profile changed: move its AVAILABLE slot between cells"""
+        user_id = profile["user_id"]
+        at = profile.get("at")
+        if at:
+            if at < self._supply_at.get(user_id, ""):
+                self.stats["stale_supply"] += 1
+                return
+            self._supply_at[user_id] = at
+        previous = self._providers.pop(user_id, None)
+        current = self.placement(profile)
+        if previous == current:
+            if current:
+                self._providers[user_id] = current
+            return
+        if previous:
+            self.supply[previous] -= 1
+            if self.supply[previous] <= 0:
+                del self.supply[previous]
+            self._touched(previous)
+        if current:
+            self.supply[current] += 1
+            self._providers[user_id] = current
+            self._touched(current)
+
+    def quote(self, latitude: float, longitude: float, category: str) -> float:
+        self.demand.advance()
+        return self.multipliers.get(self.key(latitude, longitude, category), 1.0)
+
+    async def flush(self):
+        """Publish the multipliers that changed since the last flush"""
+        changed, self._changed = list(self._changed), {}
+        for key in changed:
+            _, created = self.demand.count(key)
+            try:
+                await self.publish(SURGE_CHANNEL, {
+                    "cell": key[0],
+                    "category": key[1],
+                    "multiplier": self.multipliers.get(key, 1.0),
+                    "demand": created,
+                    "supply": self.supply.get(key, 0),
+                })
+                self.stats["published"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Could not publish surge update for {key}: {e}")
+
+    async def consume(self, source: AsyncIterator[Tuple[str, Dict[str, Any]]]):
+        async for _, event in source:
+            try:
+                if event.get("type") == SUPPLY_EVENT:
+                    self.stats["supply_events"] += 1
+                    self.update_supply(event)
+                else:
+                    self.demand.apply(event)
+            except Exception as e:
+                logger.warning(f"Could not apply surge event {event.get('event_id')}: {e}")
+            await self.flush()
+
+    async def run_decay(self, interval: float = 30.0):
+        """Windows expire without events: advance the clock periodically and publish the decay"""
+        while True:
+            await asyncio.sleep(interval)
+            self.demand.advance()
+            await self.flush()
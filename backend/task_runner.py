@@ -0,0 +1,107 @@
+"""Supervised runner for side effects that can happen after the HTTP response is sent."""
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _TaskStats:
+    def __init__(self, window: int = 512):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self.durations = deque(maxlen=window)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.durations)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2) if ordered else None
+
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+            "last_error": self.last_error,
+        }
+
+
+class BackgroundTaskRunner:
+    """Bounded queue drained by a fixed pool of workers.
+
+    `submit` never blocks the caller: when the queue is full the task is dropped and
+    counted. Failures are logged and recorded per task name instead of propagating.
+    """
+
+    def __init__(self, max_concurrency: int = 32, max_pending: int = 10000):
+        self.max_concurrency = max_concurrency
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._workers = []
+        self._stats = defaultdict(_TaskStats)
+
+    def submit(self, name: str, factory: Callable[[], Awaitable[Any]]) -> bool:
+        stats = self._stats[name]
+        stats.submitted += 1
+        try:
+            self._queue.put_nowait((name, factory))
+        except asyncio.QueueFull:
+            stats.dropped += 1
+            logger.warning(f"Background queue full, dropping task {name}")
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            name, factory = await self._queue.get()
+            stats = self._stats[name]
+            started = time.perf_counter()
+            try:
+                await factory()
+                stats.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                stats.failed += 1
+                stats.last_error = f"{type(e).__name__}: {e}"
+                logger.exception(f"Background task {name} failed")
+            finally:
+                stats.durations.append(time.perf_counter() - started)
+                self._queue.task_done()
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait for queued tasks to finish; False if the deadline was hit"""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "workers": len(self._workers),
+            "tasks": {name: stats.snapshot() for name, stats in self._stats.items()},
+        }
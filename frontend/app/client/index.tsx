@@ -68,6 +68,8 @@ export default function ClientScreen() {
 
   const fadeAnim = useRef(new Animated.Value(0)).current;
   const scaleAnim = useRef(new Animated.Value(0.9)).current;
+  // Mesma chave em todas as tentativas de uma solicitação: o backend não duplica o pedido
+  const requestKeyRef = useRef<string | null>(null);
 
   useEffect(() => {
     loadProviders();
@@ -166,6 +168,7 @@ export default function ClientScreen() {
   };
 
   const handleProviderSelect = (provider: Provider) => {
+    requestKeyRef.current = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
     setSelectedProvider(provider);
     setShowModal(true);
   };
@@ -184,7 +187,12 @@ export default function ClientScreen() {
         client_latitude: userLocation.latitude,
         client_longitude: userLocation.longitude,
         price: selectedProvider.price
-      }, { headers: { Authorization: `Bearer ${token}` } });
+      }, {
+        headers: {
+          Authorization: `Bearer ${token}`,
+          ...(requestKeyRef.current ? { 'Idempotency-Key': requestKeyRef.current } : {})
+        }
+      });
 
       setCurrentRequest({
         id: response.data.id,
@@ -215,7 +223,7 @@ export default function ClientScreen() {
         request_id: currentRequest.id,
         rating,
         comment: ratingComment
-      }, { headers: { Authorization: `Bearer ${token}` } });
+      }, { headers: { Authorization: `Bearer ${token}`, 'Idempotency-Key': `rating-${currentRequest.id}` } });
       Alert.alert('Obrigado!', 'Sua avaliação foi enviada com sucesso!');
       setShowRatingModal(false);
       setCurrentRequest(null);
@@ -260,10 +260,9 @@ export default function ProviderScreen() {
       allowsEditing: true,
       aspect: [4, 3],
       quality: 0.7,
-      base64: true,
     });
-    if (!result.canceled && result.assets[0].base64) {
-      setServicePhoto(`data:image/jpeg;base64,${result.assets[0].base64}`);
+    if (!result.canceled && result.assets[0].uri) {
+      setServicePhoto(result.assets[0].uri);
     }
   };
 
@@ -274,9 +273,15 @@ export default function ProviderScreen() {
       return;
     }
     try {
+      // Envia o arquivo (multipart) e conclui com a URL devolvida pelo servidor
+      const form = new FormData();
+      form.append('photo', { uri: servicePhoto, name: 'servico.jpg', type: 'image/jpeg' } as any);
+      const upload = await axios.post(`${API_BASE_URL}/requests/${activeRequest.id}/photo`, form, {
+        headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'multipart/form-data' }
+      });
       await axios.put(
         `${API_BASE_URL}/requests/${activeRequest.id}/update-status`,
-        { status: 'completed', photo_url: servicePhoto, message: serviceDescription || 'Serviço concluído' },
+        { status: 'completed', photo_url: upload.data.url, message: serviceDescription || 'Serviço concluído' },
         { headers: { Authorization: `Bearer ${token}` } }
       );
       Alert.alert('Sucesso!', 'Serviço concluído com sucesso!');
@@ -83,6 +83,26 @@ export const SocketProvider: React.FC<{ children: React.ReactNode }> = ({ childr
           setIsConnected(false);
         });
 
+        // O servidor agrupa eventos de alta frequência num único pacote 'batch'
+        // por sala (e, no connect, o que chegou enquanto estava offline, com
+        // 'queued_at'); cada item é repassado aos listeners do evento original
+        newSocket.on('batch', (messages: { event: string; data: any }[]) => {
+          messages.forEach(({ event, data }) => {
+            newSocket.listeners(event).forEach((listener) => listener(data));
+          });
+        });
+
+        // Deploy: o servidor vai encerrar e desconecta este socket; reconectar
+        // depois do atraso sorteado (o balanceador manda para outra instância)
+        newSocket.on('server_draining', (data: { reconnect_after_ms: number }) => {
+          console.log('🔄 [SOCKET] Servidor encerrando, reconectando em', data.reconnect_after_ms, 'ms');
+          setTimeout(() => {
+            if (!newSocket.connected) {
+              newSocket.connect();
+            }
+          }, data.reconnect_after_ms);
+        });
+
         // Event listeners específicos para o app
         newSocket.on('new_request', (data) => {
           console.log('🔔 [SOCKET] Nova solicitação recebida:', data);
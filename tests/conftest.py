@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Os módulos do backend são importados pelo nome (como o server.py faz)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,68 @@
+"""
+Provider -> active requests routing table, local and on Redis (fakeredis)
+"""
+
+import asyncio
+
+import fakeredis.aioredis
+
+from active_routes import ActiveRequestRoutes
+
+ACTIVE = ("accepted", "in_progress")
+
+
+def request(request_id, provider_id="p1", status="accepted"):
+    return {"id": request_id, "provider_id": provider_id, "client_id": f"c-{request_id}", "status": status,
+            "client_latitude": -23.55, "client_longitude": -46.63}
+
+
+async def follow_lifecycle(routes):
+    await routes.sync(request("r1"))
+    await routes.sync(request("r2"), "in_progress")
+    await routes.sync(request("r3", provider_id="p2"))
+    await routes.sync(request("r1"), "completed")
+    return (sorted(r["request_id"] for r in await routes.for_provider("p1")),
+            await routes.for_provider("p2"))
+
+
+def test_accept_and_completion_update_routes_locally_and_on_redis():
+    for routes in (ActiveRequestRoutes(ACTIVE), ActiveRequestRoutes(ACTIVE, fakeredis.aioredis.FakeRedis())):
+        p1, p2 = asyncio.run(follow_lifecycle(routes))
+        assert p1 == ["r2"]
+        assert p2 == [{"request_id": "r3", "client_id": "c-r3", "status": "accepted",
+                       "client_latitude": -23.55, "client_longitude": -46.63}]
+
+
+def test_rebuild_replaces_the_table():
+    async def scenario():
+        routes = ActiveRequestRoutes(ACTIVE, fakeredis.aioredis.FakeRedis())
+        await routes.sync(request("stale"))
+
+        async def active():
+            for doc in (request("r1"), request("r2", status="in_progress")):
+                yield doc
+
+        total = await routes.rebuild(active())
+        return total, sorted(r["request_id"] for r in await routes.for_provider("p1"))
+
+    assert asyncio.run(scenario()) == (2, ["r1", "r2"])
+
+
+def test_routes_keep_answering_while_another_worker_rebuilds():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        live, restarting = ActiveRequestRoutes(ACTIVE, redis), ActiveRequestRoutes(ACTIVE, redis)
+        await live.sync(request("r1"))
+        during = []
+
+        async def active():
+            yield request("r1")
+            # Ping de localização tratado por outro worker no meio do rebuild
+            during.extend(r["request_id"] for r in await live.for_provider("p1"))
+            yield request("r2")
+
+        await restarting.rebuild(active())
+        return during, sorted(r["request_id"] for r in await live.for_provider("p1")), \
+            sorted(key.decode() for key in await redis.keys("*"))
+
+    assert asyncio.run(scenario()) == (["r1"], ["r1", "r2"], ["routes:active:p1"])
@@ -0,0 +1,81 @@
+"""
+Analytics rollups fed by the local event bus (Mongo stand-in: mongomock-motor)
+"""
+
+import asyncio
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from analytics import REQUEST_EVENTS_CHANNEL, AnalyticsRollups, InMemoryEventBus
+from geohash import region_of
+
+
+def event(kind, event_id, price=80.0, at="2026-10-19T14:25:00"):
+    return {
+        "type": kind, "event_id": event_id, "request_id": "r1", "category": "Encanador",
+        "price": price, "client_latitude": -23.55, "client_longitude": -46.63, "at": at,
+    }
+
+
+def test_rollups_are_idempotent_per_event_id():
+    async def scenario():
+        db = AsyncMongoMockClient()["test"]
+        rollups = AnalyticsRollups(db.rollups, db.applied_events)
+        for e in [event("created", "e1"), event("created", "e1"), event("accepted", "e2"),
+                  event("completed", "e3"), event("completed", "e3"), event("status_changed", "e4")]:
+            await rollups.apply(e)
+        # Os ids ficam fora do documento da hora, que não cresce com o volume de eventos
+        stored = await db.rollups.find_one({})
+        assert set(stored) == {"_id", "hour", "category", "region", "created", "accepted", "completed", "revenue"}
+        assert await db.applied_events.count_documents({}) == 3
+        return await rollups.query(category="Encanador"), rollups.stats
+
+    rows, stats = asyncio.run(scenario())
+    assert rows == [{
+        "hour": datetime(2026, 10, 19, 14), "category": "Encanador", "region": region_of(-23.55, -46.63),
+        "created": 1, "accepted": 1, "completed": 1, "cancelled": 0, "revenue": 80.0,
+    }]
+    assert stats["duplicates"] == 2
+    assert stats["ignored"] == 1
+
+
+def test_consumer_reads_from_the_in_memory_bus():
+    async def scenario():
+        bus = InMemoryEventBus()
+        db = AsyncMongoMockClient()["test"]
+        rollups = AnalyticsRollups(db.rollups, db.applied_events)
+        consumer = asyncio.create_task(rollups.consume(bus.listen([REQUEST_EVENTS_CHANNEL])))
+        await asyncio.sleep(0)
+        bus.publish(REQUEST_EVENTS_CHANNEL, event("created", "e1", at="2026-10-19T14:00:00"))
+        bus.publish(REQUEST_EVENTS_CHANNEL, event("cancelled", "e2", at="2026-10-19T15:10:00"))
+        bus.publish("other_channel", event("created", "e3"))
+        for _ in range(20):
+            await asyncio.sleep(0)
+        consumer.cancel()
+        return await rollups.query(start=datetime(2026, 10, 19, 15))
+
+    rows = asyncio.run(scenario())
+    assert [(r["hour"].hour, r["created"], r["cancelled"]) for r in rows] == [(15, 0, 1)]
+
+
+def test_failed_rollup_write_releases_the_event_id_for_redelivery():
+    async def scenario():
+        db = AsyncMongoMockClient()["test"]
+        rollups = AnalyticsRollups(db.rollups, db.applied_events)
+        update_one = rollups.collection.update_one
+
+        async def failing_update(*args, **kwargs):
+            raise ConnectionError("mongo down")
+
+        rollups.collection.update_one = failing_update
+        try:
+            await rollups.apply(event("created", "e1"))
+        except ConnectionError:
+            pass
+        rollups.collection.update_one = update_one
+        return await rollups.apply(event("created", "e1")), await rollups.query()
+
+    applied, rows = asyncio.run(scenario())
+    assert applied is True
+    assert [r["created"] for r in rows] == [1]
@@ -0,0 +1,121 @@
+"""
+Request chat: group-committed writes, keyset history, coalesced read receipts and throttling
+"""
+
+import asyncio
+
+import mongomock_motor
+import pytest
+
+from chat import ChatBackpressure, ChatStore, Throttle
+
+
+def make_store(**kwargs):
+    db = mongomock_motor.AsyncMongoMockClient()["t"]
+    return ChatStore(db.chat_messages, db.chat_reads, **kwargs)
+
+
+def send(store, request_id, count, sender="c1"):
+    return [store.append(store.new_message(request_id, sender, 2, f"msg {i}")) for i in range(count)]
+
+
+def test_concurrent_messages_are_written_in_few_batches():
+    store = make_store(batch_size=500, flush_interval=0.01)
+
+    async def scenario():
+        store.start()
+        try:
+            await asyncio.gather(*send(store, "r1", 1200), *send(store, "r2", 300, sender="p1"))
+            return await store.messages.count_documents({}), await store.messages.count_documents({"request_id": "r2"})
+        finally:
+            await store.stop()
+
+    total, second_chat = asyncio.run(scenario())
+    assert (total, second_chat) == (1500, 300)
+    assert store.stats["messages"] == 1500
+    assert store.stats["batches"] <= 4
+    assert store.stats["max_batch"] == 500
+
+
+def test_history_pages_newest_first_by_cursor():
+    store = make_store(flush_interval=0)
+
+    async def scenario():
+        store.start()
+        try:
+            for i in range(120):
+                await store.append(store.new_message("r1", "c1", 2, f"msg {i}"))
+            await store.append(store.new_message("r2", "c1", 2, "other chat"))
+        finally:
+            await store.stop()
+        pages, cursor = [], None
+        while True:
+            page, cursor = await store.history("r1", before=cursor, limit=50)
+            pages.append([message["text"] for message in page])
+            if cursor is None:
+                return pages
+
+    pages = asyncio.run(scenario())
+    assert [len(page) for page in pages] == [50, 50, 20]
+    assert [text for page in pages for text in page] == [f"msg {i}" for i in reversed(range(120))]
+    with pytest.raises(ValueError):
+        asyncio.run(store.history("r1", before="not-an-id"))
+
+
+def test_read_receipts_only_move_forward_and_are_coalesced():
+    store = make_store()
+
+    async def scenario():
+        store.start()
+        try:
+            first, second, third = [await store.append(store.new_message("r1", "c1", 2, t)) for t in "abc"]
+            other = await store.append(store.new_message("r2", "c1", 2, "d"))
+        finally:
+            await store.stop()
+        ids = [str(m["_id"]) for m in (first, second, third)]
+        accepted = [await store.mark_read("r1", "p1", ids[1]), await store.mark_read("r1", "p1", ids[0]),
+                    await store.mark_read("r1", "p1", ids[2]), await store.mark_read("r1", "p1", "bogus"),
+                    # Mensagem de outro pedido (ou inexistente) não move a marca deste chat
+                    await store.mark_read("r1", "p1", str(other["_id"])),
+                    await store.mark_read("r2", "p1", ids[2])]
+        await store.flush()
+        # Depois de gravado, um recibo mais antigo não faz a marca voltar
+        await store.mark_read("r1", "p1", ids[0])
+        await store.flush()
+        return ids, accepted, await store.read_state("r1")
+
+    ids, accepted, reads = asyncio.run(scenario())
+    assert accepted == [True, False, True, False, False, False]
+    assert reads == {"p1": ids[2]}
+    assert store.stats["receipts"] == 2
+
+
+def test_failed_batch_is_reported_to_every_sender_and_backpressure_applies():
+    store = make_store(max_pending=2)
+
+    async def failing_insert(*args, **kwargs):
+        raise ConnectionError("mongo down")
+
+    store.messages.insert_many = failing_insert
+
+    async def scenario():
+        store.start()
+        try:
+            results = await asyncio.gather(*send(store, "r1", 3), return_exceptions=True)
+        finally:
+            await store.stop()
+        return [type(result) for result in results]
+
+    assert asyncio.run(scenario()) == [ConnectionError, ConnectionError, ChatBackpressure]
+    assert store.stats == {**store.stats, "failed": 2, "rejected": 1, "messages": 0}
+
+
+def test_throttle_allows_one_event_per_interval_per_key():
+    now = [0.0]
+    throttle = Throttle(2.0, clock=lambda: now[0])
+    assert throttle.allow(("u1", "r1"))
+    assert not throttle.allow(("u1", "r1"))
+    assert throttle.allow(("u2", "r1"))
+    now[0] = 2.5
+    assert throttle.allow(("u1", "r1"))
+    assert throttle.dropped == 1
@@ -0,0 +1,56 @@
+"""
+Version counters and ETag helpers behind conditional GETs
+"""
+
+import asyncio
+
+import fakeredis.aioredis
+
+from collection_versions import (
+    CollectionVersions,
+    etag_matches,
+    provider_cell,
+    provider_cells_in_radius,
+)
+
+
+def test_etag_changes_only_when_a_scope_is_bumped():
+    async def scenario():
+        versions = CollectionVersions()
+        first = await versions.etag(["requests:user:a"])
+        same = await versions.etag(["requests:user:a"])
+        await versions.bump("requests:user:b")
+        unrelated = await versions.etag(["requests:user:a"])
+        await versions.bump("requests:user:a")
+        return first, same, unrelated, await versions.etag(["requests:user:a"])
+
+    first, same, unrelated, bumped = asyncio.run(scenario())
+    assert first == same == unrelated
+    assert bumped != first
+
+
+def test_shared_counters_keep_the_epoch_of_the_first_worker():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        worker_a, worker_b = CollectionVersions(redis), CollectionVersions(redis)
+        await worker_a.init()
+        await worker_b.init()
+        await worker_a.bump("providers")
+        return await worker_a.etag(["providers"]), await worker_b.etag(["providers"])
+
+    etag_a, etag_b = asyncio.run(scenario())
+    assert etag_a == etag_b
+
+
+def test_if_none_match_parsing():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc", "def"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"abd"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+
+def test_radius_cells_cover_the_center_cell():
+    cells = provider_cells_in_radius(-23.55, -46.63, 5)
+    assert provider_cell(-23.55, -46.63) in cells
+    assert provider_cells_in_radius(-23.55, -46.63, 5000) is None
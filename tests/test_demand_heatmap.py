@@ -0,0 +1,61 @@
+"""
+Demand heatmap: pending counts, sliding-window decay and duplicate events
+"""
+
+from demand_heatmap import DemandHeatmap
+
+SAO_PAULO = (-23.5489, -46.6388)
+BBOX = (-24.0, -47.0, -23.0, -46.0)
+
+
+class Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def totals(heatmap, window=None, category=None):
+    cells = heatmap.cells(*BBOX, window=window, category=category)
+    return sum(c["pending"] for c in cells), sum(c["recent"] for c in cells)
+
+
+def test_windows_decay_as_time_passes():
+    clock = Clock()
+    heatmap = DemandHeatmap(windows=(600, 1800), bucket_seconds=60, clock=clock)
+    heatmap.record("r1", *SAO_PAULO, "Encanador")
+    clock.now += 300
+    heatmap.record("r2", *SAO_PAULO, "Pintor")
+    heatmap.resolve("r1")
+    assert totals(heatmap) == (1, 2)
+
+    clock.now += 400  # r1 saiu da janela de 10 min
+    assert totals(heatmap) == (1, 1)
+    assert totals(heatmap, window=1800) == (1, 2)
+    clock.now += 1800
+    assert totals(heatmap) == (1, 0) and totals(heatmap, window=1800) == (1, 0)
+    assert heatmap.cells(-10.0, -10.0, -9.0, -9.0) == []
+
+
+def test_events_are_idempotent_and_filtered_by_category():
+    clock = Clock()
+    heatmap = DemandHeatmap(windows=(600,), clock=clock)
+    created = {"type": "created", "request_id": "r1", "category": "Encanador", "status": "pending",
+               "client_latitude": SAO_PAULO[0], "client_longitude": SAO_PAULO[1]}
+    heatmap.apply(created)
+    heatmap.apply(created)
+    heatmap.apply({"type": "created", "request_id": "r2", "category": "Pintor", "status": "pending",
+                   "client_latitude": SAO_PAULO[0], "client_longitude": SAO_PAULO[1]})
+    assert totals(heatmap, category="Encanador") == (1, 1)
+    heatmap.apply({"type": "accepted", "request_id": "r1", "status": "accepted"})
+    heatmap.apply({"type": "accepted", "request_id": "r1", "status": "accepted"})
+    assert totals(heatmap) == (1, 2)
+
+
+def test_requests_older_than_every_window_only_count_while_pending():
+    clock = Clock()
+    heatmap = DemandHeatmap(windows=(600,), clock=clock)
+    heatmap.record("old", *SAO_PAULO, "Encanador", created_at=clock.now - 7200)
+    heatmap.record("old-done", *SAO_PAULO, "Encanador", created_at=clock.now - 7200, pending=False)
+    assert totals(heatmap) == (1, 0)
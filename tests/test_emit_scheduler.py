@@ -0,0 +1,79 @@
+"""
+Per-tick emit coalescing: superseded messages, empty rooms and batch packets
+"""
+
+import asyncio
+
+from emit_scheduler import BATCH_EVENT, EmitScheduler
+
+
+def test_one_packet_per_room_with_superseded_locations_dropped():
+    sent = []
+
+    async def emit(event, data, room):
+        sent.append((room, event, data))
+
+    async def scenario():
+        scheduler = EmitScheduler(emit, lambda room: room != "client_gone")
+        for i in range(5):
+            scheduler.queue("provider_location_update", {"request_id": "r1", "i": i}, "client_1", key="r1")
+        scheduler.queue("status_note", {"text": "a caminho"}, "client_1")
+        scheduler.queue("provider_location_update", {"request_id": "r2", "i": 9}, "request_r2", key="r2")
+        scheduler.queue("provider_location_update", {"request_id": "r3"}, "client_gone", key="r3")
+        packets = await scheduler.flush()
+        return packets, scheduler.stats
+
+    packets, stats = asyncio.run(scenario())
+    assert packets == 2
+    assert sorted(sent, key=lambda item: item[0]) == [
+        ("client_1", BATCH_EVENT, [
+            {"event": "provider_location_update", "data": {"request_id": "r1", "i": 4}},
+            {"event": "status_note", "data": {"text": "a caminho"}},
+        ]),
+        ("request_r2", "provider_location_update", {"request_id": "r2", "i": 9}),
+    ]
+    assert stats["superseded"] == 4 and stats["empty_rooms"] == 1
+
+
+def test_ticks_flush_in_the_background_and_stop_flushes_the_rest():
+    sent = []
+
+    async def emit(event, data, room):
+        sent.append(room)
+
+    async def scenario():
+        scheduler = EmitScheduler(emit, lambda room: True, tick=0.01)
+        scheduler.start()
+        scheduler.queue("location_updated", {}, "provider_1", key="p1")
+        await asyncio.sleep(0.05)
+        first = list(sent)
+        scheduler.queue("location_updated", {}, "provider_2", key="p2")
+        await scheduler.stop()
+        return first, scheduler.pending()
+
+    first, pending = asyncio.run(scenario())
+    assert first == ["provider_1"] and sent == ["provider_1", "provider_2"] and pending == 0
+
+
+def test_messages_for_empty_rooms_are_handed_over_with_their_keys():
+    held = []
+
+    async def emit(event, data, room):
+        pass
+
+    async def on_empty(messages):
+        held.extend(messages)
+
+    async def scenario():
+        scheduler = EmitScheduler(emit, lambda room: room == "client_1", on_empty=on_empty)
+        scheduler.queue("provider_location_update", {"i": 1}, "client_2", key="r2")
+        scheduler.queue("provider_location_update", {"i": 2}, "client_2", key="r2")
+        scheduler.queue("chat_unread", {"n": 1}, "provider_9")
+        scheduler.queue("provider_location_update", {"i": 3}, "client_1", key="r1")
+        await scheduler.flush()
+        return scheduler.stats
+
+    stats = asyncio.run(scenario())
+    assert held == [("client_2", "provider_location_update", {"i": 2}, "r2"),
+                    ("provider_9", "chat_unread", {"n": 1}, None)]
+    assert stats["held"] == 2 and stats["empty_rooms"] == 2
@@ -0,0 +1,101 @@
+"""
+Provider geo hot set against an in-memory Redis stand-in (fakeredis)
+"""
+
+import asyncio
+
+import fakeredis.aioredis
+
+from geo_index import ProviderGeoIndex
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _index():
+    return ProviderGeoIndex(fakeredis.aioredis.FakeRedis())
+
+
+def test_available_provider_is_found_by_geosearch():
+    async def scenario():
+        index = await _index()
+        await index.sync({"user_id": "p1", "category": "Encanador", "status": "available",
+                          "latitude": -23.5505, "longitude": -46.6333})
+        await index.sync({"user_id": "p2", "category": "Encanador", "status": "available",
+                          "latitude": -22.9068, "longitude": -43.1729})  # Rio, ~360 km
+        return await index.search(-23.5489, -46.6388, 10, "Encanador")
+
+    hits = run(scenario())
+    assert [user_id for user_id, _ in hits] == ["p1"]
+    assert hits[0][1] < 1
+
+
+def test_status_change_and_category_change_move_the_member():
+    async def scenario():
+        index = await _index()
+        base = {"user_id": "p1", "latitude": -23.55, "longitude": -46.63}
+        await index.sync({**base, "category": "Encanador", "status": "available"})
+        await index.sync({**base, "category": "Eletricista", "status": "available"})
+        moved = (await index.search(-23.55, -46.63, 5, "Encanador"),
+                 await index.search(-23.55, -46.63, 5, "Eletricista"))
+        await index.sync({**base, "category": "Eletricista", "status": "busy"})
+        return moved, await index.search(-23.55, -46.63, 5)
+
+    (old_category, new_category), after_busy = run(scenario())
+    assert old_category == []
+    assert [user_id for user_id, _ in new_category] == ["p1"]
+    assert after_busy == []
+
+
+def test_remove_without_category_and_search_across_categories():
+    async def scenario():
+        index = await _index()
+        await index.add("p1", "Encanador", -23.55, -46.63)
+        await index.add("p2", "Eletricista", -23.56, -46.64)
+        await index.remove("p1")
+        await index.remove("unknown")
+        return await index.search(-23.55, -46.63, 5)
+
+    assert [user_id for user_id, _ in run(scenario())] == ["p2"]
+
+
+def test_rebuild_replaces_stale_members():
+    async def profiles():
+        for profile in [
+            {"user_id": "p2", "category": "Borracheiro", "latitude": -23.55, "longitude": -46.63},
+            {"user_id": "p3", "category": "Borracheiro", "latitude": None, "longitude": None},
+        ]:
+            yield profile
+
+    async def scenario():
+        index = await _index()
+        await index.add("stale", "Encanador", -23.55, -46.63)
+        total = await index.rebuild(profiles())
+        return total, await index.search(-23.55, -46.63, 5), await index.categories()
+
+    total, hits, categories = run(scenario())
+    assert total == 1
+    assert [user_id for user_id, _ in hits] == ["p2"]
+    assert categories == ["Borracheiro"]
+
+
+def test_other_workers_keep_the_old_set_while_one_rebuilds():
+    async def scenario():
+        index = await _index()
+        await index.add("old", "Encanador", -23.55, -46.63)
+        during = []
+
+        async def profiles():
+            yield {"user_id": "new", "category": "Encanador", "latitude": -23.55, "longitude": -46.63}
+            # Outro worker consultando no meio do rebuild
+            during.extend(user_id for user_id, _ in await index.search(-23.55, -46.63, 5))
+
+        await index.rebuild(profiles())
+        keys = sorted(key.decode() for key in await index.redis.keys("*"))
+        return during, [user_id for user_id, _ in await index.search(-23.55, -46.63, 5)], keys
+
+    during, after, keys = run(scenario())
+    assert during == ["old"]
+    assert after == ["new"]
+    assert keys == ["providers:available:Encanador", "providers:available:categories", "providers:available:members"]
@@ -0,0 +1,34 @@
+"""
+Batched distance/bearing kernel against known distances
+"""
+
+import numpy as np
+
+from geo_kernel import bearing_deg, bounding_box_mask, with_distances, within_radius
+
+SAO_PAULO = (-23.5489, -46.6388)
+RIO = (-22.9068, -43.1729)
+
+
+def test_haversine_and_bearing():
+    lats, lons = np.array([RIO[0], SAO_PAULO[0]]), np.array([RIO[1], SAO_PAULO[1]])
+    indices, distances = within_radius(*SAO_PAULO, lats, lons)
+    assert indices.tolist() == [0, 1]
+    assert 355 < distances[0] < 362 and distances[1] == 0
+    north_east = bearing_deg(0.0, 0.0, np.array([1.0, 0.0]), np.array([0.0, 1.0]))
+    assert np.allclose(north_east, [0.0, 90.0])
+
+
+def test_radius_filter_matches_exact_distance_and_sorts():
+    points = [{"id": "rio", "latitude": RIO[0], "longitude": RIO[1]},
+              {"id": "far", "latitude": SAO_PAULO[0] + 0.05, "longitude": SAO_PAULO[1]},
+              {"id": "near", "latitude": SAO_PAULO[0] + 0.01, "longitude": SAO_PAULO[1]}]
+    found = with_distances(*SAO_PAULO, points, radius_km=10, nearest_first=True)
+    assert [p["id"] for p in found] == ["near", "far"]
+    assert abs(found[0]["distance"] - 1.11) < 0.01
+    assert with_distances(*SAO_PAULO, [], radius_km=10) == []
+
+
+def test_bounding_box_wraps_the_antimeridian():
+    mask = bounding_box_mask(0.0, 179.95, np.array([0.0, 0.0]), np.array([-179.95, 170.0]), 50)
+    assert mask.tolist() == [True, False]
@@ -0,0 +1,37 @@
+"""
+Geofence hysteresis for automatic NEAR_CLIENT transitions
+"""
+
+import pytest
+
+from geofence import Geofence
+
+
+def route(status="accepted"):
+    return {"request_id": "r1", "status": status}
+
+
+def test_enter_and_leave_with_hysteresis():
+    fence = Geofence(enter_radius_km=0.2, exit_radius_km=0.3)
+    assert fence.evaluate([route()], [0.25]) == []
+    assert fence.evaluate([route()], [0.19]) == [(route(), "near_client")]
+    # Enquanto a transição não foi gravada, nada é repetido
+    assert fence.evaluate([route()], [0.1]) == []
+    fence.settle("r1")
+
+    assert fence.evaluate([route("near_client")], [0.28]) == []
+    assert fence.evaluate([route("near_client")], [0.31]) == [(route("near_client"), "accepted")]
+
+
+def test_leaving_restores_the_previous_status():
+    fence = Geofence()
+    fence.evaluate([route("in_progress")], [0.05])
+    fence.settle("r1")
+    assert fence.evaluate([route("near_client")], [1.0])[0][1] == "in_progress"
+
+
+def test_other_statuses_are_ignored_and_radii_are_validated():
+    fence = Geofence()
+    assert fence.evaluate([route("started")], [0.0]) == []
+    with pytest.raises(ValueError):
+        Geofence(enter_radius_km=0.5, exit_radius_km=0.3)
@@ -0,0 +1,114 @@
+"""
+Idempotency-Key store: replay, concurrent retries, payload conflicts and failure release
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import mongomock_motor
+import pytest
+
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore, fingerprint
+
+
+def make_store(**kwargs):
+    return IdempotencyStore(mongomock_motor.AsyncMongoMockClient()["t"]["idempotency_keys"], **kwargs)
+
+
+def counting_handler(calls, result, delay=0.0):
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+    return handler
+
+
+def test_retry_replays_the_stored_response_without_running_again():
+    store = make_store()
+    calls = []
+
+    async def scenario():
+        payload = {"provider_id": "p1", "price": 80}
+        first = await store.run("requests", "u1", "k1", payload, counting_handler(calls, {"id": "r1"}))
+        retry = await store.run("requests", "u1", "k1", dict(reversed(list(payload.items()))),
+                                counting_handler(calls, {"id": "r2"}))
+        other_user = await store.run("requests", "u2", "k1", payload, counting_handler(calls, {"id": "r3"}))
+        return first, retry, other_user
+
+    first, retry, other_user = asyncio.run(scenario())
+    assert first == ({"id": "r1"}, False)
+    assert retry == ({"id": "r1"}, True)
+    assert other_user == ({"id": "r3"}, False)
+    assert len(calls) == 2
+    assert store.stats["replayed"] == 1
+
+
+def test_concurrent_requests_with_the_same_key_wait_for_the_first():
+    store = make_store()
+    calls = []
+
+    async def scenario():
+        return await asyncio.gather(*(
+            store.run("ratings", "u1", "k1", {"rating": 5}, counting_handler(calls, {"id": "x"}, delay=0.05))
+            for _ in range(5)
+        ))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert sorted(replayed for _, replayed in results) == [False, True, True, True, True]
+    assert all(result == {"id": "x"} for result, _ in results)
+
+
+def test_same_key_with_a_different_payload_is_rejected():
+    store = make_store()
+
+    async def scenario():
+        await store.run("ratings", "u1", "k1", {"rating": 5}, counting_handler([], {}))
+        await store.run("ratings", "u1", "k1", {"rating": 1}, counting_handler([], {}))
+
+    with pytest.raises(IdempotencyConflict):
+        asyncio.run(scenario())
+
+
+def test_failed_attempt_releases_the_key_and_waiters_redo_it():
+    store = make_store()
+    calls = []
+
+    async def failing():
+        calls.append("fail")
+        await asyncio.sleep(0.02)
+        raise RuntimeError("mongo down")
+
+    async def scenario():
+        first = asyncio.create_task(store.run("requests", "u1", "k1", {}, failing))
+        await asyncio.sleep(0)
+        retry = await store.run("requests", "u1", "k1", {}, counting_handler(calls, {"id": "r1"}))
+        with pytest.raises(RuntimeError):
+            await first
+        return retry
+
+    assert asyncio.run(scenario()) == ({"id": "r1"}, False)
+    assert calls == ["fail", 1]
+    assert store.stats["released"] == 1
+
+
+def test_expired_lease_is_taken_over_and_a_live_one_times_out():
+    store = make_store(wait_timeout=0.1, poll_interval=0.01)
+
+    async def scenario():
+        now = datetime.utcnow()
+        await store.collection.insert_many([
+            {"_id": "requests:u1:dead", "fingerprint": fingerprint({}), "state": "pending",
+             "created_at": now, "lease_until": now - timedelta(seconds=1)},
+            {"_id": "requests:u1:busy", "fingerprint": fingerprint({}), "state": "pending",
+             "created_at": now, "lease_until": now + timedelta(seconds=60)},
+        ])
+        taken = await store.run("requests", "u1", "dead", {}, counting_handler([], {"id": "r1"}))
+        with pytest.raises(IdempotencyInProgress):
+            await store.run("requests", "u1", "busy", {}, counting_handler([], {"id": "r2"}))
+        return taken, await store.collection.find_one({"_id": "requests:u1:dead"})
+
+    taken, stored = asyncio.run(scenario())
+    assert taken == ({"id": "r1"}, False)
+    assert stored["state"] == "done" and stored["response"] == {"id": "r1"}
+
@@ -0,0 +1,110 @@
+"""
+Latency-injecting stand-ins: distributions, errors, stalls and the client proxies
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fakeredis.aioredis
+import mongomock_motor
+import pytest
+
+from latency_fakes import FakeGeocoder, FakeKafkaProducer, LatencyDatabase, LatencyProfile, latency_redis
+
+
+def test_profile_is_log_normal_around_the_median_and_counts_stalls():
+    profile = LatencyProfile(median_ms=10, spread=0.5, stall_rate=0.01, stall_seconds=5, seed=7)
+    delays = sorted(profile.delay() for _ in range(5000))
+    assert 0.009 < delays[len(delays) // 2] < 0.011
+    assert delays[-1] == 5
+    assert profile.stats["calls"] == 5000
+    assert 20 < profile.stats["stalls"] < 80
+    assert LatencyProfile(median_ms=3, spread=0).delay() == pytest.approx(0.003)
+
+
+def test_mongo_proxy_delays_io_calls_and_keeps_cursor_chaining():
+    profile = LatencyProfile(median_ms=20, spread=0)
+    db = LatencyDatabase(mongomock_motor.AsyncMongoMockClient()["t"], profile)
+
+    async def scenario():
+        await db.users.insert_many([{"id": str(i), "n": i} for i in range(5)])
+        started = time.perf_counter()
+        found = await db["users"].find({"n": {"$gte": 2}}, {"_id": 0}).sort("n", -1).limit(2).to_list(None)
+        elapsed = time.perf_counter() - started
+        iterated = [doc["n"] async for doc in db.users.find({}, {"_id": 0})]
+        return found, elapsed, iterated, await db.users.count_documents({})
+
+    found, elapsed, iterated, count = asyncio.run(scenario())
+    assert [doc["n"] for doc in found] == [4, 3]
+    assert elapsed >= 0.02
+    assert iterated == [0, 1, 2, 3, 4]
+    assert count == 5
+    # insert_many, to_list, iteração, count_documents
+    assert profile.stats["calls"] == 4
+
+
+def test_redis_proxy_injects_errors_on_commands_and_pipelines():
+    profile = LatencyProfile(median_ms=0.1, error_rate=1.0, seed=1)
+    redis = latency_redis(fakeredis.aioredis.FakeRedis(), profile)
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await redis.publish("channel", "message")
+        pipe = redis.pipeline(transaction=False)
+        pipe.publish("channel", "a")
+        with pytest.raises(ConnectionError):
+            await pipe.execute()
+        profile.error_rate = 0.0
+        await redis.set("k", "v")
+        return await redis.get("k")
+
+    assert asyncio.run(scenario()) == b"v"
+    assert profile.stats == {"calls": 4, "errors": 2, "stalls": 0}
+
+
+def test_slow_kafka_shows_up_in_the_p99_of_send_and_wait():
+    async def p99(profile):
+        producer = FakeKafkaProducer(profile)
+        await producer.start()
+
+        async def timed(i):
+            started = time.perf_counter()
+            await producer.send_and_wait("request_events", f"{i}".encode())
+            return time.perf_counter() - started
+
+        durations = sorted(await asyncio.gather(*(timed(i) for i in range(100))))
+        assert len(producer.sent) == 100
+        return durations[98]
+
+    def injected_p99(**profile):
+        # Mesma semente, mesma sequência de atrasos: o p99 injetado não depende do relógio
+        replay = LatencyProfile(**profile)
+        return sorted(replay.delay() for _ in range(100))[98]
+
+    fast_profile = dict(median_ms=1, spread=0.3, seed=3)
+    slow_profile = dict(fast_profile, stall_rate=0.05, stall_seconds=0.2)
+    assert injected_p99(**fast_profile) < 0.01
+    assert injected_p99(**slow_profile) == 0.2
+    # Só limites inferiores no tempo medido: uma pausa do GC pode atrasar, nunca adiantar
+    assert asyncio.run(p99(LatencyProfile(**fast_profile))) >= injected_p99(**fast_profile)
+    assert asyncio.run(p99(LatencyProfile(**slow_profile))) >= 0.2
+
+
+def test_hung_geocoder_is_cut_by_a_timeout_and_the_caller_falls_back(monkeypatch):
+    import server
+
+    geocoder = FakeGeocoder(LatencyProfile(stall_rate=1.0, stall_seconds=0.5))
+    monkeypatch.setattr(server, "GEOCODE_TIMEOUT_SECONDS", 0.05)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        monkeypatch.setattr(server, "geocode_executor", executor)
+        monkeypatch.setattr(server, "gmaps", FakeGeocoder(LatencyProfile(median_ms=1)))
+        assert asyncio.run(server.get_address_from_coordinates(-23.5, -46.6)) == "Rua Simulada, -23.5000, -46.6000"
+
+        monkeypatch.setattr(server, "gmaps", geocoder)
+        started = time.perf_counter()
+        address = asyncio.run(server.get_address_from_coordinates(-23.5, -46.6))
+        waited = time.perf_counter() - started
+    assert address == "Lat: -23.5, Lng: -46.6"
+    assert geocoder.profile.stats["stalls"] == 1
+    assert waited < 0.5  # o endpoint não espera a thread presa
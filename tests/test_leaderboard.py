@@ -0,0 +1,85 @@
+"""
+Bayesian provider rankings in Redis sorted sets (fakeredis)
+"""
+
+import asyncio
+
+import fakeredis.aioredis
+
+from geohash import region_of
+from leaderboard import ProviderLeaderboard, bayesian_score
+
+
+def profile(user_id, rating, total, status="available", category="Eletricista", lat=-23.55, lon=-46.63):
+    return {"user_id": user_id, "category": category, "status": status, "rating": rating,
+            "total_ratings": total, "latitude": lat, "longitude": lon}
+
+
+def test_few_ratings_are_shrunk_towards_the_prior():
+    assert bayesian_score(5.0, 1) < bayesian_score(4.6, 200)
+    assert bayesian_score(0.0, 0) == 3.5
+
+
+def test_top_per_category_and_region():
+    async def scenario():
+        board = ProviderLeaderboard(fakeredis.aioredis.FakeRedis())
+        await board.sync(profile("a", 5.0, 1))
+        await board.sync(profile("b", 4.6, 200))
+        await board.sync(profile("c", 4.9, 50, lat=-22.90, lon=-43.17))  # Rio
+        await board.sync(profile("d", 5.0, 90, status="offline"))
+        return (await board.top("Eletricista"),
+                await board.top("Eletricista", region_of(-23.55, -46.63)))
+
+    everywhere, sao_paulo = asyncio.run(scenario())
+    assert [user_id for user_id, _ in everywhere] == ["c", "b", "a"]
+    assert [user_id for user_id, _ in sao_paulo] == ["b", "a"]
+
+
+def test_going_offline_or_moving_updates_the_placement():
+    async def scenario():
+        board = ProviderLeaderboard(fakeredis.aioredis.FakeRedis())
+        await board.sync(profile("a", 4.0, 10))
+        await board.sync(profile("a", 4.0, 10, lat=-22.90, lon=-43.17))
+        moved = await board.top("Eletricista", region_of(-23.55, -46.63))
+        await board.sync(profile("a", 4.0, 10, status="offline", lat=-22.90, lon=-43.17))
+        return moved, await board.top("Eletricista")
+
+    moved, after_offline = asyncio.run(scenario())
+    assert moved == []
+    assert after_offline == []
+
+
+def test_stored_rating_score_wins_over_the_rounded_rating():
+    # Média real 4.64 gravada como rating 4.6: a nota do perfil é a mesma do fallback no Mongo
+    stored = bayesian_score(4.64, 20)
+
+    async def scenario():
+        board = ProviderLeaderboard(fakeredis.aioredis.FakeRedis())
+        await board.sync({**profile("a", 4.6, 20), "rating_score": stored})
+        return await board.top("Eletricista")
+
+    assert asyncio.run(scenario()) == [("a", stored)]
+    assert stored != bayesian_score(4.6, 20)
+
+
+def test_rankings_stay_readable_while_another_worker_rebuilds():
+    async def scenario():
+        board = ProviderLeaderboard(fakeredis.aioredis.FakeRedis())
+        await board.sync(profile("old", 4.0, 10))
+        during = []
+
+        async def profiles():
+            yield profile("new", 4.8, 30)
+            during.extend(await board.top("Eletricista"))
+            yield profile("gone", 4.0, 10, status="offline")
+
+        total = await board.rebuild(profiles())
+        return total, during, [user_id for user_id, _ in await board.top("Eletricista")], \
+            sorted(key.decode() for key in await board.redis.keys("*"))
+
+    total, during, after, keys = asyncio.run(scenario())
+    assert total == 1
+    assert [user_id for user_id, _ in during] == ["old"]
+    assert after == ["new"]
+    region = region_of(-23.55, -46.63)
+    assert keys == sorted(["leaderboard:Eletricista:all", f"leaderboard:Eletricista:{region}", "leaderboard:members"])
@@ -0,0 +1,106 @@
+"""
+Queue-based JSON logging: output format, sampling, runtime levels and a full queue
+"""
+
+import io
+import json
+import logging
+
+import pytest
+
+from log_pipeline import LogPipeline, SamplingFilter, parse_rates
+
+
+@pytest.fixture(autouse=True)
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_records_are_written_as_json_by_the_listener_thread():
+    stream = io.StringIO()
+    pipeline = LogPipeline(level="INFO", stream=stream).install()
+    try:
+        log = logging.getLogger("test.pipeline")
+        log.info("Client %s connected", "s1", extra={"event": "socket_connect", "sid": "s1"})
+        log.debug("hidden")
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            log.exception("Geocoding error")
+    finally:
+        pipeline.stop()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["msg"] for line in lines] == ["Client s1 connected", "Geocoding error"]
+    assert lines[0]["level"] == "INFO" and lines[0]["logger"] == "test.pipeline"
+    assert lines[0]["event"] == "socket_connect" and lines[0]["sid"] == "s1"
+    assert "RuntimeError: boom" in lines[1]["exc"]
+
+
+def test_runtime_levels_per_logger():
+    stream = io.StringIO()
+    pipeline = LogPipeline(level="INFO", levels={"engineio.server": "WARNING"}, stream=stream).install()
+    try:
+        logging.getLogger("engineio.server").info("Received packet PING")
+        pipeline.set_level("DEBUG", "engineio.server")
+        logging.getLogger("engineio.server").debug("Sending packet PONG")
+        pipeline.set_level("ERROR")
+        logging.getLogger("test.pipeline").warning("muted")
+    finally:
+        pipeline.stop()
+    assert [json.loads(line)["msg"] for line in stream.getvalue().splitlines()] == ["Sending packet PONG"]
+    assert pipeline.status()["levels"]["engineio.server"] == "DEBUG"
+
+
+def test_sampling_by_event_then_logger_never_drops_warnings():
+    sampling = SamplingFilter(parse_rates("socket_connect=0, engineio.server=0"))
+
+    def record(name, level, event=None):
+        item = logging.LogRecord(name, level, __file__, 1, "msg", (), None)
+        if event:
+            item.event = event
+        return item
+
+    assert not sampling.filter(record("server", logging.INFO, "socket_connect"))
+    assert not sampling.filter(record("engineio.server", logging.INFO))
+    assert sampling.filter(record("server", logging.WARNING, "socket_connect"))
+    assert sampling.filter(record("server", logging.INFO, "request_created"))
+    assert sampling.sampled_out == 2
+
+    sampling.rates["socket_connect"] = 0.5
+    kept = [sampling.filter(record("server", logging.INFO, "socket_connect")) for _ in range(2000)]
+    assert 800 < sum(kept) < 1200
+
+
+def test_full_queue_drops_instead_of_blocking():
+    pipeline = LogPipeline(stream=io.StringIO(), max_queue=3)
+    log = logging.getLogger("test.pipeline.full")
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.addHandler(pipeline.handler)
+    try:
+        for i in range(10):
+            log.warning("line %d", i)
+    finally:
+        log.removeHandler(pipeline.handler)
+    assert pipeline.queue.qsize() == 3
+    assert pipeline.handler.dropped == 7
+
+
+def test_stop_flushes_the_queue_and_can_hand_off_to_a_direct_writer():
+    stream = io.StringIO()
+    pipeline = LogPipeline(level="INFO", stream=stream)
+    assert pipeline.install() is pipeline.install()
+    log = logging.getLogger("test.pipeline")
+    for i in range(50):
+        log.info("queued %d", i)
+    pipeline.stop(hand_off=True)
+    log.info("Shutdown complete")
+    lines = [json.loads(line)["msg"] for line in stream.getvalue().splitlines()]
+    assert lines[:50] == [f"queued {i}" for i in range(50)]
+    assert lines[50:] == ["Shutdown complete"]
+    assert logging.getLogger().handlers.count(pipeline.handler) == 0
@@ -0,0 +1,78 @@
+"""
+Outbox dispatcher against an in-memory Mongo stand-in (mongomock-motor)
+"""
+
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from outbox import LEASE_FREE, OutboxDispatcher, outbox_event
+
+
+def make_dispatcher(deliver, **kwargs):
+    collection = AsyncMongoMockClient()["test"]["outbox"]
+    return OutboxDispatcher(collection, deliver, **kwargs), collection
+
+
+def test_events_are_delivered_in_order_and_marked():
+    seen = []
+
+    async def deliver(events):
+        seen.extend(e["event"] for e in events)
+        return [e["_id"] for e in events]
+
+    async def scenario():
+        dispatcher, collection = make_dispatcher(deliver)
+        await dispatcher.enqueue([outbox_event("a", {}), outbox_event("b", {}, room="r")])
+        await dispatcher.dispatch_once()
+        return await collection.count_documents({"dispatched_at": None}), await dispatcher.dispatch_once()
+
+    pending, second_batch = asyncio.run(scenario())
+    assert seen == ["a", "b"]
+    assert pending == 0
+    assert second_batch == 0
+
+
+def test_failed_delivery_is_retried_after_the_lease_expires():
+    attempts = []
+
+    async def deliver(events):
+        attempts.append(len(events))
+        if len(attempts) == 1:
+            raise RuntimeError("broker down")
+        return [e["_id"] for e in events]
+
+    async def scenario():
+        dispatcher, collection = make_dispatcher(deliver, lease_seconds=0)
+        await dispatcher.enqueue([outbox_event("a", {})])
+        await dispatcher.dispatch_once()
+        await asyncio.sleep(0.005)  # datas são gravadas com precisão de milissegundos
+        await dispatcher.dispatch_once()
+        return await collection.find_one({})
+
+    event = asyncio.run(scenario())
+    assert attempts == [1, 1]
+    assert event["attempts"] == 2
+    assert event["dispatched_at"] is not None
+
+
+def test_already_delivered_ids_are_not_delivered_twice():
+    delivered = []
+
+    async def deliver(events):
+        delivered.extend(e["_id"] for e in events)
+        return [e["_id"] for e in events]
+
+    async def scenario():
+        dispatcher, collection = make_dispatcher(deliver)
+        event = outbox_event("a", {})
+        await dispatcher.enqueue([event])
+        await dispatcher.dispatch_once()
+        # Simula um crash entre a entrega e a marcação
+        await collection.update_one({"_id": event["_id"]}, {"$set": {"dispatched_at": None, "lease_until": LEASE_FREE}})
+        await dispatcher.dispatch_once()
+        return dispatcher.stats
+
+    stats = asyncio.run(scenario())
+    assert len(delivered) == 1
+    assert stats["duplicates_skipped"] == 1
@@ -0,0 +1,95 @@
+"""
+Store-and-forward of socket events for offline users: collapsing, bounds and claim/ack on connect
+"""
+
+import asyncio
+
+import mongomock_motor
+
+from pending_events import PendingEvents, is_personal_room
+
+
+def make_store(**kwargs):
+    return PendingEvents(mongomock_motor.AsyncMongoMockClient()["t"]["pending_events"], **kwargs)
+
+
+async def deliver(store, room):
+    token, held = await store.claim(room)
+    if token:
+        await store.ack(token)
+    return held
+
+
+def test_held_events_are_delivered_once_oldest_first_with_locations_collapsed():
+    store = make_store()
+
+    async def scenario():
+        await store.hold([("provider_p1", "new_request", {"request_id": "r1"}, None)])
+        for i in range(5):
+            await store.hold([("client_c1", "provider_location_update", {"request_id": "r1", "i": i}, "r1")])
+        await store.hold([
+            ("client_c1", "status_updated", {"request_id": "r1", "status": "near_client"}, None),
+            ("client_c1", "provider_location_update", {"request_id": "r2", "i": 0}, "r2"),
+            ("request_r1", "provider_location_update", {"request_id": "r1"}, "r1"),
+        ])
+        return await deliver(store, "client_c1"), await deliver(store, "client_c1"), await deliver(store, "provider_p1")
+
+    client, again, provider = asyncio.run(scenario())
+    assert [(item["event"], item["data"]) for item in client] == [
+        ("provider_location_update", {"request_id": "r1", "i": 4}),
+        ("status_updated", {"request_id": "r1", "status": "near_client"}),
+        ("provider_location_update", {"request_id": "r2", "i": 0}),
+    ]
+    assert all("queued_at" in item for item in client)
+    assert again == []
+    assert [item["event"] for item in provider] == ["new_request"]
+    assert store.stats["collapsed"] == 4
+    assert store.stats["delivered"] == 4
+
+
+def test_each_room_keeps_only_its_newest_events():
+    store = make_store(max_per_room=3)
+
+    async def scenario():
+        await store.hold([("provider_p1", "new_request", {"n": i}, None) for i in range(5)])
+        await store.hold([("provider_p1", "new_request", {"n": 5}, None)])
+        return await deliver(store, "provider_p1")
+
+    assert [item["data"]["n"] for item in asyncio.run(scenario())] == [3, 4, 5]
+    assert store.stats["trimmed"] == 3
+
+
+def test_concurrent_claims_deliver_each_event_once():
+    store = make_store()
+
+    async def scenario():
+        await store.hold([("client_c1", "request_accepted", {"n": i}, None) for i in range(20)])
+        return await asyncio.gather(*(deliver(store, "client_c1") for _ in range(4)))
+
+    drains = asyncio.run(scenario())
+    assert sorted(item["data"]["n"] for drained in drains for item in drained) == list(range(20))
+
+
+def test_released_or_abandoned_claims_are_delivered_again():
+    store = make_store(claim_seconds=0)
+
+    async def scenario():
+        await store.hold([("client_c1", "request_accepted", {"n": 1}, None)])
+        token, held = await store.claim("client_c1")
+        await store.release(token)  # o emit falhou
+        retried = await deliver(store, "client_c1")
+        await store.hold([("client_c1", "request_accepted", {"n": 2}, None)])
+        await store.claim("client_c1")  # worker morreu sem ack: claim expira (claim_seconds=0)
+        await asyncio.sleep(0.002)
+        return held, retried, await deliver(store, "client_c1"), await store.collection.count_documents({})
+
+    held, retried, abandoned, left = asyncio.run(scenario())
+    assert [item["data"] for item in held] == [item["data"] for item in retried] == [{"n": 1}]
+    assert [item["data"] for item in abandoned] == [{"n": 2}]
+    assert left == 0
+    assert store.stats["released"] == 1
+
+
+def test_only_personal_rooms_are_held():
+    assert is_personal_room("client_1") and is_personal_room("provider_1")
+    assert not is_personal_room("request_1") and not is_personal_room(None)
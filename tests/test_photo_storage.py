@@ -0,0 +1,132 @@
+"""
+Photo uploads: streaming multipart parsing, content-addressed storage and thumbnails
+"""
+
+import asyncio
+import hashlib
+import io
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from photo_storage import (InvalidUpload, PhotoStore, UnsupportedImage, UploadTooLarge, drain, multipart_boundary,
+                           stream_file_part)
+
+BOUNDARY = b"----form7MA4YWxkTrZu0gW"
+JPEG = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 40
+
+
+def multipart(photo: bytes, field: str = "photo") -> bytes:
+    return (
+        b"--" + BOUNDARY + b"\r\nContent-Disposition: form-data; name=\"note\"\r\n\r\nfeito\r\n"
+        b"--" + BOUNDARY + b"\r\nContent-Disposition: form-data; name=\"" + field.encode() +
+        b"\"; filename=\"a.jpg\"\r\nContent-Type: image/jpeg\r\n\r\n" + photo +
+        b"\r\n--" + BOUNDARY + b"--\r\n"
+    )
+
+
+async def chunked(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+async def collect(parts):
+    return b"".join([part async for part in parts])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 65536])
+def test_file_part_is_extracted_across_any_chunking(chunk_size):
+    body = multipart(JPEG + b"\r\n--" + BOUNDARY[:-1] + b"\r\n")  # quase-delimitador dentro do arquivo
+    assert asyncio.run(collect(stream_file_part(chunked(body, chunk_size), BOUNDARY, "photo"))) \
+        == JPEG + b"\r\n--" + BOUNDARY[:-1] + b"\r\n"
+
+
+def test_missing_or_truncated_parts_are_invalid():
+    with pytest.raises(InvalidUpload):
+        asyncio.run(collect(stream_file_part(chunked(multipart(JPEG, field="other"), 100), BOUNDARY, "photo")))
+    with pytest.raises(InvalidUpload):
+        asyncio.run(collect(stream_file_part(chunked(multipart(JPEG)[:-200], 100), BOUNDARY, "photo")))
+    with pytest.raises(InvalidUpload):
+        multipart_boundary("application/json")
+    assert multipart_boundary(f'multipart/form-data; boundary="{BOUNDARY.decode()}"') == BOUNDARY
+
+
+def test_identical_photos_are_stored_once_under_their_digest(tmp_path):
+    store = PhotoStore(tmp_path, thumbnail_sizes=())
+
+    async def upload(photo):
+        return await store.save(stream_file_part(chunked(multipart(photo), 1000), BOUNDARY, "photo"))
+
+    first = asyncio.run(upload(JPEG))
+    again = asyncio.run(upload(JPEG))
+    digest = hashlib.sha256(JPEG).hexdigest()
+    assert first["url"] == again["url"] == f"/media/photos/{digest[:2]}/{digest}.jpg"
+    assert (first["deduplicated"], again["deduplicated"]) == (False, True)
+    assert (tmp_path / digest[:2] / f"{digest}.jpg").read_bytes() == JPEG
+    assert list((tmp_path / "tmp").iterdir()) == []
+    assert store.stats["stored"] == 1 and store.stats["deduplicated"] == 1
+
+
+def test_non_images_and_oversized_uploads_are_rejected_without_leftovers(tmp_path):
+    store = PhotoStore(tmp_path, max_bytes=len(JPEG) - 1, thumbnail_sizes=())
+
+    async def upload(photo):
+        return await store.save(stream_file_part(chunked(multipart(photo), 512), BOUNDARY, "photo"))
+
+    with pytest.raises(UnsupportedImage):
+        asyncio.run(upload(b"%PDF-1.7" + b"x" * 100))
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(upload(JPEG))
+    assert store.stats["rejected"] == 2
+    assert list((tmp_path / "tmp").iterdir()) == []
+
+
+def test_memory_stays_flat_for_large_uploads(tmp_path):
+    store = PhotoStore(tmp_path, max_bytes=64 * 1024 * 1024, thumbnail_sizes=())
+
+    async def body():
+        yield b"--" + BOUNDARY + b"\r\nContent-Disposition: form-data; name=\"photo\"\r\n\r\n" + JPEG[:4]
+        block = b"\x00" * 65536
+        for _ in range(512):  # 32 MB
+            yield block
+        yield b"\r\n--" + BOUNDARY + b"--\r\n"
+
+    tracemalloc.start()
+    try:
+        photo = asyncio.run(store.save(stream_file_part(body(), BOUNDARY, "photo")))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert photo["size"] == 32 * 1024 * 1024 + 4
+    assert peak < 4 * 1024 * 1024
+
+
+def test_thumbnails_are_rendered_in_a_process_pool(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.new("RGB", (1600, 1200), (200, 40, 40)).save(buffer, "JPEG")
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        store = PhotoStore(tmp_path, thumbnail_sizes=(512, 128), executor=executor)
+        photo = asyncio.run(store.save(stream_file_part(chunked(multipart(buffer.getvalue()), 4096),
+                                                        BOUNDARY, "photo")))
+
+    digest = photo["sha256"]
+    assert photo["thumbnails"] == {size: f"/media/photos/{digest[:2]}/{digest}_{size}.jpg" for size in ("512", "128")}
+    with Image.open(tmp_path / digest[:2] / f"{digest}_128.jpg") as thumbnail:
+        assert thumbnail.size == (128, 96)
+
+
+def test_rejected_upload_leaves_a_tail_that_drain_discards(tmp_path):
+    store = PhotoStore(tmp_path, thumbnail_sizes=())
+
+    async def scenario(limit):
+        chunks = chunked(multipart(b"%PDF-1.7" + b"x" * 20000), 512)
+        with pytest.raises(UnsupportedImage):
+            await store.save(stream_file_part(chunks, BOUNDARY, "photo"))
+        return await drain(chunks, limit), [chunk async for chunk in chunks]
+
+    assert asyncio.run(scenario(limit=64 * 1024)) == (True, [])
+    drained, rest = asyncio.run(scenario(limit=1024))
+    assert drained is False and rest  # acima do limite: para de ler e a conexão deve fechar
@@ -0,0 +1,119 @@
+"""
+Sampling profiler outputs, per-route sampling and the blocked-loop watchdog
+"""
+
+import asyncio
+import threading
+import time
+
+from profiler import (LoopMonitor, RouteProfiler, RouteProfilerMiddleware, StackSampler, collapsed, profile_for,
+                      speedscope)
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_profile_for_samples_the_loop_in_collapsed_and_speedscope_formats():
+    async def hot_path():
+        await asyncio.sleep(0)
+        busy_wait(0.15)
+
+    async def scenario():
+        task = asyncio.create_task(hot_path())
+        counts = await profile_for(0.2, interval=0.002)
+        await task
+        return counts
+
+    counts = asyncio.run(scenario())
+    text = collapsed(counts)
+    assert "busy_wait (test_profiler.py:" in text
+    line = next(row for row in text.splitlines() if "busy_wait" in row)
+    assert ";" in line and int(line.rsplit(" ", 1)[1]) > 0
+
+    profile = speedscope(counts, "loop", 0.002)
+    frames = profile["shared"]["frames"]
+    sampled = profile["profiles"][0]
+    assert sampled["type"] == "sampled"
+    assert len(sampled["samples"]) == len(sampled["weights"]) == len(counts)
+    assert any(frames[i]["name"] == "busy_wait" for sample in sampled["samples"] for i in sample)
+    assert sampled["endValue"] == round(sum(sampled["weights"]), 3)
+
+
+def test_route_profiler_keeps_only_samples_of_the_chosen_requests():
+    async def app(scope, receive, send):
+        if scope["path"].startswith("/api/slow"):
+            busy_wait(0.05)
+        else:
+            await asyncio.sleep(0.05)
+
+    async def other_route():
+        for _ in range(5):
+            await asyncio.sleep(0)
+            busy_wait(0.01)
+
+    async def scenario():
+        profiler = RouteProfiler(interval=0.002)
+        profiler.enable("/api/slow/*", fraction=1.0, max_requests=2)
+        middleware = RouteProfilerMiddleware(app, profiler)
+        noise = asyncio.create_task(other_route())
+        for _ in range(3):
+            await middleware({"type": "http", "path": "/api/slow/1"}, None, None)
+        await middleware({"type": "http", "path": "/api/fast"}, None, None)
+        await noise
+        status = profiler.status()
+        text = collapsed(profiler.results("/api/slow/*"))
+        profiler.disable()
+        return status, text
+
+    status, text = asyncio.run(scenario())
+    target = status["targets"]["/api/slow/*"]
+    assert target["profiled"] == 2 and target["remaining"] == 0
+    assert target["samples"] > 0
+    assert "busy_wait" in text
+    assert "other_route" not in text
+
+
+def test_loop_monitor_captures_the_stack_of_a_blocking_call():
+    def blocking_io():
+        time.sleep(0.3)
+
+    async def scenario():
+        monitor = LoopMonitor(threshold=0.1, interval=0.02)
+        monitor.start()
+        await asyncio.sleep(0.1)
+        blocking_io()
+        await asyncio.sleep(0.1)
+        await monitor.stop()
+        return monitor.report()
+
+    report = asyncio.run(scenario())
+    assert not report["running"]
+    assert len(report["blocked"]) == 1
+    episode = report["blocked"][0]
+    assert any("blocking_io (test_profiler.py:" in frame for frame in episode["stack"])
+    assert episode["lag_ms"] >= 250
+    assert report["lag_ms"]["max"] >= 250
+
+
+def test_reading_a_live_sampler_gets_a_copy_not_the_counter_it_mutates():
+    worker_done = threading.Event()
+    worker = threading.Thread(target=lambda: worker_done.wait(2))
+    worker.start()
+    sampler = StackSampler(worker.ident, interval=0.0005)
+    sampler.start()
+    try:
+        for _ in range(200):
+            # Iterar a cópia enquanto a thread amostra não levanta "changed size during iteration"
+            collapsed(sampler.snapshot("all"))
+        time.sleep(0.02)
+        first = sampler.snapshot("all")
+        first[("x", "y.py", 1)] += 1
+        assert ("x", "y.py", 1) not in sampler.snapshot("all")
+    finally:
+        sampler.stop()
+        worker_done.set()
+        worker.join()
+    assert sum(sampler.snapshot("all").values()) == sampler.samples > 0
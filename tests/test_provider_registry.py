@@ -0,0 +1,66 @@
+"""
+Columnar provider registry: slot reuse, O(1) updates, snapshots and memory budget
+"""
+
+import uuid
+
+from provider_registry import ProviderRegistry
+
+SAO_PAULO = (-23.5489, -46.6388)
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+def test_upsert_update_and_remove_reuse_slots():
+    registry = ProviderRegistry(capacity=16)
+    a, b = new_id(), new_id()
+    registry.upsert(a, "Encanador", "available", *SAO_PAULO, price=80.0, rating=4.5)
+    registry.upsert(b, "Pintor", "busy", *SAO_PAULO)
+    assert registry.get(a)["category"] == "Encanador" and registry.get(a)["price"] == 80.0
+
+    registry.update_location(a, -23.56, -46.64)
+    assert abs(registry.get(a)["latitude"] + 23.56) < 1e-5
+    slot = registry.slot_of(a)
+    assert registry.remove(a) and registry.get(a) is None and len(registry) == 1
+    c = new_id()
+    registry.upsert(c, "Encanador", "available", *SAO_PAULO)
+    assert registry.slot_of(c) == slot
+    assert registry.remove("not-a-uuid") is False
+
+
+def test_grows_past_capacity_and_keeps_lookups():
+    registry = ProviderRegistry(capacity=16)
+    ids = [new_id() for _ in range(500)]
+    for i, user_id in enumerate(ids):
+        registry.upsert(user_id, f"cat{i % 7}", "available", SAO_PAULO[0], SAO_PAULO[1] + i * 1e-4)
+    for user_id in ids[::2]:
+        registry.remove(user_id)
+    assert len(registry) == 250
+    assert all(registry.get(user_id) for user_id in ids[1::2])
+    assert not any(registry.get(user_id) for user_id in ids[::2])
+
+
+def test_snapshot_is_immutable_and_filters_nearby():
+    registry = ProviderRegistry()
+    near, far, busy = new_id(), new_id(), new_id()
+    registry.sync({"user_id": near, "category": "Encanador", "status": "available",
+                   "latitude": SAO_PAULO[0] + 0.01, "longitude": SAO_PAULO[1]})
+    registry.sync({"user_id": far, "category": "Encanador", "status": "available",
+                   "latitude": -22.90, "longitude": -43.17})
+    registry.sync({"user_id": busy, "category": "Encanador", "status": "busy",
+                   "latitude": SAO_PAULO[0], "longitude": SAO_PAULO[1]})
+    snapshot = registry.snapshot()
+    assert registry.snapshot() is snapshot
+
+    registry.sync({"user_id": near, "status": "offline"})
+    hits = snapshot.nearby(*SAO_PAULO, radius_km=10, category="Encanador")
+    assert [user_id for user_id, _ in hits] == [near] and abs(hits[0][1] - 1.11) < 0.01
+    assert registry.snapshot().nearby(*SAO_PAULO, radius_km=10) == []
+    assert registry.snapshot().nearby(*SAO_PAULO, radius_km=500, category="Encanador")[0][0] == far
+
+
+def test_memory_per_provider_stays_under_64_bytes():
+    registry = ProviderRegistry(capacity=1 << 20)
+    assert registry.nbytes() / registry.capacity < 64
@@ -0,0 +1,100 @@
+"""
+Request archival (hot -> archive in batches) and history pagination across both tiers
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import mongomock_motor
+import pytest
+
+from request_archive import RequestArchiver, decode_cursor, history_page
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def make_tiers():
+    db = mongomock_motor.AsyncMongoMockClient()["t"]
+    return db.service_requests, db.service_requests_archive
+
+
+def request(i, status="completed", age_days=60, client_id="c1"):
+    return {"id": f"r{i:03d}", "client_id": client_id, "provider_id": "p1", "status": status, "updated_seq": i,
+            "created_at": NOW - timedelta(days=age_days, minutes=i), "updated_at": NOW - timedelta(days=age_days)}
+
+
+def test_only_old_finished_requests_move_in_batches():
+    hot, archive = make_tiers()
+    notified = []
+
+    async def on_archived(requests):
+        notified.append(len(requests))
+
+    archiver = RequestArchiver(hot, archive, ["completed", "cancelled"], older_than_days=30,
+                               batch_size=4, pause=0, on_archived=on_archived)
+
+    async def scenario():
+        await hot.insert_many(
+            [request(i) for i in range(7)] + [request(7, status="cancelled"), request(8, status="pending"),
+                                               request(9, age_days=5)]
+        )
+        moved = await archiver.archive_once(now=NOW)
+        again = await archiver.archive_once(now=NOW)
+        return moved, again, sorted(d["id"] for d in await hot.find({}).to_list(None)), \
+            await archive.count_documents({"archived_at": NOW})
+
+    moved, again, still_hot, archived = asyncio.run(scenario())
+    assert (moved, again) == (8, 0)
+    assert still_hot == ["r008", "r009"]
+    assert archived == 8
+    assert notified == [4, 4]
+
+
+def test_request_written_during_the_copy_stays_hot():
+    hot, archive = make_tiers()
+    archiver = RequestArchiver(hot, archive, ["completed"], older_than_days=30, pause=0)
+
+    async def scenario():
+        await hot.insert_many([request(1), request(2)])
+        original = archive.bulk_write
+
+        async def racing_bulk_write(*args, **kwargs):
+            result = await original(*args, **kwargs)
+            await hot.update_one({"id": "r002"}, {"$set": {"updated_seq": 99}})
+            return result
+
+        archive.bulk_write = racing_bulk_write
+        await archiver.archive_batch(now=NOW)
+        return [d["id"] for d in await hot.find({}).to_list(None)], [d["id"] for d in await archive.find({}).to_list(None)]
+
+    still_hot, archived = asyncio.run(scenario())
+    assert still_hot == ["r002"]
+    assert archived == ["r001"]
+    assert archiver.stats["raced"] == 1
+
+
+def test_history_pages_through_both_tiers_newest_first():
+    hot, archive = make_tiers()
+
+    async def scenario():
+        # Camadas intercaladas por created_at, um pedido duplicado (meio da movimentação) e outro cliente
+        await hot.insert_many([request(i, age_days=1 + 10 * (i % 2)) for i in range(0, 10)])
+        await archive.insert_many([request(i, age_days=40) for i in range(10, 15)] + [request(3, age_days=11)])
+        await archive.insert_one(request(50, client_id="c2"))
+        pages, cursor = [], None
+        while True:
+            page, cursor = await history_page([hot, archive], {"client_id": "c1"}, limit=4, before=cursor)
+            pages.append([doc["id"] for doc in page])
+            if cursor is None:
+                return pages
+
+    pages = asyncio.run(scenario())
+    flat = [request_id for page in pages for request_id in page]
+    assert [len(page) for page in pages] == [4, 4, 4, 3]
+    assert flat == ["r000", "r002", "r004", "r006", "r008", "r001", "r003", "r005", "r007", "r009",
+                    "r010", "r011", "r012", "r013", "r014"]
+
+
+def test_malformed_cursor_is_rejected():
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
@@ -0,0 +1,134 @@
+"""
+Delta sync of service requests: cursor, tombstones, lag window and counterpart enrichment
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import mongomock_motor
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+NOW = datetime.utcnow()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["t"]
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "REQUEST_CHANGES_LAG_SECONDS", 5)
+
+    async def seed():
+        await db.users.insert_many([
+            {"id": "c1", "name": "Ana", "email": "ana@x.com", "phone": "11", "user_type": 2},
+            {"id": "p1", "name": "Bruno", "email": "bruno@x.com", "phone": "22", "user_type": 1},
+        ])
+        await db.provider_profiles.insert_one({"user_id": "p1", "category": "Encanador"})
+
+    asyncio.run(seed())
+    return TestClient(server.app), db
+
+
+def auth(user_id):
+    return {"Authorization": f"Bearer {server.create_access_token({'sub': user_id})}"}
+
+
+def request_doc(request_id, seq, provider_id="p1", age=60):
+    return {"id": request_id, "client_id": "c1", "provider_id": provider_id, "status": "pending",
+            "updated_seq": seq, "created_at": NOW - timedelta(seconds=age, minutes=seq),
+            "updated_at": NOW - timedelta(seconds=age)}
+
+
+def changes(client, user_id, since=0, limit=200):
+    response = client.get("/api/requests/changes", params={"since": since, "limit": limit}, headers=auth(user_id))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_changes_and_tombstones_are_merged_by_sequence_and_paged(api):
+    client, db = api
+
+    async def seed():
+        await db.service_requests.insert_many([request_doc("r1", 1), request_doc("r3", 3)])
+        await db.service_requests_archive.insert_one(request_doc("r4", 4))
+        await db.service_request_tombstones.insert_one(
+            {"request_id": "r2", "user_ids": ["c1", "p1"], "deleted_seq": 2, "deleted_at": NOW - timedelta(seconds=60)}
+        )
+
+    asyncio.run(seed())
+    first = changes(client, "c1", limit=2)
+    assert [r["id"] for r in first["changes"]] == ["r1"]
+    assert first["tombstones"] == ["r2"]
+    assert (first["cursor"], first["has_more"]) == (2, True)
+    rest = changes(client, "c1", since=first["cursor"])
+    assert [r["id"] for r in rest["changes"]] == ["r3", "r4"]
+    assert (rest["cursor"], rest["has_more"]) == (4, False)
+    assert changes(client, "c1", since=4) == {"changes": [], "tombstones": [], "cursor": 4, "has_more": False}
+
+
+def test_tombstone_requests_records_the_removal_for_both_parties(api):
+    client, db = api
+
+    async def remove():
+        await db.counters.insert_one({"_id": "service_requests", "seq": 10})
+        await server.tombstone_requests([request_doc("r9", 7)])
+        await db.service_request_tombstones.update_many({}, {"$set": {"deleted_at": NOW - timedelta(seconds=60)}})
+
+    asyncio.run(remove())
+    for user_id in ("c1", "p1"):
+        assert changes(client, user_id, since=7) == {"changes": [], "tombstones": ["r9"], "cursor": 11, "has_more": False}
+
+
+def test_cursor_stops_before_writes_inside_the_lag_window(api):
+    client, db = api
+    # seq 2 foi reservado e ainda não tem commit; o 3 já está gravado
+    asyncio.run(db.service_requests.insert_many([request_doc("r1", 1), request_doc("r3", 3, age=0)]))
+    page = changes(client, "c1")
+    assert [r["id"] for r in page["changes"]] == ["r1", "r3"]
+    assert page["cursor"] == 1
+
+    asyncio.run(db.service_requests.insert_one(request_doc("r2", 2, age=0)))
+    assert [r["id"] for r in changes(client, "c1", since=page["cursor"])["changes"]] == ["r2", "r3"]
+
+
+def test_rows_are_enriched_and_kept_when_the_counterpart_is_missing(api):
+    client, db = api
+    asyncio.run(db.service_requests.insert_many([request_doc("r1", 1), request_doc("r2", 2, provider_id="gone")]))
+
+    rows = {r["id"]: r for r in changes(client, "c1")["changes"]}
+    assert (rows["r1"]["provider_name"], rows["r1"]["provider_phone"], rows["r1"]["provider_category"]) \
+        == ("Bruno", "22", "Encanador")
+    assert "provider_name" not in rows["r2"]
+
+    rows = changes(client, "p1")["changes"]
+    assert [(r["id"], r["client_name"], r["client_phone"]) for r in rows] == [("r1", "Ana", "11")]
+
+
+def test_request_listing_keeps_requests_whose_counterpart_is_gone(api):
+    client, db = api
+    asyncio.run(db.service_requests.insert_many([request_doc("r1", 1), request_doc("r2", 2, provider_id="gone")]))
+
+    response = client.get("/api/requests", headers=auth("c1"))
+    assert response.status_code == 200
+    rows = {r["id"]: r for r in response.json()}
+    assert set(rows) == {"r1", "r2"}
+    assert rows["r1"]["provider_name"] == "Bruno"
+    assert "provider_name" not in rows["r2"] and "provider_phone" not in rows["r2"]
+
+
+def test_request_listing_pages_through_archived_requests(api):
+    client, db = api
+
+    async def seed():
+        await db.service_requests.insert_many([request_doc("r1", 1), request_doc("r3", 3)])
+        await db.service_requests_archive.insert_one({**request_doc("r2", 2), "status": "completed"})
+
+    asyncio.run(seed())
+    first = client.get("/api/requests", params={"limit": 2}, headers=auth("c1"))
+    assert [r["id"] for r in first.json()] == ["r1", "r2"]
+    rest = client.get("/api/requests", params={"before": first.headers["X-Next-Cursor"]}, headers=auth("p1"))
+    assert [(r["id"], r["client_name"]) for r in rest.json()] == [("r3", "Ana")]
+    assert "X-Next-Cursor" not in rest.headers
+    assert client.get("/api/requests", params={"before": "nope"}, headers=auth("c1")).status_code == 400
@@ -0,0 +1,47 @@
+"""
+Provider full-text search index: accents, typos, prefixes and distance filter
+"""
+
+from search_index import ProviderSearchIndex, normalize
+
+
+def build():
+    index = ProviderSearchIndex()
+    index.upsert("a", "Encanador", "Conserto de vazamentos e pias", -23.55, -46.63)
+    index.upsert("b", "Eletricista", "Instalação elétrica residencial", -23.56, -46.64)
+    index.upsert("c", "Encanador", "Desentupimento de esgoto", -22.90, -43.17)  # Rio
+    return index
+
+
+def ids(hits):
+    return [doc_id for doc_id, _, _ in hits]
+
+
+def test_accents_are_ignored():
+    assert normalize("Instalação Elétrica") == "instalacao eletrica"
+    assert ids(build().search("eletrica")) == ["b"]
+    assert ids(build().search("PÍA")) == ["a"]
+
+
+def test_typos_and_prefixes_match():
+    index = build()
+    assert set(ids(index.search("encanadro"))) == {"a", "c"}
+    assert ids(index.search("eletric")) == ["b"]
+    assert index.search("marceneiro") == []
+
+
+def test_distance_and_category_filters():
+    index = build()
+    hits = index.search("encanador", latitude=-23.55, longitude=-46.63, radius_km=10)
+    assert ids(hits) == ["a"] and hits[0][2] < 1
+    assert ids(index.search("residencial", category="Encanador")) == []
+
+
+def test_updates_and_removals_are_incremental():
+    index = build()
+    index.update_location("c", -23.551, -46.631)
+    assert set(ids(index.search("encanador", latitude=-23.55, longitude=-46.63, radius_km=10))) == {"a", "c"}
+    index.upsert("a", "Pintor", "Pintura de paredes", -23.55, -46.63)
+    index.remove("c")
+    assert index.search("encanador") == []
+    assert ids(index.search("pintura")) == ["a"] and len(index) == 2
@@ -0,0 +1,62 @@
+"""
+Graceful shutdown: ordering, shared deadline, per-step reports
+"""
+
+import asyncio
+
+from shutdown import GracefulShutdown
+
+
+def test_steps_run_in_order_and_report_what_they_flushed():
+    calls = []
+
+    def step(name, result=None):
+        async def action(budget):
+            calls.append(name)
+            return result
+        return name, action
+
+    shutdown = GracefulShutdown(grace_seconds=5)
+    report = asyncio.run(shutdown.run([
+        step("sockets", {"notified": 3}),
+        step("outbox", {"delivered": 10, "left_pending": 0}),
+        step("mongo"),
+    ]))
+    assert calls == ["sockets", "outbox", "mongo"]
+    assert shutdown.draining
+    assert report["within_deadline"]
+    assert report["steps"]["sockets"]["notified"] == 3
+    assert report["steps"]["outbox"]["delivered"] == 10
+    assert set(report["steps"]["mongo"]) == {"ms"}
+
+
+def test_a_hung_step_uses_the_deadline_and_later_steps_still_close_clients():
+    budgets = {}
+
+    async def hung(budget):
+        budgets["kafka"] = budget
+        await asyncio.sleep(10)
+
+    async def broken(budget):
+        raise ConnectionError("redis gone")
+
+    async def close(budget):
+        budgets["mongo"] = budget
+        return {"closed": True}
+
+    shutdown = GracefulShutdown(grace_seconds=0.2, floor_seconds=0.05)
+    report = asyncio.run(shutdown.run([("kafka", hung), ("redis", broken), ("mongo", close)]))
+    assert budgets["kafka"] <= 0.2
+    assert report["steps"]["kafka"]["timed_out"]
+    assert report["steps"]["redis"]["error"] == "ConnectionError: redis gone"
+    # Prazo estourado: ainda recebe o piso para fechar
+    assert budgets["mongo"] == 0.05
+    assert report["steps"]["mongo"]["closed"]
+    assert not report["within_deadline"]
+
+
+def test_begin_drain_only_once():
+    shutdown = GracefulShutdown()
+    assert shutdown.begin_drain()
+    assert not shutdown.begin_drain()
+    assert shutdown.draining
@@ -0,0 +1,80 @@
+"""
+Slow Mongo command log: shapes, thresholds and explain capture
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from slow_queries import SlowQueryLog, plan_summary, query_shape
+
+
+def run_command(log, request_id, command_name, command, elapsed_ms, database="app", failed=False):
+    started = SimpleNamespace(command_name=command_name, command=command, database_name=database,
+                              connection_id=("db", 27017), request_id=request_id)
+    finished = SimpleNamespace(command_name=command_name, connection_id=("db", 27017),
+                               request_id=request_id, duration_micros=int(elapsed_ms * 1000))
+    log.started(started)
+    (log.failed if failed else log.succeeded)(finished)
+
+
+def test_shape_ignores_literals_but_keeps_fields_operators_and_sort():
+    a = query_shape("find", {"find": "service_requests", "filter": {"status": "pending", "created_at": {"$gte": 1}},
+                             "sort": {"created_at": -1}, "lsid": {"id": 1}})
+    b = query_shape("find", {"find": "service_requests", "filter": {"status": "accepted", "created_at": {"$gte": 99}},
+                             "sort": {"created_at": -1}})
+    c = query_shape("find", {"find": "service_requests", "filter": {"provider_id": "p1"}})
+    assert a == b
+    assert a[0] == "service_requests"
+    assert a != c
+    update = query_shape("update", {"update": "provider_profiles",
+                                    "updates": [{"q": {"user_id": "u1"}, "u": {"$set": {"latitude": 1}}}]})
+    assert '"q": [{"user_id": "?"}]' in update[1]
+
+
+def test_only_commands_over_the_threshold_are_grouped_by_shape():
+    log = SlowQueryLog(threshold_ms=50, clock=lambda: 1000.0)
+    run_command(log, 1, "find", {"find": "service_requests", "filter": {"status": "pending"}}, 120)
+    run_command(log, 2, "find", {"find": "service_requests", "filter": {"status": "accepted"}}, 80)
+    run_command(log, 3, "find", {"find": "service_requests", "filter": {"status": "pending"}}, 10)
+    run_command(log, 4, "find", {"find": "provider_profiles", "filter": {"user_id": "u1"}}, 60, failed=True)
+    run_command(log, 5, "hello", {"hello": 1}, 500)
+
+    slowest = log.slowest()
+    assert [(row["collection"], row["count"]) for row in slowest] == [("service_requests", 2), ("provider_profiles", 1)]
+    assert slowest[0]["shape"] == {"op": "find", "filter": {"status": "?"}}
+    assert slowest[0]["max_ms"] == 120.0 and slowest[0]["avg_ms"] == 100.0
+    assert slowest[1]["failed"] == 1
+    assert log.slowest(collection="provider_profiles")[0]["count"] == 1
+    assert log.summary()["slow"] == 3
+
+
+def test_explain_runs_for_the_slowest_shapes_and_flags_collection_scans():
+    commands = []
+
+    class FakeDatabase:
+        async def command(self, command):
+            commands.append(command)
+            return {"queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}}
+
+    log = SlowQueryLog(threshold_ms=50, clock=lambda: 1000.0)
+    run_command(log, 1, "find", {"find": "service_requests", "filter": {"status": "pending"}, "lsid": {"id": 1},
+                                 "$db": "app", "$clusterTime": {}}, 300)
+    run_command(log, 2, "insert", {"insert": "service_requests", "documents": [{}]}, 200)
+
+    explained = asyncio.run(log.explain_slowest({"app": FakeDatabase()}))
+    assert explained == 1
+    assert commands == [{"explain": {"find": "service_requests", "filter": {"status": "pending"}},
+                         "verbosity": "queryPlanner"}]
+    plan = log.slowest()[0]["plan"]
+    assert plan["collscan"] and plan["stages"] == ["SORT", "COLLSCAN"]
+    assert log.summary()["collscans"] == [
+        {"collection": "service_requests", "shape": {"op": "find", "filter": {"status": "?"}}, "count": 1}
+    ]
+    # Plano recente não é refeito
+    assert asyncio.run(log.explain_slowest({"app": FakeDatabase()})) == 0
+
+
+def test_plan_summary_reads_index_scans_and_aggregate_cursors():
+    plan = plan_summary({"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {
+        "stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "status_1"}}}}}]})
+    assert plan == {"stages": ["FETCH", "IXSCAN"], "indexes": ["status_1"], "collscan": False}
@@ -0,0 +1,106 @@
+"""
+Surge multipliers from rolling demand vs available supply
+"""
+
+import asyncio
+
+from surge_pricing import SURGE_CHANNEL, SurgePricing
+
+SAO_PAULO = (-23.5489, -46.6388)
+
+
+class Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def created(request_id, category="Encanador"):
+    return {"type": "created", "request_id": request_id, "category": category, "status": "pending",
+            "client_latitude": SAO_PAULO[0], "client_longitude": SAO_PAULO[1]}
+
+
+def provider(user_id, status="available", lat=SAO_PAULO[0], lon=SAO_PAULO[1]):
+    return {"user_id": user_id, "category": "Encanador", "status": status, "latitude": lat, "longitude": lon}
+
+
+def test_multiplier_follows_demand_supply_and_window_decay():
+    published = []
+
+    async def publish(channel, message):
+        published.append((channel, message["multiplier"]))
+
+    async def scenario():
+        clock = Clock()
+        surge = SurgePricing(publish, window_seconds=600, sensitivity=0.25, clock=clock)
+        surge.update_supply(provider("p1"))
+        for i in range(5):
+            surge.demand.apply(created(f"r{i}"))
+        surge.demand.apply(created("other", category="Pintor"))
+        await surge.flush()
+        quotes = [surge.quote(*SAO_PAULO, "Encanador"), surge.quote(*SAO_PAULO, "Pintor")]
+
+        surge.update_supply(provider("p2"))            # 5 pedidos / 2 prestadores
+        quotes.append(surge.quote(*SAO_PAULO, "Encanador"))
+        surge.update_supply(provider("p2", status="busy"))
+        surge.update_supply(provider("p1", lat=-22.90, lon=-43.17))  # foi para o Rio
+        quotes.append(surge.quote(*SAO_PAULO, "Encanador"))
+
+        clock.now += 700
+        surge.demand.advance()
+        await surge.flush()
+        quotes.append(surge.quote(*SAO_PAULO, "Encanador"))
+        return quotes
+
+    quotes = asyncio.run(scenario())
+    assert quotes == [2.0, 1.0, 1.4, 2.0, 1.0]
+    assert published[0] == (SURGE_CHANNEL, 2.0) and published[-1] == (SURGE_CHANNEL, 1.0)
+
+
+def test_multiplier_is_capped_and_quantized():
+    surge = SurgePricing(lambda channel, message: None, max_multiplier=1.5)
+    assert surge.multiplier_for(1, 1) == 1.0
+    assert surge.multiplier_for(3, 1) == 1.5
+    assert surge.multiplier_for(100, 0) == 1.5
+
+
+def test_supply_comes_from_the_shared_stream_on_every_worker():
+    async def stream(events):
+        for event in events:
+            yield "request_events", event
+
+    async def scenario():
+        publisher = SurgePricing(lambda channel, message: None)
+        announced = [publisher.announce(provider("p1"))]
+        publisher.update_supply(announced[0])          # o próprio evento voltou pelo stream
+        announced += [publisher.announce(provider("p1", lat=SAO_PAULO[0] + 0.001)),  # mesma célula
+                      publisher.announce(provider("p2"))]
+        offline = publisher.announce(provider("p2"), "offline")
+        stale = dict(announced[0], at="2000-01-01T00:00:00")
+        events = [e for e in announced if e] + [created(f"r{i}") for i in range(5)] + [offline, stale]
+
+        workers = [SurgePricing(lambda channel, message: None, sensitivity=0.25) for _ in range(2)]
+        workers[1].seed_supply(provider("p2"))         # snapshot do Mongo antes do disconnect
+        for worker in workers:
+            await worker.consume(stream(events))
+        workers[1].seed_supply(provider("p2"))         # snapshot atrasado não ressuscita o offline
+        return announced[1], offline["status"], [(sum(w.supply.values()), w.quote(*SAO_PAULO, "Encanador"))
+                                                  for w in workers], workers[0].stats["stale_supply"]
+
+    same_cell, offline_status, workers, stale = asyncio.run(scenario())
+    assert same_cell is None
+    assert offline_status == "offline"
+    assert workers == [(1, 2.0), (1, 2.0)]
+    assert stale == 1
+
+
+def test_announce_repeats_a_move_back_before_the_stream_catches_up():
+    surge = SurgePricing(lambda channel, message: None)
+    rio = provider("p1", lat=-22.90, lon=-43.17)
+    assert surge.announce(provider("p1")) is not None
+    assert surge.announce(rio) is not None
+    assert surge.announce(provider("p1")) is not None
+    surge.update_supply(surge.announce(rio))
+    assert surge.announce(rio) is None
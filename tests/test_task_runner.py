@@ -0,0 +1,47 @@
+"""
+Background side-effect runner: bounded queue, error capture and metrics
+"""
+
+import asyncio
+
+from task_runner import BackgroundTaskRunner
+
+
+def test_tasks_run_and_failures_are_recorded():
+    async def scenario():
+        runner = BackgroundTaskRunner(max_concurrency=2)
+        runner.start()
+        done = []
+
+        async def ok():
+            done.append(1)
+
+        async def boom():
+            raise ValueError("geocoder down")
+
+        runner.submit("ok", ok)
+        runner.submit("boom", boom)
+        assert await runner.drain(timeout=1)
+        await runner.stop()
+        return done, runner.metrics()
+
+    done, metrics = asyncio.run(scenario())
+    assert done == [1]
+    assert metrics["tasks"]["ok"]["completed"] == 1
+    assert metrics["tasks"]["boom"]["failed"] == 1
+    assert "geocoder down" in metrics["tasks"]["boom"]["last_error"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    async def scenario():
+        runner = BackgroundTaskRunner(max_concurrency=1, max_pending=1)
+
+        async def noop():
+            pass
+
+        accepted = [runner.submit("noop", noop) for _ in range(3)]
+        return accepted, runner.metrics()["tasks"]["noop"]["dropped"]
+
+    accepted, dropped = asyncio.run(scenario())
+    assert accepted == [True, False, False]
+    assert dropped == 2